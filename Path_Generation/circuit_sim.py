@@ -1,10 +1,15 @@
 import pdb
 import copy
 import math
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List
 from Path_Generation.pauli_operator import PauliOperator
 from Path_Generation.pauli_path_trav import PauliPathTrav
 from Path_Generation.xyz_generation import XYZGeneration
+from Path_Generation.path_cache import PathCache, trees_to_arrays, arrays_to_trees
+from Path_Generation.path_count import count_paths
+from Path_Generation.flat_trees import FlatTrees
+from Path_Generation.subtree_sharing import share_subtrees
 
 class CircuitSim:
     """
@@ -13,7 +18,8 @@ class CircuitSim:
     Also fills out a list of all list representations of legal Pauli paths given the circuit architecture
     and Hamming weight upper bound.
     """
-    def __init__(self, num_qubits:int, max_weight:int, gate_pos:List[List[tuple]]):
+    def __init__(self, num_qubits:int, max_weight:int, gate_pos:List[List[tuple]], path_cache:PathCache = None,
+                 lazy:bool = False, workers:int = 1, compiled_circuit = None):
 
         if not self.valid_gate_pos(num_qubits,gate_pos):
             print(gate_pos)
@@ -27,15 +33,45 @@ class CircuitSim:
         if self.max_weight < self.num_op_layers: # we cannot make a valid Pauli path
             raise ValueError
 
+        # Gate-aware mode: with the compiled circuit (a CompiledCircuit from Pauli_Amplitude.pauli_transfer),
+        # the trees skip every operator that the gates reach only through zero transfer matrix entries
+        if compiled_circuit is not None and len(compiled_circuit.layers) != len(gate_pos):
+            raise ValueError
+        self.compiled_circuit = compiled_circuit
+
         self.weight_combos = []
         # Fills out self.weight_combos with all weight configurations of legal Pauli paths
         # given the circuit and Hamming weight upper bound
         self.enumerate_weights([], self.max_weight-self.num_op_layers, self.num_op_layers)
 
-        self.init_pauli_paths() # Adds the PauliPathTrav that matches each weight combo to self.pauli_path_travs
-        self.travs_to_list()
+        # In lazy mode nothing else is built up front: iter_xyz_trees and iter_paths generate
+        # each tree or path when it is asked for, so memory stays bounded by a single tree
+        self.lazy = lazy
+        self.pauli_path_travs = None
+        self.rnp_pauli_paths = None
+        self.xyz_gen_heads = None
+        self.xyz_pauli_paths = None
+        if lazy:
+            return
+
+        # The trees only depend on the architecture and max_weight, so they may already be on disk.
+        # Trees loaded from the cache come without the PauliPathTravs and rnp paths they were built from.
+        # Gate-aware trees also depend on the gates, so they are neither loaded nor stored
+        if compiled_circuit is not None:
+            path_cache = None
+        cached_heads = path_cache.load(num_qubits, max_weight, gate_pos) if path_cache is not None else None
+        if cached_heads is not None:
+            self.xyz_gen_heads = cached_heads
+        else:
+            if workers > 1: # Only the trees come back from the workers, not the PauliPathTravs and rnp paths
+                self.build_xyz_trees_parallel(workers)
+            else:
+                self.init_pauli_paths() # Adds the PauliPathTrav that matches each weight combo to self.pauli_path_travs
+                self.travs_to_list()
 
-        self.build_xyz_trees()
+                self.build_xyz_trees()
+            if path_cache is not None:
+                path_cache.store(num_qubits, max_weight, gate_pos, self.xyz_gen_heads)
 
         self.trees_to_lists()
 
@@ -117,6 +153,12 @@ class CircuitSim:
                 self.enumerate_weights(weight_list_copy, wiggle_room-i, num_op_layers_left-1)
             return
 
+    # Counts the legal Pauli paths (overall, per weight combo, and per Hamming weight) and estimates
+    # the memory and time to build them, without generating any. Use lazy=True to skip generation
+    # in the constructor when only the counts are needed
+    def count_paths(self):
+        return count_paths(self.num_qubits, self.max_weight, self.gate_pos)
+
     # Initiates the list of all PauliPathTravs that fit the circuit architecture and upper bound on Hamming weight
     def init_pauli_paths(self):
         self.pauli_path_travs = []
@@ -132,70 +174,208 @@ class CircuitSim:
             self.rnp_pauli_paths.append(self.trav_to_list(pauli_path_trav))
 
     def trav_to_list(self,trav:PauliPathTrav):
-        trav_list = []
+        return list(self.iter_trav_paths(trav))
+
+    # Yields every Pauli path through trav, still in 'R', 'N', 'P', and 'I'
+    def iter_trav_paths(self,trav:PauliPathTrav):
         for rnp_sibs in trav.layers[0].forward_rnp_sibs.values():
             for pauli_op in rnp_sibs:
-                self.trav_branching(trav_list, [], pauli_op)
-        return trav_list
+                yield from self.trav_branching([], pauli_op)
 
-    def trav_branching(self,trav_list:List[List[PauliOperator]], partial_pauli_path:List[PauliOperator], pauli_op:PauliOperator):
+    # Recursively yields every Pauli path that continues partial_pauli_path with pauli_op.
+    # All branches share partial_pauli_path, so only the finished paths are copied
+    def trav_branching(self, partial_pauli_path:List[PauliOperator], pauli_op:PauliOperator):
         partial_pauli_path.append(pauli_op)
 
         # Base case: Reached last Pauli operator layer of the circuit
         if pauli_op.next_ops == None:
-            trav_list.append(partial_pauli_path)
-            return
-    
-        for i in range(len(pauli_op.next_ops)):
-            partial_pauli_path_copy = copy.deepcopy(partial_pauli_path)
-            self.trav_branching(trav_list, partial_pauli_path_copy, pauli_op.next_ops[i])
+            yield list(partial_pauli_path)
+        else:
+            for next_op in pauli_op.next_ops:
+                yield from self.trav_branching(partial_pauli_path, next_op)
+
+        partial_pauli_path.pop()
 
     # Uses each Pauli path list in 'R', 'N', 'P', and 'I' to construct its own tree, 
     # with the tree's branching representing valid selections of 'X', 'Y', and 'Z'
     def build_xyz_trees(self):
         self.xyz_gen_heads = []
         for list_of_paths in self.rnp_pauli_paths:
-            for path in list_of_paths:
-                first_op_list = self.rn_to_z(path[0]) # returns a list with single element, 
-                # 'I' 'Z' version of path[00]
+            self.xyz_gen_heads.extend(self.build_live_xyz_trees(list_of_paths))
 
-                xyz_gen = XYZGeneration(first_op_list, 1, path)
-                self.xyz_gen_heads.append(xyz_gen)
+    # Builds the tree of every path, leaving out the trees that gate-aware pruning cut off entirely
+    def build_live_xyz_trees(self, paths:List[List[PauliOperator]]):
+        return list(self.iter_live_xyz_trees(paths))
+
+    # Yields the tree of every path that is not cut off entirely, building each one only when it is reached.
+    # An eager tree has already dropped its dead subtrees, and a lazy one is walked down to its first leaf,
+    # so lazy and eager generation give the same trees
+    def iter_live_xyz_trees(self, paths:Iterable[List[PauliOperator]]):
+        for path in paths:
+            xyz_gen_head = self.build_xyz_tree(path)
+            if xyz_gen_head.leads_to_leaf():
+                yield xyz_gen_head
+
+    # Builds the XYZGeneration trees of the weight combos in a process pool. The weight combos are
+    # independent, and the results are merged in the order of weight_combos, so the trees come out
+    # in the same order as with build_xyz_trees
+    def build_xyz_trees_parallel(self, workers:int):
+        self.xyz_gen_heads = []
+        # the arguments shared by every weight combo, above all the gate tables, are sent once per worker
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_combo_worker,
+                                 initargs=(self.num_qubits, self.gate_pos, self.compiled_circuit)) as pool:
+            chunksize = max(1, len(self.weight_combos) // (4*workers))
+            for arrays in pool.map(build_combo_tree_arrays, self.weight_combos, chunksize=chunksize):
+                self.xyz_gen_heads.extend(arrays_to_trees(arrays, self.num_qubits))
+
+    def build_xyz_tree(self, path:List[PauliOperator]):
+        first_op_list = self.rn_to_z(path[0]) # returns a list with single element, 
+        # 'I' 'Z' version of path[00]
+        return XYZGeneration(first_op_list, 1, path, self.lazy, # lazy trees are only built as far as they are walked
+                             self.compiled_circuit)
 
     # Turns each tree into seperate lists representing Pauli paths
     def trees_to_lists(self):
         self.xyz_pauli_paths = []
         
         for xyz_gen_head in self.xyz_gen_heads:
-            xyz_gen_paths = [[]]
-            self.xyz_tree_branching(xyz_gen_head,xyz_gen_paths)
+            self.xyz_pauli_paths.extend(self.xyz_tree_branching(xyz_gen_head, []))
     
 
-    # Recursively traverses all possible Pauli paths along the XYZGeneration tree 
-    # and appends them to xyz_pauli_paths
-    def xyz_tree_branching(self, cur_xyz_gen:XYZGeneration, pauli_paths_in_womb:List[List[PauliOperator]]):
-        if (cur_xyz_gen.next_gen == None): # Base case: add the 'I' 'Z' leaf pauli op to all paths
-            for pauli_path in pauli_paths_in_womb:
-                pauli_path.append(cur_xyz_gen.parent_ops[0]) # only the next pauli operator is the one with all 'I's and 'Z's
-                self.xyz_pauli_paths.append(pauli_path) # adds all the completed pauli paths
+    # Recursively yields all possible Pauli paths along the XYZGeneration tree that
+    # continue partial_pauli_path. All branches share partial_pauli_path, and the
+    # PauliOperators are shared with the tree rather than copied
+    def xyz_tree_branching(self, cur_xyz_gen:XYZGeneration, partial_pauli_path:List[PauliOperator]):
+        if (cur_xyz_gen.next_gen == None): # Base case: add the 'I' 'Z' leaf pauli op to the path
+            partial_pauli_path.append(cur_xyz_gen.parent_ops[0]) # only the next pauli operator is the one with all 'I's and 'Z's
+            yield list(partial_pauli_path) # the completed pauli path
+            partial_pauli_path.pop()
         else: # partway through tree construction, need to branch
+            next_gens = cur_xyz_gen.take_next_gen() # a lazy node drops its children once they are walked
             for pauli_op in cur_xyz_gen.parent_ops: # for every pauli op in the current generation
-                for next_gen in cur_xyz_gen.next_gen: 
-                    branched_pauli_paths = copy.deepcopy(pauli_paths_in_womb)
-                    for pauli_path in branched_pauli_paths:
-                        pauli_path.append(pauli_op)
-                    self.xyz_tree_branching(next_gen,branched_pauli_paths)
+                partial_pauli_path.append(pauli_op)
+                for next_gen in next_gens: 
+                    yield from self.xyz_tree_branching(next_gen, partial_pauli_path)
+                partial_pauli_path.pop()
+
+    # Yields one PauliPathTrav per weight combo, so only one needs to be alive at a time
+    def iter_pauli_path_travs(self):
+        if self.pauli_path_travs is not None:
+            yield from self.pauli_path_travs
+            return
+        for weight_combo in self.weight_combos:
+            yield PauliPathTrav(self.num_qubits, weight_combo, self.gate_pos)
+
+    # Yields every legal Pauli path in 'R', 'N', 'P', and 'I'
+    def iter_rnp_paths(self):
+        if self.rnp_pauli_paths is not None:
+            for list_of_paths in self.rnp_pauli_paths:
+                yield from list_of_paths
+            return
+        for pauli_path_trav in self.iter_pauli_path_travs():
+            yield from self.iter_trav_paths(pauli_path_trav)
+
+    # Yields the root of every XYZGeneration tree, building each tree only when it is reached
+    def iter_xyz_trees(self):
+        if self.xyz_gen_heads is not None:
+            yield from self.xyz_gen_heads
+            return
+        yield from self.iter_live_xyz_trees(self.iter_rnp_paths())
+
+    # Yields every legal Pauli path as a list of PauliOperators in 'I', 'X', 'Y', and 'Z'
+    def iter_paths(self):
+        if self.xyz_pauli_paths is not None:
+            yield from self.xyz_pauli_paths
+            return
+        for xyz_gen_head in self.iter_xyz_trees():
+            yield from self.xyz_tree_branching(xyz_gen_head, [])
             
 
+    """
+    This function raises the upper bound on Hamming weight to max_weight without rebuilding anything.
+    The weight combos of a lower bound are exactly the combos of max_weight whose total weight fits it,
+    so only the new combos, of total weight above the old bound, get a PauliPathTrav and trees. These are
+    appended to the attributes that have been built, and the existing paths are left untouched.
+
+    Args:
+        max_weight (int) : New upper bound on a Pauli path's Hamming weight, at least the current one
+
+    Returns:
+        List[XYZGeneration] : Roots of the new trees only, whose contributions can be added to the spectrum
+        of the old ones (see FourierSpectrum.extend in Pauli_Amplitude). In lazy mode, an iterator that
+        builds them one at a time
+    """
+    def extend(self, max_weight:int):
+        if max_weight < self.max_weight:
+            raise ValueError
+
+        old_max_weight = self.max_weight
+        old_weight_combos = self.weight_combos
+        self.max_weight = max_weight
+        self.weight_combos = []
+        self.enumerate_weights([], self.max_weight-self.num_op_layers, self.num_op_layers)
+        new_weight_combos = [weight_combo for weight_combo in self.weight_combos if sum(weight_combo) > old_max_weight]
+        self.weight_combos = old_weight_combos + new_weight_combos
+
+        if self.lazy: # nothing is stored, and iter_xyz_trees and iter_paths already cover the new combos
+            return self.iter_live_xyz_trees(path for weight_combo in new_weight_combos
+                                            for path in self.iter_trav_paths(PauliPathTrav(self.num_qubits, weight_combo, self.gate_pos)))
+
+        new_pauli_path_travs = [PauliPathTrav(self.num_qubits, weight_combo, self.gate_pos) for weight_combo in new_weight_combos]
+        new_rnp_pauli_paths = [self.trav_to_list(pauli_path_trav) for pauli_path_trav in new_pauli_path_travs]
+        if self.pauli_path_travs is not None: # not kept for trees loaded from a cache or built in parallel
+            self.pauli_path_travs.extend(new_pauli_path_travs)
+            self.rnp_pauli_paths.extend(new_rnp_pauli_paths)
+
+        new_xyz_gen_heads = []
+        for list_of_paths in new_rnp_pauli_paths:
+            new_xyz_gen_heads.extend(self.build_live_xyz_trees(list_of_paths))
+        self.xyz_gen_heads.extend(new_xyz_gen_heads)
+        for xyz_gen_head in new_xyz_gen_heads:
+            self.xyz_pauli_paths.extend(self.xyz_tree_branching(xyz_gen_head, []))
+        return new_xyz_gen_heads
+
+    # Compiles the XYZGeneration trees into contiguous arrays (see FlatTrees), which can be saved
+    # and memory-mapped, and which the vectorized amplitude traversal runs on directly
+    def to_flat_trees(self):
+        return FlatTrees.from_trees(self.iter_xyz_trees(), self.num_qubits)
+
+    # Merges the structurally identical subtrees of xyz_gen_heads, turning the forest into a DAG
+    # with shared suffixes. The same paths run through it, with far fewer nodes
+    def share_subtrees(self):
+        self.xyz_gen_heads = share_subtrees(self.iter_xyz_trees())
+
     @staticmethod
     # The first Pauli operator in a Pauli path can only be a tensor of 'I's and 'Z's
     def rn_to_z(first_op:PauliOperator):
-        first_op_list = [copy.deepcopy(first_op)]
+        if first_op.p_mask:
+            return [] # we shouldn't encounter a 'P' in the first layer
 
-        for i in range(len(first_op_list[0].operator)):
-            if first_op_list[0].operator[i] == 'R' or first_op_list[0].operator[i] == 'N':
-                first_op_list[0].operator[i] = 'Z'
-            if first_op_list[0].operator[i] == 'P':
-                return [] # we shouldn't encounter a 'P' in the first layer
+        first_op_list = [first_op.copy()]
+        first_op_list[0].set_mask(first_op.r_mask | first_op.n_mask, 'Z')
             
-        return first_op_list # valid operator possible
\ No newline at end of file
+        return first_op_list # valid operator possible
+
+
+# Arguments of the worker processes of CircuitSim.build_xyz_trees_parallel that are the same for
+# every weight combo, set once per worker by init_combo_worker instead of pickled with every task
+_shared = {}
+
+
+def init_combo_worker(num_qubits:int, gate_pos:List[List[tuple]], compiled_circuit):
+    _shared['num_qubits'] = num_qubits
+    _shared['gate_pos'] = gate_pos
+    _shared['compiled_circuit'] = compiled_circuit
+
+
+# Runs in a worker process of CircuitSim.build_xyz_trees_parallel. Builds the trees of a single
+# weight combo and ships them back flattened into arrays, which pickle far smaller and faster
+# than the object graphs of the trees
+def build_combo_tree_arrays(weight_combo:List[int]):
+    num_qubits = _shared['num_qubits']
+    circuit = CircuitSim.__new__(CircuitSim) # only the attributes build_xyz_tree needs
+    circuit.lazy = False
+    circuit.compiled_circuit = _shared['compiled_circuit']
+    trav = PauliPathTrav(num_qubits, weight_combo, _shared['gate_pos'])
+    heads = circuit.build_live_xyz_trees(circuit.iter_trav_paths(trav))
+    return trees_to_arrays(heads, num_qubits)
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import os
+from typing import List
+import numpy as np
+from Path_Generation.pauli_operator import num_mask_words, mask_to_words
+from Path_Generation.xyz_generation import XYZGeneration
+
+FLAT_TREE_ARRAYS = ('op_start', 'child_start', 'layer_start', 'x_words', 'z_words')
+
+
+class FlatTrees:
+    """
+    XYZGeneration trees stored as a few contiguous arrays instead of Python objects. The nodes are
+    numbered layer by layer (breadth first), so every layer, and the children of every node, is a
+    contiguous range:
+
+        nodes of layer k             layer_start[k] .. layer_start[k+1]
+        operators of node i          op_start[i] .. op_start[i+1]
+        children of node i           child_start[i] .. child_start[i+1] (empty for a leaf)
+        masks of operator j          x_words[j], z_words[j] (64-bit little-endian words)
+
+    Saved with save, the arrays can be opened with load as read-only memory maps, so several
+    processes share one copy through the page cache and nothing is unpickled.
+    """
+    def __init__(self, num_qubits:int, op_start:np.ndarray, child_start:np.ndarray, layer_start:np.ndarray,
+                 x_words:np.ndarray, z_words:np.ndarray):
+        self.num_qubits = num_qubits
+        self.op_start = op_start
+        self.child_start = child_start
+        self.layer_start = layer_start
+        self.x_words = x_words
+        self.z_words = z_words
+
+    """
+    This function compiles XYZGeneration trees into a FlatTrees.
+
+    Args:
+        xyz_gen_heads (List[XYZGeneration]) : Roots of the trees, e.g. CircuitSim.xyz_gen_heads
+        num_qubits (int) : Number of qubits of every PauliOperator in the trees
+
+    Returns:
+        FlatTrees : The trees, with the roots in their original order
+    """
+    @classmethod
+    def from_trees(cls, xyz_gen_heads:List[XYZGeneration], num_qubits:int):
+        num_words = num_mask_words(num_qubits)
+        op_start = [0]
+        child_start = []
+        layer_start = [0]
+        x_words = []
+        z_words = []
+
+        frontier = list(xyz_gen_heads)
+        num_nodes = len(frontier) # nodes numbered so far, including the frontier
+        while frontier:
+            next_frontier = []
+            for xyz_gen in frontier:
+                for op in xyz_gen.parent_ops:
+                    x_words.extend(mask_to_words(op.x_mask, num_words))
+                    z_words.extend(mask_to_words(op.z_mask, num_words))
+                op_start.append(len(x_words) // num_words)
+                child_start.append(num_nodes + len(next_frontier))
+                if xyz_gen.next_gen is not None:
+                    next_frontier.extend(xyz_gen.next_gen)
+            layer_start.append(layer_start[-1] + len(frontier))
+            num_nodes += len(next_frontier)
+            frontier = next_frontier
+        child_start.append(num_nodes)
+
+        return cls(num_qubits,
+                   np.array(op_start, dtype=np.int64),
+                   np.array(child_start, dtype=np.int64),
+                   np.array(layer_start, dtype=np.int64),
+                   np.array(x_words, dtype=np.uint64).reshape(-1, num_words),
+                   np.array(z_words, dtype=np.uint64).reshape(-1, num_words))
+
+    @property
+    def num_layers(self) -> int:
+        return len(self.layer_start) - 1
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.op_start) - 1
+
+    @property
+    def num_ops(self) -> int:
+        return len(self.x_words)
+
+    """
+    This function returns one layer of the trees, with offsets relative to that layer.
+
+    Args:
+        k (int) : Index of the operator layer
+
+    Returns:
+        dict : 'x_words' / 'z_words' are the operators of the layer (views, so memory maps stay mapped),
+        the operators of the layer's node i are rows op_start[i] to op_start[i+1], and
+        'node_parent' is the index of node i's parent within layer k-1 (-1 in the first layer)
+    """
+    def layer(self, k:int):
+        first_node, end_node = int(self.layer_start[k]), int(self.layer_start[k+1])
+        op_start = np.asarray(self.op_start[first_node:end_node+1])
+        first_op, end_op = int(op_start[0]), int(op_start[-1])
+
+        if k == 0:
+            node_parent = np.full(end_node - first_node, -1, dtype=np.int64)
+        else:
+            # The children of layer k-1 are exactly layer k, in the order of their parents
+            parent_child_start = np.asarray(self.child_start[int(self.layer_start[k-1]):first_node+1])
+            node_parent = np.repeat(np.arange(len(parent_child_start) - 1), np.diff(parent_child_start))
+
+        return {'x_words': self.x_words[first_op:end_op],
+                'z_words': self.z_words[first_op:end_op],
+                'op_start': op_start - first_op,
+                'node_parent': node_parent}
+
+    def layers(self):
+        return [self.layer(k) for k in range(self.num_layers)]
+
+    # Writes every array as a .npy file in directory
+    def save(self, directory:str):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'num_qubits.npy'), np.array(self.num_qubits))
+        for name in FLAT_TREE_ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+    # Opens trees written by save, memory-mapped read-only unless mmap_mode is None
+    @classmethod
+    def load(cls, directory:str, mmap_mode:str = 'r'):
+        num_qubits = int(np.load(os.path.join(directory, 'num_qubits.npy')))
+        arrays = [np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) for name in FLAT_TREE_ARRAYS]
+        return cls(num_qubits, *arrays)
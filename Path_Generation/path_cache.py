@@ -0,0 +1,161 @@
+from __future__ import annotations
+import hashlib
+import os
+import tempfile
+from typing import List
+import numpy as np
+from Path_Generation.pauli_operator import PauliOperator, num_mask_words, mask_to_words, words_to_mask
+from Path_Generation.xyz_generation import XYZGeneration, PATH_GENERATION_VERSION
+
+CACHE_FORMAT_VERSION = 2 # bump whenever the layout below changes
+
+
+"""
+This function flattens XYZGeneration trees into arrays, visiting the nodes in preorder.
+
+Args:
+    xyz_gen_heads (List[XYZGeneration]) : Roots of the trees to flatten
+    num_qubits (int) : Number of qubits of every PauliOperator in the trees
+
+Returns:
+    dict : 'num_ops' (uint32, per node) is the number of parent_ops of the node,
+    'num_children' (int32, per node) is the length of its next_gen or -1 for a leaf,
+    and 'x_words' / 'z_words' (uint64, per op) are the ops' x and z masks split into 64-bit words
+"""
+def trees_to_arrays(xyz_gen_heads:List[XYZGeneration], num_qubits:int):
+    num_words = num_mask_words(num_qubits)
+    num_ops = []
+    num_children = []
+    x_words = []
+    z_words = []
+
+    stack = list(reversed(xyz_gen_heads))
+    while stack:
+        xyz_gen = stack.pop()
+        num_ops.append(len(xyz_gen.parent_ops))
+        for op in xyz_gen.parent_ops:
+            x_words.extend(mask_to_words(op.x_mask, num_words))
+            z_words.extend(mask_to_words(op.z_mask, num_words))
+        if xyz_gen.next_gen is None:
+            num_children.append(-1)
+        else:
+            num_children.append(len(xyz_gen.next_gen))
+            stack.extend(reversed(xyz_gen.next_gen))
+
+    return {'num_ops': np.array(num_ops, dtype=np.uint32),
+            'num_children': np.array(num_children, dtype=np.int32),
+            'x_words': np.array(x_words, dtype=np.uint64).reshape(-1, num_words),
+            'z_words': np.array(z_words, dtype=np.uint64).reshape(-1, num_words)}
+
+
+"""
+This function rebuilds the XYZGeneration trees flattened by trees_to_arrays.
+The rebuilt nodes hold parent_ops and next_gen only, since the rnp Pauli paths
+they were expanded from are not stored.
+
+Args:
+    arrays (dict) : Output of trees_to_arrays, or a loaded .npz file of it
+    num_qubits (int) : Number of qubits of every PauliOperator in the trees
+
+Returns:
+    List[XYZGeneration] : The roots of the trees, in their original order
+"""
+def arrays_to_trees(arrays, num_qubits:int):
+    num_ops = arrays['num_ops'].tolist()
+    num_children = arrays['num_children'].tolist()
+    x_masks = [words_to_mask(words) for words in arrays['x_words'].tolist()]
+    z_masks = [words_to_mask(words) for words in arrays['z_words'].tolist()]
+
+    op_index = 0
+    nodes = []
+    for i in range(len(num_ops)):
+        xyz_gen = XYZGeneration.__new__(XYZGeneration) # skips the expansion done by __init__
+        xyz_gen.pauli_path = None
+        xyz_gen.parent_ops = [PauliOperator.from_masks(num_qubits, x_masks[j], z_masks[j])
+                              for j in range(op_index, op_index + num_ops[i])]
+        xyz_gen.next_gen = None if num_children[i] < 0 else []
+        op_index += num_ops[i]
+        nodes.append(xyz_gen)
+
+    # Preorder: each node's children are the subtrees that directly follow it
+    heads = []
+    open_nodes = [] # nodes still waiting for children, with how many they still need
+    for i, xyz_gen in enumerate(nodes):
+        if open_nodes:
+            parent, remaining = open_nodes[-1]
+            parent.next_gen.append(xyz_gen)
+            open_nodes[-1] = (parent, remaining-1)
+        else:
+            heads.append(xyz_gen)
+        while open_nodes and open_nodes[-1][1] == 0:
+            open_nodes.pop()
+        if num_children[i] > 0:
+            open_nodes.append((xyz_gen, num_children[i]))
+
+    return heads
+
+
+class PathCache:
+    """
+    On-disk cache of the XYZGeneration trees built by CircuitSim. The trees only depend on the
+    number of qubits, the Hamming weight bound, and the gate positions, not on the gates themselves,
+    so one entry serves every random circuit with the same architecture. The oldest entries are
+    evicted once the cache grows past max_bytes.
+    """
+    def __init__(self, cache_dir:str, max_bytes:int = 1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Gate orientation and the order of gates within a layer do not change the set of legal Pauli paths
+    @staticmethod
+    def normalize_gate_pos(gate_pos:List[List[tuple]]):
+        return tuple(tuple(sorted(tuple(sorted(pos)) for pos in gate_pos_layer)) for gate_pos_layer in gate_pos)
+
+    def key(self, num_qubits:int, max_weight:int, gate_pos:List[List[tuple]]) -> str:
+        return repr((CACHE_FORMAT_VERSION, PATH_GENERATION_VERSION, num_qubits, max_weight, self.normalize_gate_pos(gate_pos)))
+
+    def entry_path(self, key:str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + '.npz')
+
+    # Returns the cached trees, or None on a miss
+    def load(self, num_qubits:int, max_weight:int, gate_pos:List[List[tuple]]):
+        key = self.key(num_qubits, max_weight, gate_pos)
+        path = self.entry_path(key)
+        try:
+            with np.load(path) as arrays:
+                if str(arrays['key']) != key: # hash collision
+                    return None
+                heads = arrays_to_trees(arrays, num_qubits)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        os.utime(path) # marks the entry as recently used
+        return heads
+
+    def store(self, num_qubits:int, max_weight:int, gate_pos:List[List[tuple]], xyz_gen_heads:List[XYZGeneration]):
+        key = self.key(num_qubits, max_weight, gate_pos)
+        arrays = trees_to_arrays(xyz_gen_heads, num_qubits)
+
+        # Written under a temporary name first, so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(suffix='.npz.tmp', dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, key=np.array(key), **arrays)
+        os.replace(tmp_path, self.entry_path(key))
+
+        self.evict()
+
+    # Deletes the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
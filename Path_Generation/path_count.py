@@ -0,0 +1,89 @@
+from __future__ import annotations
+from collections import defaultdict
+from itertools import combinations
+from typing import List
+
+# Rough costs of CircuitSim, measured on brickwork circuits of 4-6 qubits. They only
+# need to be good enough to pick a truncation that fits a budget
+SECONDS_PER_PATH = 1.2e-5 # generation time, including the XYZGeneration trees
+BYTES_PER_PATH = 64 # list object holding one entry of xyz_pauli_paths
+BYTES_PER_OP_REF = 8 # each Pauli operator reference in that list
+BYTES_PER_TREE_OP = 80 # share of the PauliOperators in the trees per path
+
+
+"""
+This function counts the legal Pauli paths of a circuit by dynamic programming over the gates,
+without building any PauliOperator, PauliPathTrav, or XYZGeneration.
+
+A path is tracked layer by layer through its support mask, which is enough to count its 'X', 'Y',
+and 'Z' fillings: a qubit keeps its Pauli while it skips gates, so each run of a qubit between gates
+is a single letter. That letter has 3 choices, unless the run touches the first or last layer, where
+only 'Z' is allowed. A run touches the first layer exactly when its qubit has not met a gate yet,
+so the support mask and the layer index determine every factor.
+
+Args:
+    num_qubits (int) : Number of qubits in the circuit
+    max_weight (int) : Upper bound on the total Hamming weight of a Pauli path
+    gate_pos (List[List[tuple]]) : Gate positions of every gate layer
+
+Returns:
+    dict : 'total' is the number of legal Pauli paths (not counting the all 'I' path),
+    'by_weight_combo' maps each tuple of per-layer Hamming weights to its number of paths,
+    'by_hamming_weight' maps each total Hamming weight to its number of paths,
+    'est_memory_bytes' and 'est_seconds' are rough costs of building them with CircuitSim
+"""
+def count_paths(num_qubits:int, max_weight:int, gate_pos:List[List[tuple]]):
+    num_op_layers = len(gate_pos)+1
+
+    # (support mask, per-layer weights so far) -> number of partial paths, counting every
+    # letter whose run has already ended. The first layer can have any nonempty support
+    states = defaultdict(int)
+    for weight in range(1, min(num_qubits, max_weight-(num_op_layers-1)) + 1): # every later layer has weight at least 1
+        for qubits in combinations(range(num_qubits), weight):
+            states[(sum(1 << q for q in qubits), (weight,))] = 1
+
+    touched = 0 # qubits that have met a gate in an earlier layer
+    for layer in range(len(gate_pos)):
+        # Push the supports through one gate at a time
+        for pos in gate_pos[layer]:
+            gate_mask = (1 << pos[0]) | (1 << pos[1])
+            next_states = defaultdict(int)
+            for (support, weights), count in states.items():
+                gate_in = support & gate_mask
+                if gate_in == 0: # 'II' can only become 'II'
+                    next_states[(support, weights)] += count
+                    continue
+
+                # The runs entering the gate end here. Those that started at the first layer are 'Z'
+                count *= 3 ** (gate_in & touched).bit_count()
+                for gate_out in (1 << pos[0], 1 << pos[1], gate_mask): # 'RI', 'IR', 'RR'
+                    next_states[((support & ~gate_mask) | gate_out, weights)] += count
+            states = next_states
+
+        for pos in gate_pos[layer]:
+            touched |= (1 << pos[0]) | (1 << pos[1])
+
+        # Record the weight of the new layer and drop the paths that can no longer fit
+        layers_left = num_op_layers-(layer+2) # layers after the new one
+        next_states = defaultdict(int)
+        for (support, weights), count in states.items():
+            weights += (support.bit_count(),)
+            if sum(weights) + layers_left <= max_weight:
+                next_states[(support, weights)] += count
+        states = next_states
+
+    # Every run still open reaches the last layer, so it must be 'Z'
+    by_weight_combo = defaultdict(int)
+    for (support, weights), count in states.items():
+        by_weight_combo[weights] += count
+
+    by_hamming_weight = defaultdict(int)
+    for weights, count in by_weight_combo.items():
+        by_hamming_weight[sum(weights)] += count
+
+    total = sum(by_weight_combo.values())
+    return {'total': total,
+            'by_weight_combo': dict(by_weight_combo),
+            'by_hamming_weight': dict(sorted(by_hamming_weight.items())),
+            'est_memory_bytes': total * (BYTES_PER_PATH + num_op_layers*BYTES_PER_OP_REF + BYTES_PER_TREE_OP),
+            'est_seconds': total * SECONDS_PER_PATH}
@@ -0,0 +1,87 @@
+from __future__ import annotations
+import os
+import shutil
+import tempfile
+from typing import Iterable
+from Path_Generation.flat_trees import FlatTrees
+from Path_Generation.xyz_generation import XYZGeneration
+
+CHUNK_PREFIX = 'chunk_'
+
+
+class PathStore:
+    """
+    Out-of-core store of XYZGeneration trees, for path sets that do not fit in memory. The trees
+    are written in chunks of a fixed number of roots, each one a FlatTrees directory, and read back
+    one memory-mapped chunk at a time, so only the chunk being evaluated is ever resident.
+    """
+    def __init__(self, directory:str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    # Chunk directories in the order they were written
+    def chunk_dirs(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith(CHUNK_PREFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def __len__(self) -> int:
+        return len(self.chunk_dirs())
+
+    """
+    This function spills trees to disk as they are generated, holding at most one chunk of roots in memory.
+    The chunks are added after the ones already in the store.
+
+    Args:
+        xyz_gen_heads (Iterable[XYZGeneration]) : Roots of the trees, e.g. CircuitSim(..., lazy=True).iter_xyz_trees()
+        num_qubits (int) : Number of qubits of every PauliOperator in the trees
+        roots_per_chunk (int) : Number of roots per chunk
+
+    Returns:
+        int : Number of chunks written
+    """
+    def write(self, xyz_gen_heads:Iterable[XYZGeneration], num_qubits:int, roots_per_chunk:int = 4096):
+        num_written = 0
+        chunk = []
+        for xyz_gen_head in xyz_gen_heads:
+            chunk.append(xyz_gen_head)
+            if len(chunk) == roots_per_chunk:
+                self.write_chunk(FlatTrees.from_trees(chunk, num_qubits))
+                num_written += 1
+                chunk = []
+        if chunk:
+            self.write_chunk(FlatTrees.from_trees(chunk, num_qubits))
+            num_written += 1
+        return num_written
+
+    # Index one past the highest chunk index in the store, so gaps left by removed chunks are never reused
+    def next_chunk_index(self) -> int:
+        indices = [int(name[len(CHUNK_PREFIX):]) for name in os.listdir(self.directory)
+                   if name.startswith(CHUNK_PREFIX) and name[len(CHUNK_PREFIX):].isdigit()]
+        return max(indices, default=-1) + 1
+
+    # Saves one chunk under a temporary name first, so readers never see a partial chunk, then renames
+    # it to the next free index. Renaming onto a chunk that already holds files fails, so when another
+    # writer takes the same index first, the chunk moves on to the next one. The temporary directory
+    # is removed if anything fails
+    def write_chunk(self, flat_trees:FlatTrees):
+        tmp_dir = tempfile.mkdtemp(suffix='.tmp', dir=self.directory)
+        try:
+            flat_trees.save(tmp_dir)
+            index = self.next_chunk_index()
+            while True:
+                chunk_dir = os.path.join(self.directory, f'{CHUNK_PREFIX}{index:08d}')
+                try:
+                    os.rename(tmp_dir, chunk_dir)
+                    break
+                except OSError:
+                    if not os.path.isdir(chunk_dir):
+                        raise
+                    index += 1
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    # Yields the chunks as read-only memory-mapped FlatTrees, one at a time
+    def __iter__(self):
+        for chunk_dir in self.chunk_dirs():
+            yield FlatTrees.load(chunk_dir)
@@ -1,5 +1,4 @@
 from collections import defaultdict
-import copy
 from typing import DefaultDict, List
 from Path_Generation.pauli_operator import PauliOperator
 
@@ -58,17 +57,21 @@ class PauliOpLayer:
         # and the key's associated value is the list of all the gate positions with non-identity I/O 
         # between the PauliOperator key and the layer to which we propagate.
 
-        self.carry_over_qubits = [] # Represents the non-gate qubits of each PauliOperator object
+        self.carry_over_qubits = [] # Represents the non-gate qubits of each PauliOperator object,
+        # as the operator's masks with its non-identity gate qubits cleared
+
+        gate_masks = [(1 << ind1) | (1 << ind2) for ind1, ind2 in self.gate_pos]
 
         for i in range(len(unsorted_pauli_ops)): # For each valid configuration of our layer
-            self.carry_over_qubits.append(copy.deepcopy(unsorted_pauli_ops[i].operator))
-            for ind1, ind2 in self.gate_pos: # For each gate between this layer and its neighboring layer
-                if (unsorted_pauli_ops[i].operator[ind1] != 'I' or unsorted_pauli_ops[i].operator[ind2] != 'I'): # non-identity output
-                    self.pos_to_fill[unsorted_pauli_ops[i]].append((ind1,ind2)) # Adds gate to the list of positions 
+            support = unsorted_pauli_ops[i].support
+            gate_qubits = 0
+            for j in range(len(self.gate_pos)): # For each gate between this layer and its neighboring layer
+                if (support & gate_masks[j]): # non-identity output
+                    self.pos_to_fill[unsorted_pauli_ops[i]].append(tuple(self.gate_pos[j])) # Adds gate to the list of positions 
                     # for layer i that require non-identity input
-                    self.carry_over_qubits[i][ind1] = 'I'
-                    self.carry_over_qubits[i][ind2] = 'I' # So when we compare the qubits that don't change,
+                    gate_qubits |= gate_masks[j] # So when we compare the qubits that don't change,
                     # we don't also compare the ones that can change in a gate
+            self.carry_over_qubits.append(unsorted_pauli_ops[i].key(~gate_qubits))
 
     def group_sibs(self,unsorted_pauli_ops:List[PauliOperator]):
         sorted_pauli_ops = defaultdict(list) # Hash map of PauliOperators,
@@ -76,7 +79,7 @@ class PauliOpLayer:
         # all PauliOperators with a particular set of non-gate qubits and non-identity I/O gate positions
 
         for i in range(len(unsorted_pauli_ops)): # For each PauliOperator
-            identifier = (tuple(self.pos_to_fill[unsorted_pauli_ops[i]]), tuple(self.carry_over_qubits[i]))
+            identifier = (tuple(self.pos_to_fill[unsorted_pauli_ops[i]]), self.carry_over_qubits[i])
             
             sorted_pauli_ops[identifier].append(unsorted_pauli_ops[i]) # DefaultFict handles new keys
             # by initializing a new list for that key before trying to append
@@ -1,14 +1,47 @@
 from __future__ import annotations
 import pdb # for debugging
-from typing import List
-import copy
+from typing import List, Tuple
+
+# Mask attribute that stores each single-qubit symbol. 'Y' is stored as a set bit in both x_mask and z_mask
+SYMBOL_MASKS = {'X': ('x_mask',), 'Y': ('x_mask', 'z_mask'), 'Z': ('z_mask',), 'R': ('r_mask',), 'N': ('n_mask',), 'P': ('p_mask',), 'I': ()}
+
+# Yields the indices of the set bits of mask in increasing order
+def mask_positions(mask:int):
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+# Masks are stored as little-endian 64-bit words (bit i of the mask is bit i % 64 of word i // 64)
+# wherever they go into NumPy arrays or files
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+# Number of 64-bit words that hold a mask over num_qubits qubits
+def num_mask_words(num_qubits:int) -> int:
+    return max(1, -(-num_qubits // WORD_BITS))
+
+# Splits mask into num_words 64-bit words
+def mask_to_words(mask:int, num_words:int) -> List[int]:
+    return [(mask >> (WORD_BITS*w)) & WORD_MASK for w in range(num_words)]
+
+# Inverse of mask_to_words
+def words_to_mask(words) -> int:
+    mask = 0
+    for w, word in enumerate(words):
+        mask |= int(word) << (WORD_BITS*w)
+    return mask
 
 class PauliOperator:
 
+    # Qubit i of the operator is bit i of the masks below. Python ints have no fixed width,
+    # so the masks work for any number of qubits
+    __slots__ = ('num_qubits', 'x_mask', 'z_mask', 'r_mask', 'n_mask', 'p_mask', 'prior_ops', 'next_ops', 'list_alloc')
+
     def __init__(self, operator:List[str], prior_ops:List[PauliOperator] = None, next_ops:List[PauliOperator] = None):
         """
-        Initializes the PauliOperator's operator object and initializes prior_ops and next_ops attributes if they are
-        sent in as arguments.
+        Initializes the PauliOperator's masks from the operator list of strs and initializes prior_ops
+        and next_ops attributes if they are sent in as arguments.
         """
 
         if not isinstance(operator, list):
@@ -18,6 +51,87 @@ class PauliOperator:
         self.prior_ops = prior_ops
         self.next_ops = next_ops
 
+    @classmethod
+    def from_masks(cls, num_qubits:int, x_mask:int = 0, z_mask:int = 0, r_mask:int = 0, n_mask:int = 0, p_mask:int = 0):
+        """
+        Builds a PauliOperator directly from its bitmasks, without going through a list of strs.
+        """
+        op = cls.__new__(cls)
+        op.num_qubits = num_qubits
+        op.x_mask = x_mask
+        op.z_mask = z_mask
+        op.r_mask = r_mask
+        op.n_mask = n_mask
+        op.p_mask = p_mask
+        op.prior_ops = None
+        op.next_ops = None
+        return op
+
+    # Read-only view of the operator as a tuple of strs, so op.operator[i] = pauli fails instead of
+    # editing a throwaway copy. Use op[i] = pauli or set_mask to edit the operator
+    @property
+    def operator(self) -> Tuple[str, ...]:
+        return tuple(self[i] for i in range(self.num_qubits))
+
+    @operator.setter
+    def operator(self, operator:List[str]):
+        self.num_qubits = len(operator)
+        self.x_mask = self.z_mask = self.r_mask = self.n_mask = self.p_mask = 0
+        for i in range(len(operator)):
+            self[i] = operator[i]
+
+    def __len__(self):
+        return self.num_qubits
+
+    def __getitem__(self, i:int) -> str:
+        bit = 1 << i
+        if self.x_mask & bit:
+            return 'Y' if self.z_mask & bit else 'X'
+        if self.z_mask & bit:
+            return 'Z'
+        if self.r_mask & bit:
+            return 'R'
+        if self.n_mask & bit:
+            return 'N'
+        if self.p_mask & bit:
+            return 'P'
+        return 'I'
+
+    def __setitem__(self, i:int, pauli:str):
+        self.set_mask(1 << i, pauli)
+
+    def __repr__(self):
+        return f"PauliOperator({''.join(self.operator)!r})"
+
+    # Sets every qubit in mask to pauli
+    def set_mask(self, mask:int, pauli:str):
+        self.x_mask &= ~mask
+        self.z_mask &= ~mask
+        self.r_mask &= ~mask
+        self.n_mask &= ~mask
+        self.p_mask &= ~mask
+        for attr in SYMBOL_MASKS[pauli]:
+            setattr(self, attr, getattr(self, attr) | mask)
+
+    # Mask of the non-identity qubits
+    @property
+    def support(self) -> int:
+        return self.x_mask | self.z_mask | self.r_mask | self.n_mask | self.p_mask
+
+    # Hamming weight of the operator
+    @property
+    def weight(self) -> int:
+        return self.support.bit_count()
+
+    # Tuple of masks restricted to the qubits in keep_mask, used to compare and group operators by value
+    def key(self, keep_mask:int = -1) -> tuple:
+        return (self.x_mask & keep_mask, self.z_mask & keep_mask, self.r_mask & keep_mask, 
+                self.n_mask & keep_mask, self.p_mask & keep_mask)
+
+    # Copies the operator's masks, but not its prior_ops and next_ops
+    def copy(self) -> PauliOperator:
+        return PauliOperator.from_masks(self.num_qubits, self.x_mask, self.z_mask, self.r_mask, self.n_mask, self.p_mask)
+
     """
     This function determines all possible operators at the Layer one depth away from this operator,
     that this operator can propagate to.
@@ -39,28 +153,32 @@ class PauliOperator:
     def weight_to_operators(self, sib_ops:List[PauliOperator], next_weight:int, pos_to_fill:List[tuple], backward:int):
         next_gate_weight = next_weight
 
-        unordered_pos_to_fill = {pos for gate_pos in pos_to_fill for pos in gate_pos}
-        neighbor_operator = copy.deepcopy(self.operator)
-        for i in range(len(self.operator)):
-            if i not in unordered_pos_to_fill and (self.operator[i] == 'R' or self.operator[i] == 'N' or self.operator[i] == 'P'):
-                next_gate_weight -= 1 # Every non-gate qubit that is non-identity takes from our 
-                # overall Hamming weight available to gate qubits
-                if (backward): # if we are propagating backward, then
-                    neighbor_operator[i] = 'N' # any operator we propagate to in the prior layer
-                    # must have the same qubit at index i as the qubit at the same index in this layer
-                    # which is the next (N) layer of its prior layer
-                    for sib_op in sib_ops:
-                        sib_op.operator[i] = 'P'
-                else: # if we are propagating forward, then
-                    neighbor_operator[i] = 'P' # any operator we propagate to in the next layer
-                    # must have the same qubit at index i as the qubit at the same index in this layer
-                    # which is the prior (P) layer of its next layer
-                    if sib_ops[0].operator[i] != 'N':
-                        for sib_op in sib_ops:
-                            sib_op.operator[i] = 'N'
-                    else:
-                        for sib_op in sib_ops:
-                            sib_op.operator[i] = 'P'
+        gate_mask = 0
+        for gate_pos in pos_to_fill:
+            for pos in gate_pos:
+                gate_mask |= 1 << pos
+        neighbor_operator = self.copy()
+
+        carry_mask = (self.r_mask | self.n_mask | self.p_mask) & ~gate_mask # Non-identity non-gate qubits
+        next_gate_weight -= carry_mask.bit_count() # Every non-gate qubit that is non-identity takes from our 
+        # overall Hamming weight available to gate qubits
+        if carry_mask:
+            if (backward): # if we are propagating backward, then
+                neighbor_operator.set_mask(carry_mask, 'N') # any operator we propagate to in the prior layer
+                # must have the same qubits in carry_mask as the qubits at the same indices in this layer
+                # which is the next (N) layer of its prior layer
+                for sib_op in sib_ops:
+                    sib_op.set_mask(carry_mask, 'P')
+            else: # if we are propagating forward, then
+                neighbor_operator.set_mask(carry_mask, 'P') # any operator we propagate to in the next layer
+                # must have the same qubits in carry_mask as the qubits at the same indices in this layer
+                # which is the prior (P) layer of its next layer
+                # A qubit that this layer already copies from its prior layer ('P') stays a copy, so an idle
+                # qubit keeps one value across every layer it is carried through. The others become
+                # the source ('N') that the next layer copies
+                already_p = carry_mask & sib_ops[0].p_mask
+                for sib_op in sib_ops:
+                    sib_op.set_mask(carry_mask & ~already_p, 'N')
 
         num_RRs = next_gate_weight - len(pos_to_fill) # Number of RRs we can use to fill in the layer
 
@@ -77,7 +195,7 @@ class PauliOperator:
 
         sibs = []
         for i in range(self.list_alloc[len(pos_to_fill)][next_gate_weight]): 
-            sibs.append(PauliOperator(copy.deepcopy(neighbor_operator))) # Copies layer_str and uses to initialize PauliOperators
+            sibs.append(neighbor_operator.copy()) # Copies the neighbor's masks to initialize PauliOperators
     
         if (backward):
             self.prior_ops = sibs
@@ -164,5 +282,5 @@ class PauliOperator:
         ind1, ind2 = indices
         str1, str2 = strs
         for i in range(r_start, r_end):
-            sibs[i].operator[ind1] = str1
-            sibs[i].operator[ind2] = str2
\ No newline at end of file
+            sibs[i][ind1] = str1
+            sibs[i][ind2] = str2
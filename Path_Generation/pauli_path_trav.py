@@ -56,8 +56,13 @@ class PauliPathTrav:
         # Propagating forward
         for i in range(min_index+2, self.num_op_layers): # Goes from min_index + 2 to self.num_op_layers-1
             next_sibs_f = self.propagate_next(self.layers[i-1].forward_rnp_sibs, self.layers[i-1].pos_to_fill, 0, i)
-            self.layers[i] = PauliOpLayer(gate_pos[i-1], 0, next_sibs_f)
+            if (i < self.num_op_layers-1): # gates between this layer and the next one
+                self.layers[i] = PauliOpLayer(gate_pos[i], 0, next_sibs_f)
+            else: # last layer, nothing left to propagate forward to
+                self.layers[i] = PauliOpLayer()
+                self.layers[i].backward_rnp_sibs = next_sibs_f
 
+        self.prune_dead_branches()
         return
     
     """
@@ -115,11 +120,11 @@ class PauliPathTrav:
 
         min_layer_ops_list = []
         for arrangement in arrangements: 
-            temp = ['I'] * self.num_qubits # Generates list ['I','I',...] that has size num_qubits
+            r_mask = 0 # All 'I's
             for index in arrangement:
-                temp[index] = 'R' # Replaces all the indices specified in one of our arrangements with 'R'
+                r_mask |= 1 << index # Replaces all the indices specified in one of our arrangements with 'R'
                 # Results in a layer with Hamming weight = min_weight
-            min_layer_ops_list.append(PauliOperator(temp))
+            min_layer_ops_list.append(PauliOperator.from_masks(self.num_qubits, r_mask=r_mask))
         return min_layer_ops_list
 
 
@@ -201,4 +206,73 @@ class PauliPathTrav:
                 if (sib_ops[0].next_ops != []):
                     new_sib_ops[identifier] = sib_ops[0].next_ops
 
-        return new_sib_ops
\ No newline at end of file
+        return new_sib_ops
+
+    """
+    This function removes every PauliOperator that lies on no legal Pauli path, so that nothing downstream
+    (CircuitSim.trav_to_list, the XYZGeneration trees) spends time or memory on it. Propagation leaves
+    such operators behind: an operator whose next_ops or prior_ops came out empty is a dead end,
+    and so is everything that only leads into it.
+
+    An operator is kept if it can reach a valid last layer (no 'N', since the last operator must be all
+    'I's and 'Z's) by following next_ops, and can be reached by following next_ops from a valid first
+    layer operator (no 'P', since the first operator must be all 'I's and 'Z's). Since the sibling
+    operator lists are shared between operators and the layers' hash maps, they are filtered in place.
+
+    Args:
+        self (PauliPathTrav) : The fully propagated PauliPathTrav
+
+    Returns:
+        void : Filters the forward_rnp_sibs and backward_rnp_sibs of every layer, and the next_ops and prior_ops
+        of the remaining operators, dropping the sibling groups that end up empty
+    """
+    def prune_dead_branches(self):
+        last_index = self.num_op_layers-1
+        reaches_end = {} # id of a PauliOperator -> whether following next_ops reaches a valid last layer
+
+        # Backward pass: an operator reaches the end if any operator it propagates to does
+        def can_reach_end(op:PauliOperator, index:int):
+            if id(op) not in reaches_end:
+                if index == last_index:
+                    reaches_end[id(op)] = not op.n_mask
+                else:
+                    reaches_end[id(op)] = any(can_reach_end(next_op, index+1) for next_op in op.next_ops or [])
+            return reaches_end[id(op)]
+
+        # Forward pass: keep what a valid first layer operator reaches through operators that reach the end
+        frontier = [op for sibs in self.layers[0].forward_rnp_sibs.values() for op in sibs
+                    if not op.p_mask and can_reach_end(op, 0)]
+        keep = {id(op) for op in frontier}
+        for index in range(last_index):
+            next_frontier = []
+            for op in frontier:
+                for next_op in op.next_ops:
+                    if id(next_op) not in keep and can_reach_end(next_op, index+1):
+                        keep.add(id(next_op))
+                        next_frontier.append(next_op)
+            frontier = next_frontier
+
+        # Filtering in place updates every operator and hash map that shares a sibling list,
+        # so each list only needs to be filtered once
+        filtered = set()
+        def filter_sibs(sibs:List[PauliOperator]):
+            if sibs and id(sibs) not in filtered:
+                filtered.add(id(sibs))
+                sibs[:] = [op for op in sibs if id(op) in keep]
+
+        for layer in self.layers:
+            for rnp_sibs in (getattr(layer, 'forward_rnp_sibs', None), getattr(layer, 'backward_rnp_sibs', None)):
+                if rnp_sibs is None:
+                    continue
+                for identifier in list(rnp_sibs.keys()):
+                    sibs = rnp_sibs[identifier]
+                    for op in sibs:
+                        if id(op) in keep:
+                            filter_sibs(op.next_ops)
+                            filter_sibs(op.prior_ops)
+                    filter_sibs(sibs)
+                    if not sibs:
+                        del rnp_sibs[identifier]
+            if hasattr(layer, 'pos_to_fill'): # only needed while propagating
+                for op in [op for op in layer.pos_to_fill if id(op) not in keep]:
+                    del layer.pos_to_fill[op]
@@ -0,0 +1,53 @@
+from __future__ import annotations
+from typing import List
+from Path_Generation.xyz_generation import XYZGeneration
+
+
+"""
+This function hash-conses XYZGeneration trees: structurally identical subtrees, meaning the same
+PauliOperators in parent_ops and the same children, are replaced by one shared node, so the forest
+becomes a DAG in which every distinct suffix is stored once. The same paths run through the DAG,
+so traversals and CircuitSim.xyz_tree_branching work unchanged, and an amplitude traversal can
+compute each shared suffix once (see compute_noisy_z_spectrum_shared in Pauli_Amplitude).
+
+Shared nodes can't point back to a single rnp Pauli path, so their pauli_path is dropped.
+
+Args:
+    xyz_gen_heads (List[XYZGeneration]) : Roots of the trees, whose next_gen lists are rewritten in place
+
+Returns:
+    List[XYZGeneration] : The roots, in their original order, with identical roots shared too
+"""
+def share_subtrees(xyz_gen_heads:List[XYZGeneration]):
+    interned = {} # (op masks, ids of interned children) -> interned node
+    return [intern_subtree(xyz_gen_head, interned) for xyz_gen_head in xyz_gen_heads]
+
+
+# Interns the children of xyz_gen first, so identical subtrees have identical child ids
+def intern_subtree(xyz_gen:XYZGeneration, interned:dict):
+    if xyz_gen.next_gen is None:
+        children = None
+    else:
+        xyz_gen.next_gen = [intern_subtree(child, interned) for child in xyz_gen.next_gen]
+        children = tuple(id(child) for child in xyz_gen.next_gen)
+
+    key = (tuple((op.x_mask, op.z_mask) for op in xyz_gen.parent_ops), children)
+    shared = interned.get(key)
+    if shared is None:
+        xyz_gen.pauli_path = None
+        interned[key] = shared = xyz_gen
+    return shared
+
+
+# Number of distinct nodes reachable from the roots, counting each shared node once
+def count_nodes(xyz_gen_heads:List[XYZGeneration]):
+    seen = set()
+    stack = list(xyz_gen_heads)
+    while stack:
+        xyz_gen = stack.pop()
+        if id(xyz_gen) in seen:
+            continue
+        seen.add(id(xyz_gen))
+        if xyz_gen.next_gen is not None:
+            stack.extend(xyz_gen.next_gen)
+    return len(seen)
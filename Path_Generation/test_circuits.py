@@ -1,10 +1,21 @@
+import os
+import shutil
+import tempfile
 import unittest
+import unittest.mock
+import numpy as np
 from typing import List, Tuple, DefaultDict
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from Path_Generation.pauli_operator import PauliOperator
 from Path_Generation.pauli_op_layer import PauliOpLayer
 from Path_Generation.pauli_path_trav import PauliPathTrav
 from Path_Generation.circuit_sim import CircuitSim
+from Path_Generation.path_cache import PathCache
+from Path_Generation.flat_trees import FlatTrees
+from Path_Generation.path_store import PathStore
+from Path_Generation.subtree_sharing import count_nodes
+from Path_Generation.xyz_generation import iter_fillings, UNEXPANDED
 
 class TestCircuits(unittest.TestCase):
     @classmethod
@@ -74,6 +85,223 @@ class TestCircuits(unittest.TestCase):
                             pauli_op_weight += 1
         self.assertEqual(len(pauli_path_set), num_pauli_ops) # If there are no duplicates, every element in 
         # the list of lists would have been added to the set, making these two values equal
+
+    # Random layouts of num_layers gate layers on num_qubits qubits, the same for every run
+    @staticmethod
+    def random_gate_pos(rng, num_qubits:int, num_layers:int):
+        gate_pos = []
+        for _ in range(num_layers):
+            qubits = [int(q) for q in rng.permutation(num_qubits)]
+            num_gates = int(rng.integers(1, num_qubits // 2 + 1))
+            gate_pos.append([(qubits[2*j], qubits[2*j+1]) for j in range(num_gates)])
+        return gate_pos
+
+    def assert_paths_legal(self, num_qubits:int, gate_pos:List[List[tuple]], pauli_paths):
+        ops_set = set()
+        for pauli_path in pauli_paths:
+            ops = [''.join(pauli_op.operator) for pauli_op in pauli_path]
+            ops_set.add(tuple(ops))
+            self.assertTrue(all(p in 'IZ' for p in ops[0]) and all(p in 'IZ' for p in ops[-1]))
+            for i in range(len(gate_pos)):
+                gate_qubits = {q for gate in gate_pos[i] for q in gate}
+                for q0, q1 in gate_pos[i]: # gate I/O is either 'II' on both sides or non-identity on both sides
+                    self.assertEqual(ops[i][q0] + ops[i][q1] == 'II', ops[i+1][q0] + ops[i+1][q1] == 'II')
+                for q in range(num_qubits): # non-gate qubits carry over unchanged
+                    if q not in gate_qubits:
+                        self.assertEqual(ops[i][q], ops[i+1][q])
+        self.assertEqual(len(ops_set), len(pauli_paths)) # no duplicates
+
+    def test_deep_xyz_paths_are_legal(self):
+        # depth 3 and more, so layers are reached by propagating past the min layer, and depth 4 and more,
+        # so idle qubits are carried through several layers
+        layouts = [(3, [[(0, 1)], [(1, 2)], [(0, 1)]], 8),
+                   (5, [[(1, 3)], [(3, 4)], [(0, 2)], [(3, 4), (0, 2)]], 7),
+                   (3, [[(0, 2)], [(0, 2)], [(0, 1)], [(1, 2)]], 7)]
+        rng = np.random.default_rng(3)
+        for num_layers in (4, 5, 5):
+            layouts.append((4, self.random_gate_pos(rng, 4, num_layers), num_layers + 2))
+        for num_qubits, gate_pos, max_weight in layouts:
+            deep_circuit = CircuitSim(num_qubits, max_weight, gate_pos)
+            self.assertGreater(len(deep_circuit.xyz_pauli_paths), 0)
+            self.assert_paths_legal(num_qubits, gate_pos, deep_circuit.xyz_pauli_paths)
+            if gate_pos == layouts[1][1]: # every legal path, counted by brute force
+                self.assertEqual(len(deep_circuit.xyz_pauli_paths), 471)
+
+    def test_pauli_operator_masks(self):
+        op = PauliOperator(list('IXYZRNP'))
+        self.assertEqual(op.operator, tuple('IXYZRNP'))
+        self.assertEqual((op.x_mask, op.z_mask, op.r_mask, op.n_mask, op.p_mask), (0b110, 0b1100, 1 << 4, 1 << 5, 1 << 6))
+        self.assertEqual(op.weight, 6)
+        with self.assertRaises(TypeError): # the view is read-only, op[i] = pauli edits the operator
+            op.operator[0] = 'Z'
+        op[0] = 'Z'
+        self.assertEqual(op.operator, tuple('ZXYZRNP'))
+
+        wide_op = PauliOperator(['I']*100) # wider than a machine word
+        wide_op[99] = 'Y'
+        wide_op[64] = 'Z'
+        self.assertEqual(wide_op.weight, 2)
+        self.assertEqual(wide_op[99], 'Y')
+        self.assertEqual(wide_op.copy().operator, wide_op.operator)
+
+    def test_lazy_iteration(self):
+        lazy_circuit = CircuitSim(4, 10, [[(0, 1),(2,3)],[(1,2)]], lazy=True)
+        self.assertIsNone(lazy_circuit.xyz_gen_heads)
+        self.assertIsNone(lazy_circuit.xyz_pauli_paths)
+        lazy_paths = [tuple(tuple(op.operator) for op in path) for path in lazy_circuit.iter_paths()]
+        eager_paths = [tuple(tuple(op.operator) for op in path) for path in self.circuit.xyz_pauli_paths]
+        self.assertEqual(lazy_paths, eager_paths) # same paths in the same order
+        self.assertEqual(sum(1 for _ in lazy_circuit.iter_xyz_trees()), len(self.circuit.xyz_gen_heads))
+
+    def test_parallel_generation(self):
+        parallel_circuit = CircuitSim(4, 10, [[(0, 1),(2,3)],[(1,2)]], workers=2)
+        parallel_paths = [tuple(tuple(op.operator) for op in path) for path in parallel_circuit.xyz_pauli_paths]
+        serial_paths = [tuple(tuple(op.operator) for op in path) for path in self.circuit.xyz_pauli_paths]
+        self.assertEqual(parallel_paths, serial_paths) # merged in weight combo order
+
+    def test_count_paths(self):
+        # the shallow fixture, and circuits deep enough that idle qubits are carried through several layers
+        circuits = [self.circuit, CircuitSim(5, 7, [[(1, 3)], [(3, 4)], [(0, 2)], [(3, 4), (0, 2)]]),
+                    CircuitSim(3, 7, [[(0, 2)], [(0, 2)], [(0, 1)], [(1, 2)]]),
+                    CircuitSim(4, 7, [[(3, 2), (1, 0)], [(1, 2), (3, 0)], [(3, 0), (2, 1)], [(2, 3)], [(2, 3), (1, 0)]])]
+        for circuit in circuits:
+            counts = CircuitSim(circuit.num_qubits, circuit.max_weight, circuit.gate_pos, lazy=True).count_paths()
+            self.assertEqual(counts['total'], len(circuit.xyz_pauli_paths))
+            by_weight_combo = defaultdict(int)
+            for pauli_path in circuit.xyz_pauli_paths:
+                by_weight_combo[tuple(pauli_op.weight for pauli_op in pauli_path)] += 1
+            self.assertEqual(counts['by_weight_combo'], by_weight_combo)
+            self.assertEqual(sum(counts['by_hamming_weight'].values()), counts['total'])
+
+    def test_path_cache(self):
+        gate_pos = [[(0, 1),(2,3)],[(1,2)]]
+        path_set = {tuple(tuple(op.operator) for op in path) for path in self.circuit.xyz_pauli_paths}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path_cache = PathCache(cache_dir)
+            CircuitSim(4, 10, gate_pos, path_cache)
+            # the same architecture written differently hits the same entry
+            cached = CircuitSim(4, 10, [[(3,2),(1,0)],[(2,1)]], path_cache)
+            self.assertIsNone(cached.rnp_pauli_paths)
+            self.assertEqual(path_set, {tuple(tuple(op.operator) for op in path) for path in cached.xyz_pauli_paths})
+            self.assertEqual(len(path_set), len(cached.xyz_pauli_paths))
+
+            # entries written by another version of the generator are not loaded
+            with unittest.mock.patch('Path_Generation.path_cache.PATH_GENERATION_VERSION', 1):
+                self.assertIsNone(path_cache.load(4, 10, gate_pos))
+
+            # a second architecture pushes the cache past its bound, so the older entry is evicted
+            path_cache.max_bytes = os.path.getsize(os.path.join(cache_dir, os.listdir(cache_dir)[0]))
+            os.utime(os.path.join(cache_dir, os.listdir(cache_dir)[0]), (0, 0))
+            CircuitSim(4, 6, gate_pos, path_cache)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertIsNone(path_cache.load(4, 10, gate_pos))
+
+    def test_flat_trees(self):
+        flat = self.circuit.to_flat_trees()
+        self.assertEqual(flat.num_layers, self.circuit.num_op_layers)
+        self.assertEqual(flat.num_ops, flat.op_start[-1])
+
+        # paths below node i = its number of ops times the paths below its children
+        paths = np.zeros(flat.num_nodes, dtype=np.int64)
+        for i in reversed(range(flat.num_nodes)):
+            num_ops = flat.op_start[i+1] - flat.op_start[i]
+            children = paths[flat.child_start[i]:flat.child_start[i+1]]
+            paths[i] = num_ops * (children.sum() if len(children) else 1)
+        self.assertEqual(paths[:flat.layer_start[1]].sum(), len(self.circuit.xyz_pauli_paths))
+
+        with tempfile.TemporaryDirectory() as directory:
+            flat.save(directory)
+            mapped = FlatTrees.load(directory)
+            self.assertIsInstance(mapped.x_words, np.memmap)
+            for k in range(flat.num_layers):
+                for name, array in flat.layer(k).items():
+                    self.assertTrue(np.array_equal(array, mapped.layer(k)[name]))
+            del mapped
+
+    def test_iter_fillings(self):
+        fillings = [''.join(op.operator) for op in iter_fillings(PauliOperator(list('RINZ')), [0, 2])]
+        self.assertEqual(fillings, [a + 'I' + b + 'Z' for a in 'XYZ' for b in 'XYZ'])
+
+    def test_lazy_xyz_expansion(self):
+        circuit = CircuitSim(4, 10, [[(0, 1),(2,3)],[(1,2)]], lazy=True)
+        heads = list(circuit.iter_xyz_trees())
+        self.assertTrue(all(head._next_gen is UNEXPANDED for head in heads)) # nothing below the roots yet
+        lazy_paths = [tuple(tuple(op.operator) for op in path) for head in heads for path in circuit.xyz_tree_branching(head, [])]
+        self.assertEqual(lazy_paths, [tuple(tuple(op.operator) for op in path) for path in self.circuit.xyz_pauli_paths])
+        self.assertTrue(all(head._next_gen is UNEXPANDED for head in heads)) # the walk let go of what it built
+        self.assertEqual(lazy_paths, [tuple(tuple(op.operator) for op in path) for head in heads for path in circuit.xyz_tree_branching(head, [])])
+        with self.assertRaises(AttributeError):
+            heads[0].memo = {} # slotted, like PauliOperator
+
+    def test_share_subtrees(self):
+        circuit = CircuitSim(4, 10, [[(0, 1),(2,3)],[(1,2)]], lazy=True)
+        num_nodes = count_nodes(list(circuit.iter_xyz_trees()))
+        circuit.share_subtrees()
+        self.assertLess(count_nodes(circuit.xyz_gen_heads), num_nodes)
+
+        # the DAG holds exactly the same paths
+        path_set = [tuple(tuple(op.operator) for op in path) for path in self.circuit.xyz_pauli_paths]
+        shared_path_set = [tuple(tuple(op.operator) for op in path) for path in circuit.iter_paths()]
+        self.assertEqual(sorted(path_set), sorted(shared_path_set))
+
+    def test_path_store(self):
+        circuit = CircuitSim(4, 10, [[(0, 1),(2,3)],[(1,2)]], lazy=True)
+        with tempfile.TemporaryDirectory() as directory:
+            path_store = PathStore(directory)
+            num_chunks = path_store.write(circuit.iter_xyz_trees(), 4, roots_per_chunk=10)
+            self.assertEqual(num_chunks, -(-len(self.circuit.xyz_gen_heads) // 10))
+            self.assertEqual(len(path_store), num_chunks)
+
+            # the chunks hold the same trees, just flattened 10 roots at a time
+            flat = self.circuit.to_flat_trees()
+            chunks = list(path_store)
+            self.assertEqual(sum(chunk.layer_start[1] for chunk in chunks), len(self.circuit.xyz_gen_heads))
+            self.assertEqual(sum(chunk.num_nodes for chunk in chunks), flat.num_nodes)
+            self.assertEqual(sum(chunk.num_ops for chunk in chunks), flat.num_ops)
+            del chunks
+
+            # concurrent writers and a removed chunk never make two chunks share a name
+            shutil.rmtree(path_store.chunk_dirs()[0])
+            with ThreadPoolExecutor(4) as pool:
+                list(pool.map(lambda _: path_store.write(iter(self.circuit.xyz_gen_heads), 4, roots_per_chunk=10), range(4)))
+            self.assertEqual(len(path_store), 5 * num_chunks - 1)
+
+            # a failed write leaves no temporary directory behind
+            with self.assertRaises(AttributeError):
+                path_store.write_chunk(None)
+            self.assertEqual(len(os.listdir(directory)), len(path_store))
+
+    def test_extend(self):
+        gate_pos = [[(0, 1),(2,3)],[(1,2)]]
+        circuit = CircuitSim(4, 6, gate_pos)
+        num_old_paths = len(circuit.xyz_pauli_paths)
+        new_heads = circuit.extend(10)
+        self.assertEqual(circuit.xyz_gen_heads[-len(new_heads):], new_heads)
+
+        # the extended circuit holds the same combos and paths as one built at the new bound
+        path_set = sorted(tuple(tuple(op.operator) for op in path) for path in self.circuit.xyz_pauli_paths)
+        self.assertEqual(sorted(map(tuple, circuit.weight_combos)), sorted(map(tuple, self.circuit.weight_combos)))
+        self.assertEqual(sorted(tuple(tuple(op.operator) for op in path) for path in circuit.xyz_pauli_paths), path_set)
+        self.assertEqual(len(circuit.rnp_pauli_paths), len(circuit.weight_combos))
+
+        # only paths heavier than the old bound are new
+        new_paths = [path for head in new_heads for path in circuit.xyz_tree_branching(head, [])]
+        self.assertEqual(len(new_paths), len(path_set) - num_old_paths)
+        self.assertTrue(all(sum(op.weight for op in path) > 6 for path in new_paths))
+
+        lazy = CircuitSim(4, 6, gate_pos, lazy=True)
+        lazy_new_paths = [path for head in lazy.extend(10) for path in lazy.xyz_tree_branching(head, [])]
+        self.assertEqual(len(lazy_new_paths), len(new_paths))
+        self.assertEqual(sum(1 for _ in lazy.iter_paths()), len(path_set))
+
+    def test_prune_dead_branches(self):
+        circuit = CircuitSim(3, 8, [[(0, 1)], [(1, 2)], [(0, 1)]])
+        for trav, rnp_paths in zip(circuit.pauli_path_travs, circuit.rnp_pauli_paths):
+            on_path = {id(op) for pauli_path in rnp_paths for op in pauli_path}
+            for layer in trav.layers: # every operator left in the trav lies on some Pauli path
+                for rnp_sibs in (getattr(layer, 'forward_rnp_sibs', None), getattr(layer, 'backward_rnp_sibs', None)):
+                    for sibs in (rnp_sibs or {}).values():
+                        self.assertTrue(sibs and all(id(op) in on_path for op in sibs))
     
 
 if __name__ == '__main__':
@@ -1,22 +1,124 @@
 from __future__ import annotations
-import copy
-from typing import List
-from Path_Generation.pauli_operator import PauliOperator
+import numpy as np
+from typing import Callable, List
+from Path_Generation.pauli_operator import PauliOperator, mask_positions
+
+UNEXPANDED = object() # next_gen of a lazy XYZGeneration that has not been built yet
+ZERO_TOL = 1e-12 # Pauli transfer matrix entries at or below this magnitude are treated as zero
+# Bump whenever PauliPathTrav or XYZGeneration change which trees are built or the order of their nodes,
+# so PathCache entries written by an older generator are not loaded
+PATH_GENERATION_VERSION = 3
+
+
+"""
+This function yields every copy of op whose qubits at the positions in pos_list hold a combination
+of 'X', 'Y', and 'Z', one operator at a time. It counts in base 3 with one digit per position, the
+first position being the most significant, so the combinations come in the order
+'X...X', 'X...Y', 'X...Z', ..., 'Z...Z'.
+
+Args:
+    op (PauliOperator) : The operator to fill, which is not modified
+    pos_list (List[int]) : The qubit positions to fill with non-identity Paulis
+    allowed (Callable[[int, int], bool]) : Optional test on the x_mask and z_mask of each filling;
+        the fillings it rejects are skipped before any operator is built
+
+Returns:
+    Iterator[PauliOperator] : Up to 3 ** len(pos_list) new operators
+"""
+def iter_fillings(op:PauliOperator, pos_list:List[int], allowed:Callable[[int, int], bool] = None):
+    pos_bits = [1 << pos for pos in pos_list]
+    clear = ~sum(pos_bits)
+    x_base, z_base = op.x_mask & clear, op.z_mask & clear
+    r_mask, n_mask, p_mask = op.r_mask & clear, op.n_mask & clear, op.p_mask & clear
+
+    digits = [0] * len(pos_list) # 0, 1, 2 stand for 'X', 'Y', 'Z'
+    while True:
+        x_mask, z_mask = x_base, z_base
+        for bit, digit in zip(pos_bits, digits):
+            if digit != 2: # 'X' or 'Y'
+                x_mask |= bit
+            if digit != 0: # 'Y' or 'Z'
+                z_mask |= bit
+        if allowed is None or allowed(x_mask, z_mask):
+            yield PauliOperator.from_masks(op.num_qubits, x_mask, z_mask, r_mask, n_mask, p_mask)
+
+        i = len(digits) - 1 # increments the counter, carrying into the more significant digits
+        while i >= 0 and digits[i] == 2:
+            digits[i] = 0
+            i -= 1
+        if i < 0:
+            return
+        digits[i] += 1
+
+
+# Row or column of a gate's Pauli transfer matrix for the Paulis on its qubits, the first qubit
+# being the most significant base-4 digit
+def gate_pauli_index(x_mask:int, z_mask:int, qubit_indices:tuple):
+    index = 0
+    for q in qubit_indices:
+        index = 4*index + ((x_mask >> q) & 1 | ((z_mask >> q) & 1) << 1)
+    return index
+
 
 class XYZGeneration:
     """
     Initiates a list of all PauliOperator objects that map to the same next PauliOperator object list
     """
-    def __init__(self, pauli_ops:List[PauliOperator],next_index:int, pauli_path:List[PauliOperator]):
+    __slots__ = ('parent_ops', 'pauli_path', 'next_index', 'compiled_circuit', 'lazy', '_next_gen')
+
+    def __init__(self, pauli_ops:List[PauliOperator],next_index:int, pauli_path:List[PauliOperator], lazy:bool = False,
+                 compiled_circuit = None):
         self.parent_ops = pauli_ops
         self.pauli_path = pauli_path
-
-        if next_index == len(self.pauli_path):
-            self.next_gen = None
-        elif self.pauli_path[next_index].next_ops == None: # next_op is in the last layer of the Pauli path
-            self.rp_to_z(self.pauli_path[next_index]) # must only use 'I's and 'Z's
+        self.next_index = next_index
+
+        # With the compiled circuit (a CompiledCircuit from Pauli_Amplitude.pauli_transfer), the
+        # children that every parent operator reaches through a zero transfer matrix entry are skipped
+        self.compiled_circuit = compiled_circuit
+
+        # A lazy generation only builds its children when next_gen is first read,
+        # so subtrees that a traversal never reaches are never built
+        self.lazy = lazy
+        self._next_gen = UNEXPANDED
+        if not lazy:
+            self.expand()
+
+    @property
+    def next_gen(self):
+        if self._next_gen is UNEXPANDED:
+            self.expand()
+        return self._next_gen
+
+    @next_gen.setter
+    def next_gen(self, next_gen):
+        self._next_gen = next_gen
+        self.lazy = False # children set from outside, e.g. shared subtrees, are kept
+
+    # Reads next_gen for a walk that visits each node once. A lazy node lets go of its children
+    # afterwards, so the walk only holds the part of the tree it has yet to visit rather than the
+    # whole tree, and walking the node again builds them anew
+    def take_next_gen(self):
+        next_gen = self.next_gen
+        if self.lazy:
+            self._next_gen = UNEXPANDED
+        return next_gen
+
+    # Whether at least one Pauli path runs from this generation to a leaf, which gate-aware pruning
+    # can rule out for a whole subtree. A lazy generation only builds its subtree as far as it takes to
+    # find a leaf, and lets go of what it built (see take_next_gen)
+    def leads_to_leaf(self) -> bool:
+        next_gen = self.take_next_gen()
+        return next_gen is None or any(child.leads_to_leaf() for child in next_gen)
+
+    # Builds the XYZGenerations that can directly follow this one
+    def expand(self):
+        if self.next_index == len(self.pauli_path):
+            self._next_gen = None
+        elif self.pauli_path[self.next_index].next_ops == None: # next_op is in the last layer of the Pauli path
+            if not self.rp_to_z(self.pauli_path[self.next_index]): # must only use 'I's and 'Z's
+                self._next_gen = [] # no legal last layer follows
         else:
-            self.rnp_to_xyz(next_index)
+            self.rnp_to_xyz(self.next_index)
 
     # We traverse the Pauli path from left to right (moving from a prior index to this next_index). 
     # If we encounter an 'R' or 'N', we can do any of 'X', 'Y', and 'Z'.
@@ -25,80 +127,38 @@ class XYZGeneration:
         r_pos_list = []
         n_pos_list = []
 
-        self.fill_pos_lists(next_index, r_pos_list, n_pos_list)
-
-        filled_n_list = []
-
-        # We will fill in the 'N' positions with 'X', 'Y', and 'Z' in all possible combinations
-        # resulting in 3 ** len(n_pos_list) configurations
-        for i in range(3 ** len(n_pos_list)):
-            filled_n_list.append(copy.deepcopy(self.pauli_path[next_index]))
-
-        self.fill_in_pos(filled_n_list,n_pos_list,'X',0,0)
-        self.fill_in_pos(filled_n_list,n_pos_list,'Y',0,3 ** (len(n_pos_list)-1))
-        self.fill_in_pos(filled_n_list,n_pos_list,'Z',0,2 * (3 ** (len(n_pos_list)-1)))
-
-        filled_rn_list = [[] for _ in range(len(filled_n_list))] # one grouping per n filling configuration
-
-        for i in range(len(filled_n_list)):
-            for j in range(3 ** len(r_pos_list)): # 3 options for every 'R' position
-                filled_rn_list[i].append(copy.deepcopy(filled_n_list[i]))
-
-            self.fill_in_pos(filled_rn_list[i],r_pos_list,'X',0,0)
-            self.fill_in_pos(filled_rn_list[i],r_pos_list,'Y',0,3 ** (len(r_pos_list)-1))
-            self.fill_in_pos(filled_rn_list[i],r_pos_list,'Z',0,2 * (3 ** (len(r_pos_list)-1)))
-        
-        self.next_gen = []
-        for i in range(len(filled_n_list)):
-            self.next_gen.append(XYZGeneration(filled_rn_list[i],next_index+1, self.pauli_path))
-
-    def fill_pos_lists(self, next_index:int, r_pos_list: List[int], n_pos_list: List[int]):
-        for i in range(len(self.pauli_path[next_index].operator)):
-            if self.pauli_path[next_index].operator[i] == 'R':
-                r_pos_list.append(i)
-            elif self.pauli_path[next_index].operator[i] == 'N':
-                carries = self.carries_to_the_end(next_index, i)
-                if (carries == 1): # if the qubit remains a non-gate qubit to the last layer
-                    self.pauli_path[next_index].operator[i] = 'Z' # to ensure that the last layer is all 'I's and 'Z's
-                elif(carries == 2):
-                    raise ValueError
-                else:
-                    n_pos_list.append(i)
-            elif self.pauli_path[next_index].operator[i] == 'P': # the qubit is forced to be the same as the prior qubit
-                self.pauli_path[next_index].operator[i] = self.parent_ops[0].operator[i]
+        # The rnp operator is shared by every XYZGeneration built from this Pauli path,
+        # so we resolve its 'N's and 'P's on a copy rather than in place
+        next_op = self.pauli_path[next_index].copy()
+        self.fill_pos_lists(next_index, next_op, r_pos_list, n_pos_list)
+
+        # One child per filling of the 'N' positions, holding every filling of the 'R' positions.
+        # The fillings are counted out one at a time, so no intermediate lists of copies are built
+        allowed = self.gate_filter(next_index)
+        self._next_gen = []
+        for filled_n_op in iter_fillings(next_op, n_pos_list):
+            next_ops = list(iter_fillings(filled_n_op, r_pos_list, allowed))
+            if not next_ops: # every filling of the 'R's may be cut off by the gates
+                continue
+            next_gen = XYZGeneration(next_ops, next_index+1, self.pauli_path, self.lazy, self.compiled_circuit)
+            if self.lazy or next_gen.next_gen != []: # an eagerly built child is dropped if it leads nowhere
+                self._next_gen.append(next_gen)
+
+    def fill_pos_lists(self, next_index:int, next_op:PauliOperator, r_pos_list: List[int], n_pos_list: List[int]):
+        rnp_op = self.pauli_path[next_index]
+        r_pos_list.extend(mask_positions(rnp_op.r_mask))
+        for i in mask_positions(rnp_op.n_mask):
+            carries = self.carries_to_the_end(next_index, i)
+            if (carries == 1): # if the qubit remains a non-gate qubit to the last layer
+                next_op[i] = 'Z' # to ensure that the last layer is all 'I's and 'Z's
+            elif(carries == 2):
+                raise ValueError
+            else:
+                n_pos_list.append(i)
+        for i in mask_positions(rnp_op.p_mask): # the qubit is forced to be the same as the prior qubit
+            next_op[i] = self.parent_ops[0][i]
 
 
-    """
-    This function recursively fills specified qubit positions of PauliOperators in
-    filled_pos list with all possible combinations of 'X', 'Y', and 'Z'
-
-    Args:
-        self (XYZGeneration) :  The XYZGeneration instance, used to recursively call this function.
-        filled_pos (List[PauliOperator]) : The list of PauliOperators to fill with all possible combinations
-        of 'X', 'Y', and 'Z' at the positions in pos_list. This list is updated in place.
-        pos_list (List[int]) : The list of qubit positions that we will recursively fill with
-        non-identity Paulis.
-        index (int) : The index of pos_list that contains the qubit position at which we want to 
-        edit every PauliOperator in filled_pos in the range beginning with start.
-        pauli (str) : The Pauli ('X', 'Y', or 'Z') to write to that given index .
-        start (int) : The beginning of the range of PauliOperators in filled_pos that
-        we should edit on this function call.
-
-    Returns:
-        void : Updates filled_pos to contain all PauliOperators whose qubits at the positions in pos_list
-        contain all possible combinations of "X", "Y", and "Z".
-    """
-    def fill_in_pos(self,filled_pos:List[PauliOperator],pos_list:List[int], index:int, pauli:str, start:int):
-        if index == len(pos_list): # We have filled all positions in pos_list
-            return
-        
-        for i in range(start, start + (3 ** (len(pos_list)-index-1))):
-            filled_pos[i].operator[pos_list[index]] = pauli
-        
-        self.fill_in_pos(filled_pos,pos_list,'X', index+1,start)
-        self.fill_in_pos(filled_pos,pos_list,'Y', index+1,start+(3 ** (len(pos_list)-index-2)))
-        self.fill_in_pos(filled_pos,pos_list,'Z', index+1,start+(2 * (3 ** (len(pos_list)-index-2))))
-
     # Checks if the non-gate qubit at index i in the Pauli operator at index pauli_path_index
     # in the Pauli path carries to the end of the Pauli path, i.e., if it remains a non-gate qubit
     # until the last layer of the Pauli path. In this case, it would be forced to 
@@ -108,20 +168,39 @@ class XYZGeneration:
             return 1 # the non-gate qubit remain a non-gate qubit to the last layer
         elif (self.pauli_path[pauli_path_index].next_ops == []): # NEED TO CHECK IF THIS CAUSES ANY ISSUES
             return 2
-        elif self.pauli_path[pauli_path_index].next_ops[0].operator[i] == 'P':
+        elif (self.pauli_path[pauli_path_index].next_ops[0].p_mask >> i) & 1:
             return self.carries_to_the_end(pauli_path_index+1, i)
         return 0
 
 
     # The last Pauli operator in a Pauli path can only be a tensor of 'I's and 'Z's
     def rp_to_z(self, next_op:PauliOperator):
-        for i in range(len(next_op.operator)):
-            if next_op.operator[i] == 'R':
-                next_op.operator[i] = 'Z'
-            elif next_op.operator[i] == 'N':
-                return 0 # there should be no 'N' in our last layer
-            elif next_op.operator[i] == 'P':
-                next_op.operator[i] = 'Z' # we set up our propagation to gurantee the prior of the last layer 
-                # would have all Z's in non-gate qubit positions with Hamming weight
-            self.next_gen = [XYZGeneration([next_op],len(self.pauli_path),self.pauli_path)] 
-        return 1 # valid operator possible
\ No newline at end of file
+        if next_op.n_mask:
+            return 0 # there should be no 'N' in our last layer
+        last_op = next_op.copy() # next_op is shared by every Pauli path that ends with it
+        last_op.set_mask(last_op.r_mask | last_op.p_mask, 'Z') # we set up our propagation to gurantee the prior of the last layer 
+        # would have all Z's in non-gate qubit positions with Hamming weight
+        allowed = self.gate_filter(len(self.pauli_path)-1)
+        if allowed is not None and not allowed(last_op.x_mask, last_op.z_mask):
+            self._next_gen = [] # the gates cannot reach the last operator
+        else:
+            self._next_gen = [XYZGeneration([last_op],len(self.pauli_path),self.pauli_path)]
+        return 1 # valid operator possible
+
+    # With a compiled circuit, returns a test on the masks of an operator at next_index that fails
+    # if, for some gate between parent_ops and next_index, the transfer matrix entry is zero from
+    # every parent operator. The amplitude is a product over the gates, so such an operator has a
+    # zero transition amplitude from all of parent_ops. Returns None when nothing can be cut
+    def gate_filter(self, next_index:int):
+        if self.compiled_circuit is None:
+            return None
+        gate_checks = []
+        for qubit_indices, ptm in self.compiled_circuit.layers[next_index-1]:
+            cols = sorted({gate_pauli_index(op.x_mask, op.z_mask, qubit_indices) for op in self.parent_ops})
+            nonzero_rows = np.abs(ptm[:, cols]).max(axis=1) > ZERO_TOL
+            if not nonzero_rows.all():
+                gate_checks.append((qubit_indices, nonzero_rows))
+        if not gate_checks:
+            return None
+        return lambda x_mask, z_mask: all(nonzero_rows[gate_pauli_index(x_mask, z_mask, qubit_indices)]
+                                          for qubit_indices, nonzero_rows in gate_checks)
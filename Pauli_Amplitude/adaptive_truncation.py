@@ -0,0 +1,116 @@
+import math
+from Path_Generation.circuit_sim import CircuitSim
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Pauli_Amplitude.fourier_spectrum import FourierSpectrum
+
+
+def tail_bound(n, gamma, max_weight, num_op_layers):
+    """
+    Bound, in expectation over random circuits, on the L1 distance between the noisy output
+    distribution and its truncation at max_weight, following Aharonov et al. Every omitted path
+    has total Hamming weight above max_weight, so the noise damps it by (1 - γ)^(max_weight+1) or
+    more, and distinct paths are orthogonal on average, so
+
+        E Σ_x (q(x) - q_ℓ(x))² ≤ (1 - γ)^(2(ℓ+1)) E Σ_x p(x)² ≤ (1 - γ)^(2(ℓ+1)) · 2/(2^n + 1)
+
+    by anticoncentration. Cauchy–Schwarz over the 2^n outcomes turns this into an L1 bound.
+
+    Parameters:
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+        max_weight (int): Upper bound on the total Hamming weight of the kept paths.
+        num_op_layers (int): Number of Pauli operators in a path (circuit depth + 1).
+
+    Returns:
+        float: Bound on E‖q - q_ℓ‖₁, 0 once max_weight leaves no path out.
+    """
+    if max_weight >= n * num_op_layers:
+        return 0.0
+    return math.sqrt(2.0 / (1 + 2.0 ** (-n))) * (1 - gamma) ** (max_weight + 1)
+
+
+class AdaptiveTruncation:
+    """
+    Picks the Hamming weight truncation for a target error instead of taking it by hand. run()
+    starts at the lightest possible paths and raises the truncation one weight at a time with
+    CircuitSim.extend, so only the paths of the new weight are generated and traversed at each
+    step, and stops once
+
+        - tail_bound shows that the omitted tail is below epsilon ('bound'),
+        - the estimated tail from the last step is below tol ('converged'), or
+        - max_weight_limit is reached ('limit').
+
+    Each step's added coefficients Δc give its L1 change ‖Δq‖₁ ≤ 2^(n/2) ‖Δc‖₂ (Parseval). Each
+    further weight damps a path by another (1 - γ), so with orthogonal steps the squared masses of
+    the later steps fall off at least like (1 - γ)^2, and the tail after a step of size s is
+    estimated as s · sqrt(r / (1 - r)) with r = (1 - γ)^2. Without noise (γ = 0) nothing is damped,
+    so neither the bound nor the estimate can stop the run, and max_weight_limit is required.
+    """
+
+    def __init__(self, C, n, gate_pos, gamma, epsilon, tol=None, max_weight_limit=None):
+        '''
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples
+        n (int): Number of qubits
+        gate_pos (List[List[tuple]]): Gate positions of each layer, as CircuitSim takes them
+        gamma (float): Depolarizing noise rate
+        epsilon (float): Target L1 error of the truncated distribution
+        tol (float): Estimated tail that counts as converged, epsilon if None
+        max_weight_limit (int): Largest truncation to try, every path if None (only allowed with noise)
+        '''
+        if gamma <= 0 and max_weight_limit is None:
+            raise ValueError("Without noise the tail is never damped, so a max_weight_limit is needed.")
+
+        self.C = compile_circuit(C, n)
+        self.n = n
+        self.gate_pos = gate_pos
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.tol = epsilon if tol is None else tol
+        self.num_op_layers = len(gate_pos) + 1
+        self.max_weight_limit = n * self.num_op_layers if max_weight_limit is None else max_weight_limit
+
+        self.circuit = None
+        self.spectrum = None
+        self.max_weight = None # the chosen truncation
+        self.step_sizes = [] # (max_weight, L1 bound on the change of that step), in order
+        self.estimated_tail = None
+        self.error_bound = None
+        self.stop_reason = None
+
+    def run(self):
+        """
+        Raises the truncation until one of the stopping rules holds. Afterwards, max_weight,
+        error_bound, estimated_tail, step_sizes, stop_reason, and circuit describe the result.
+
+        Returns:
+            FourierSpectrum: The spectrum at the chosen truncation, including the all-I path.
+        """
+        # lazy, so each step only holds the trees of its own weight
+        self.circuit = CircuitSim(self.n, self.num_op_layers, self.gate_pos, lazy=True)
+        self.spectrum = FourierSpectrum.from_trees(self.C, self.circuit.iter_xyz_trees(), self.n, self.gamma)
+        self.max_weight = self.num_op_layers
+        self.step_sizes = []
+
+        damping = (1 - self.gamma) ** 2
+        tail_factor = math.sqrt(damping / (1 - damping)) if damping < 1 else None # no estimate without noise
+        self.estimated_tail = math.inf
+        while True:
+            self.error_bound = tail_bound(self.n, self.gamma, self.max_weight, self.num_op_layers)
+            if self.error_bound <= self.epsilon:
+                self.stop_reason = 'bound'
+                break
+            if self.estimated_tail <= self.tol:
+                self.stop_reason = 'converged'
+                break
+            if self.max_weight >= self.max_weight_limit:
+                self.stop_reason = 'limit'
+                break
+
+            self.max_weight += 1
+            added = self.spectrum.extend(self.C, self.circuit.extend(self.max_weight), self.gamma)
+            step_size = 2.0 ** (self.n / 2) * math.sqrt(sum(coeff * coeff for coeff in added.values()))
+            self.step_sizes.append((self.max_weight, step_size))
+            if added and tail_factor is not None: # a weight without any paths says nothing about the tail
+                self.estimated_tail = step_size * tail_factor
+
+        return self.spectrum
@@ -0,0 +1,142 @@
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from Path_Generation.circuit_sim import CircuitSim
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Pauli_Amplitude.tree_traverse_pauli_amp import push_tree_weights, add_identity_path
+from Pauli_Amplitude.fourier_spectrum import FourierSpectrum
+from Pauli_Amplitude.adaptive_truncation import tail_bound
+
+
+def resident_bytes():
+    """
+    Resident memory of this process, read from /proc where available, otherwise its peak
+    resident memory so far.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024 # bytes on macOS, kilobytes elsewhere
+
+
+class AnytimeEvaluation:
+    """
+    Builds the spectrum under a wall-clock and/or memory budget, and can be cancelled from another
+    thread. The noise damps a path of total Hamming weight W by (1 - γ)^W, so the paths are
+    generated and traversed lightest weight first (with CircuitSim.extend on a lazy circuit). A weight
+    is only added to the spectrum once all of its trees are in, so whenever the run stops, the spectrum
+    is exactly the truncation at the last completed weight, and the rest is bounded by tail_bound there.
+
+    The cancellation is checked before every tree, and the budgets before every check_interval-th
+    one (reading the resident memory costs a file read), so a run overshoots them by at most the
+    time and memory of check_interval trees.
+    """
+
+    def __init__(self, C, n, gate_pos, gamma, max_weight=None, time_budget=None, memory_budget=None,
+                 cancel_event=None, check_interval=32):
+        '''
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples
+        n (int): Number of qubits
+        gate_pos (List[List[tuple]]): Gate positions of each layer, as CircuitSim takes them
+        gamma (float): Depolarizing noise rate
+        max_weight (int): Heaviest paths to include, every path if None
+        time_budget (float): Seconds run may take, no limit if None
+        memory_budget (int): Resident bytes of the process at which run stops, no limit if None
+        cancel_event (threading.Event): Event that stops the run once set, e.g. shared with a scheduler,
+        which is left to clear it. A new one is made if None; cancel() sets it, and run() clears it
+        again when it returns, so the object can be run again
+        check_interval (int): Number of trees between two checks of the budgets
+        '''
+        self.C = compile_circuit(C, n)
+        self.n = n
+        self.gate_pos = gate_pos
+        self.gamma = gamma
+        self.num_op_layers = len(gate_pos) + 1
+        self.max_weight = n * self.num_op_layers if max_weight is None else max_weight
+        self.time_budget = time_budget
+        self.memory_budget = memory_budget
+        self.owns_cancel_event = cancel_event is None
+        self.cancel_event = threading.Event() if cancel_event is None else cancel_event
+        self.check_interval = check_interval
+
+        self.spectrum = None
+        self.completed_weight = None # the spectrum holds every path of at most this weight, and no other
+        self.error_bound = None
+        self.stop_reason = None
+        self.num_trees = 0 # trees in the spectrum
+
+    # Asks a run in progress, e.g. in another thread, to stop after its current tree, or the next
+    # run if none is in progress
+    def cancel(self):
+        self.cancel_event.set()
+
+    # Why the run has to stop now, or None if it can go on. The budgets are only checked if check_budgets
+    def _interruption(self, deadline, check_budgets=True):
+        if self.cancel_event.is_set():
+            return 'cancelled'
+        if not check_budgets:
+            return None
+        if deadline is not None and time.monotonic() >= deadline:
+            return 'time'
+        if self.memory_budget is not None and resident_bytes() >= self.memory_budget:
+            return 'memory'
+        return None
+
+    # Yields each total path weight with an iterator over the trees of exactly that weight, lightest first
+    def _weight_classes(self):
+        circuit = CircuitSim(self.n, self.num_op_layers, self.gate_pos, lazy=True)
+        yield self.num_op_layers, circuit.iter_xyz_trees()
+        for path_weight in range(self.num_op_layers + 1, self.max_weight + 1):
+            yield path_weight, circuit.extend(path_weight)
+
+    def run(self):
+        """
+        Adds paths to the spectrum, lightest weight first, until every path up to max_weight is in
+        or the run is interrupted. The trees of the weight in progress when the run is interrupted are
+        dropped, so the spectrum is the truncation at completed_weight. Afterwards, completed_weight,
+        error_bound (the bound on the L1 error of that truncation, see tail_bound), num_trees, and
+        stop_reason ('complete', 'time', 'memory', or 'cancelled') describe the partial result.
+
+        Returns:
+            FourierSpectrum: The spectrum of the paths added so far, including the all-I path.
+        """
+        deadline = None if self.time_budget is None else time.monotonic() + self.time_budget
+        self.num_trees = 0
+
+        z_spectrum = add_identity_path(defaultdict(float), self.n)
+        self.completed_weight = self.num_op_layers - 1 # no path other than the all-'I' one is lighter than the number of layers
+        self.stop_reason = self._interruption(deadline)
+
+        if self.stop_reason is None and self.max_weight >= self.num_op_layers:
+            num_traversed = 0
+            for path_weight, xyz_gen_heads in self._weight_classes():
+                # the weight is summed on its own and only added once complete
+                class_z_spectrum = defaultdict(float)
+                class_num_trees = 0
+                for root in xyz_gen_heads:
+                    self.stop_reason = self._interruption(deadline, num_traversed % self.check_interval == 0)
+                    if self.stop_reason is not None:
+                        break
+                    push_tree_weights(root, self.C, self.gamma, class_z_spectrum)
+                    class_num_trees += 1
+                    num_traversed += 1
+                if self.stop_reason is not None:
+                    break
+                for z_mask, coeff in class_z_spectrum.items():
+                    z_spectrum[z_mask] += coeff
+                self.num_trees += class_num_trees
+                self.completed_weight = path_weight
+
+        if self.stop_reason is None:
+            self.stop_reason = 'complete'
+            self.completed_weight = self.max_weight
+        self.error_bound = tail_bound(self.n, self.gamma, self.completed_weight, self.num_op_layers)
+        self.spectrum = FourierSpectrum(self.n, z_spectrum)
+        if self.owns_cancel_event: # the cancellation is used up, and a shared event is up to its owner
+            self.cancel_event.clear()
+        return self.spectrum
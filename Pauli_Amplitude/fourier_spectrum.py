@@ -0,0 +1,254 @@
+import numpy as np
+from bisect import bisect_left
+from collections import defaultdict
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Pauli_Amplitude.tree_traverse_pauli_amp import compute_noisy_z_spectrum, push_tree_weights, fast_walsh_hadamard, outcome_mask
+from Pauli_Amplitude.parallel_eval import compute_noisy_z_spectrum_parallel
+from Pauli_Amplitude.pauli_propagation import propagate_noisy_z_spectrum
+from Path_Generation.pauli_operator import num_mask_words, mask_to_words, words_to_mask
+
+
+def word_parity(words):
+    """
+    Parity of the number of set bits along the last axis of a uint64 array.
+
+    Parameters:
+        words (np.ndarray): uint64 array of shape (..., num_words).
+
+    Returns:
+        np.ndarray: int array of shape (...), 1 where the popcount is odd.
+    """
+    folded = np.bitwise_xor.reduce(words, axis=-1)
+    for shift in (32, 16, 8, 4, 2, 1):
+        folded = folded ^ (folded >> np.uint64(shift))
+    return (folded & np.uint64(1)).astype(np.int64)
+
+
+class FourierSpectrum:
+    """
+    Sparse noisy Fourier spectrum of a circuit: each Z-mask z of a final Pauli operator s_d
+    mapped to the summed coefficient c_z of every path ending in it, so that
+
+        q̄(C, x) = 2^(-n/2) Σ_z c_z (-1)^|z ∧ x|.
+
+    Once built, point, batch, and marginal queries cost O(#masks) and never touch the
+    Pauli path trees again.
+    """
+
+    def __init__(self, n, z_spectrum):
+        '''
+        n (int): Number of qubits
+        z_spectrum (Dict[int, float]): Z-mask (bit i is qubit i) mapped to its coefficient
+        '''
+        self.n = n
+        self.num_words = num_mask_words(n)
+        self.norm = 2.0 ** (-n / 2)
+        self._set_spectrum(z_spectrum)
+
+    def _set_spectrum(self, z_spectrum):
+        # Sorted by mask, so the masks supported on qubits [0, i] are a prefix of the arrays
+        masks = sorted(z_mask for z_mask, coeff in z_spectrum.items() if coeff != 0)
+        self.masks = masks
+        self.coeffs = np.array([z_spectrum[z_mask] for z_mask in masks], dtype=float)
+        self.words = np.array([mask_to_words(z_mask, self.num_words) for z_mask in masks],
+                              dtype=np.uint64).reshape(len(masks), self.num_words)
+
+    @classmethod
+    def from_trees(cls, C, xyz_gen_heads, n, gamma, workers=None, factorized=True):
+        """
+        Builds the spectrum with a single traversal of the Pauli path trees.
+
+        Parameters:
+            C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+            xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+            n (int): Number of qubits.
+            gamma (float): Depolarizing noise rate.
+            workers (int): If given, the roots are split across this many worker processes
+                (see compute_noisy_z_spectrum_parallel); otherwise they are walked in this process.
+            factorized (bool): Visit every tree node once with push_tree_weights.
+
+        Returns:
+            FourierSpectrum: The spectrum, including the all-I path.
+        """
+        if workers is not None:
+            return cls(n, compute_noisy_z_spectrum_parallel(C, xyz_gen_heads, n, gamma, workers,
+                                                                 factorized=factorized))
+        return cls(n, compute_noisy_z_spectrum(C, xyz_gen_heads, n, gamma, factorized))
+
+    @classmethod
+    def from_propagation(cls, C, n, max_weight, gamma):
+        """
+        Builds the spectrum with propagate_noisy_z_spectrum, without generating any Pauli paths.
+
+        Parameters:
+            C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+            n (int): Number of qubits.
+            max_weight (int): Upper bound on the total Hamming weight of a Pauli path.
+            gamma (float): Depolarizing noise rate.
+
+        Returns:
+            FourierSpectrum: The spectrum, including the all-I path.
+        """
+        return cls(n, propagate_noisy_z_spectrum(C, n, max_weight, gamma))
+
+    def extend(self, C, xyz_gen_heads, gamma):
+        """
+        Adds the paths of more trees to the spectrum in place, e.g. the new trees returned by
+        CircuitSim.extend after raising the truncation. Only the new trees are traversed, and
+        the coefficients already in the spectrum are kept as they are.
+
+        Parameters:
+            C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+            xyz_gen_heads (List[XYZGenerations]): Root nodes of the new Pauli path trees.
+            gamma (float): Depolarizing noise rate the spectrum was built with.
+
+        Returns:
+            DefaultDict[int, float]: The coefficients the new trees added, by Z-mask.
+        """
+        C = compile_circuit(C, self.n)
+        added = defaultdict(float)
+        for root in xyz_gen_heads:
+            push_tree_weights(root, C, gamma, added)
+
+        z_spectrum = defaultdict(float, zip(self.masks, self.coeffs.tolist()))
+        for z_mask, coeff in added.items():
+            z_spectrum[z_mask] += coeff
+        self._set_spectrum(z_spectrum)
+        return added
+
+    def __len__(self):
+        return len(self.masks)
+
+    def _outcome_words(self, x):
+        # Accepts a bitstring (x[i] is qubit i) or a mask that is already packed
+        if isinstance(x, str):
+            x = outcome_mask(x)
+        return np.array(mask_to_words(x, self.num_words), dtype=np.uint64)
+
+    def prob(self, x):
+        """
+        Computes q̄(C, x) for one outcome.
+
+        Parameters:
+            x (str or int): Output bitstring (e.g., "0110"), or its outcome_mask.
+
+        Returns:
+            float: Approximate probability of x.
+        """
+        signs = 1 - 2*word_parity(self.words & self._outcome_words(x))
+        return self.norm * float(signs @ self.coeffs)
+
+    def probs(self, xs, batch_size=1024):
+        """
+        Computes q̄(C, x) for every outcome in xs.
+
+        Parameters:
+            xs (Iterable[str or int]): Output bitstrings or their outcome_masks.
+            batch_size (int): Number of outcomes evaluated per vectorized step.
+
+        Returns:
+            np.ndarray: Probabilities in the order of xs.
+        """
+        outcome_words = np.array([self._outcome_words(x) for x in xs], dtype=np.uint64).reshape(-1, self.num_words)
+        result = np.empty(len(outcome_words))
+        for start in range(0, len(outcome_words), batch_size):
+            batch = outcome_words[start:start+batch_size]
+            signs = 1 - 2*word_parity(batch[:, None, :] & self.words[None, :, :])
+            result[start:start+batch_size] = self.norm * (signs @ self.coeffs)
+        return result
+
+    def marginal(self, fixed_bits):
+        """
+        Computes ∑_{x ∈ {0,1}^n: x_T = fixed_bits} q̄(C, x) as per Lemma 9. Summing out a qubit
+        kills every mask with a 'Z' on it, so only the masks inside T contribute.
+
+        Parameters:
+            fixed_bits (Dict[int, str]): Fixed qubits T mapped to '0' or '1'.
+
+        Returns:
+            float: Marginal probability.
+        """
+        fixed_mask = 0
+        ones_mask = 0
+        for i, b in fixed_bits.items():
+            fixed_mask |= 1 << i
+            if b == '1':
+                ones_mask |= 1 << i
+
+        outside = ~np.array(mask_to_words(fixed_mask, self.num_words), dtype=np.uint64)
+        inside = np.all((self.words & outside) == 0, axis=-1)
+        signs = 1 - 2*word_parity(self.words[inside] & self._outcome_words(ones_mask))
+
+        return self.norm * 2**(self.n - len(fixed_bits)) * float(signs @ self.coeffs[inside])
+
+    def prefix_marginal(self, ones_mask, num_fixed):
+        """
+        Same as marginal, with T = {0, ..., num_fixed-1}. The masks supported on T are exactly
+        the masks below 2^num_fixed, which form a prefix of the sorted arrays.
+
+        Parameters:
+            ones_mask (int): Bits of the fixed qubits (bit i is qubit i).
+            num_fixed (int): Number of leading qubits that are fixed.
+
+        Returns:
+            float: Marginal probability.
+        """
+        cut = bisect_left(self.masks, 1 << num_fixed)
+        signs = 1 - 2*word_parity(self.words[:cut] & self._outcome_words(ones_mask))
+        return self.norm * 2.0**(self.n - num_fixed) * float(signs @ self.coeffs[:cut])
+
+    def prefix_marginals(self, ones_masks, num_fixed, batch_size=1 << 22):
+        """
+        prefix_marginal for many prefixes of the same length at once.
+
+        Parameters:
+            ones_masks (List[int]): Bits of the fixed qubits of each prefix.
+            num_fixed (int): Number of leading qubits that are fixed.
+            batch_size (int): Rough number of (prefix, mask) sign entries held in memory at once.
+
+        Returns:
+            np.ndarray: Marginal probability of each prefix.
+        """
+        cut = bisect_left(self.masks, 1 << num_fixed)
+        scale = self.norm * 2.0**(self.n - num_fixed)
+
+        # With many prefixes it is cheaper to get all 2^num_fixed of them with one transform
+        if (num_fixed << num_fixed) < len(ones_masks) * cut:
+            dense_spectrum = np.zeros(1 << num_fixed)
+            dense_spectrum[self.masks[:cut]] = self.coeffs[:cut]
+            return scale * fast_walsh_hadamard(dense_spectrum)[list(ones_masks)]
+
+        prefix_words = np.array([self._outcome_words(m) for m in ones_masks], dtype=np.uint64).reshape(-1, self.num_words)
+        result = np.empty(len(prefix_words))
+        step = max(1, batch_size // max(cut, 1))
+        for start in range(0, len(prefix_words), step):
+            batch = prefix_words[start:start+step]
+            signs = 1 - 2*word_parity(batch[:, None, :] & self.words[None, :cut, :])
+            result[start:start+step] = signs @ self.coeffs[:cut]
+        return scale * result
+
+    def distribution(self):
+        """
+        Computes q̄(C, x) for all 2^n outcomes with a fast Walsh–Hadamard transform.
+
+        Returns:
+            np.ndarray: Array of length 2^n, where entry outcome_mask(x) is the probability of x.
+        """
+        dense_spectrum = np.zeros(1 << self.n)
+        dense_spectrum[self.masks] = self.coeffs
+        return self.norm * fast_walsh_hadamard(dense_spectrum)
+
+    def save(self, path):
+        """
+        Writes the spectrum to an .npz file.
+        """
+        np.savez_compressed(path, n=self.n, words=self.words, coeffs=self.coeffs)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a spectrum written by save.
+        """
+        with np.load(path) as data:
+            masks = [words_to_mask(words) for words in data['words']]
+            return cls(int(data['n']), dict(zip(masks, data['coeffs'])))
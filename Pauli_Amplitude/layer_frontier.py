@@ -0,0 +1,195 @@
+from collections import defaultdict
+import numpy as np
+from Path_Generation.flat_trees import FlatTrees
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Pauli_Amplitude.tree_traverse_pauli_amp import add_identity_path
+from Path_Generation.pauli_operator import WORD_BITS, mask_to_words, words_to_mask
+
+# Bit masks of the SWAR popcount
+POPCOUNT_MASKS = [np.uint64(0x5555555555555555), np.uint64(0x3333333333333333), np.uint64(0x0f0f0f0f0f0f0f0f)]
+POPCOUNT_MULT = np.uint64(0x0101010101010101)
+
+
+def popcount(words):
+    """
+    Number of set bits along the last axis of a uint64 array.
+
+    Parameters:
+        words (np.ndarray): uint64 array of shape (..., num_words).
+
+    Returns:
+        np.ndarray: int array of shape (...).
+    """
+    m1, m2, m4 = POPCOUNT_MASKS
+    words = words - ((words >> np.uint64(1)) & m1)
+    words = (words & m2) + ((words >> np.uint64(2)) & m2)
+    words = (words + (words >> np.uint64(4))) & m4
+    return ((words * POPCOUNT_MULT) >> np.uint64(56)).astype(np.int64).sum(axis=-1)
+
+
+def flatten_layers(xyz_gen_heads, n):
+    """
+    Flattens XYZGenerations trees into one set of arrays per operator layer, so a whole
+    layer of the trees can be processed with array operations.
+
+    Parameters:
+        xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+        n (int): Number of qubits.
+
+    Returns:
+        List[dict]: Per layer, 'x_words' / 'z_words' (uint64, ops × words) are the masks of every
+        operator of the layer, the operators of node i are rows op_start[i] to op_start[i+1],
+        and 'node_parent' (int64, per node) is the index of the node's parent in the previous layer.
+        This is FlatTrees.layers, so frontier_z_spectrum also runs on memory-mapped FlatTrees.
+    """
+    return FlatTrees.from_trees(xyz_gen_heads, n).layers()
+
+
+def qubit_paulis(x_words, z_words, q):
+    # Index of the Pauli on qubit q of every operator, as in PAULI_INDEX
+    word, bit = divmod(q, WORD_BITS)
+    bit = np.uint64(bit)
+    return (((x_words[:, word] >> bit) & np.uint64(1)) | (((z_words[:, word] >> bit) & np.uint64(1)) << np.uint64(1))).astype(np.int64)
+
+
+def layer_transition_amplitudes(C, index, x_words, z_words, prev_x_words, prev_z_words):
+    """
+    Vectorized CompiledCircuit.op_transition_amplitude for pairs of operators.
+
+    Parameters:
+        C (CompiledCircuit): Compiled circuit.
+        index (int): Layer of the circuit between the two operators of each pair.
+        x_words, z_words (np.ndarray): Masks of the current operator of each pair.
+        prev_x_words, prev_z_words (np.ndarray): Masks of the previous operator of each pair.
+
+    Returns:
+        np.ndarray: Transition amplitude of each pair.
+    """
+    non_gate_words = np.array(mask_to_words(C.non_gate_masks[index], x_words.shape[1]), dtype=np.uint64)
+    changed = ((x_words ^ prev_x_words) | (z_words ^ prev_z_words)) & non_gate_words
+    amplitudes = np.where(np.any(changed != 0, axis=1), 0.0, 1.0)
+
+    for qubit_indices, ptm in C.layers[index]:
+        row = 0
+        col = 0
+        for q in qubit_indices:
+            row = 4*row + qubit_paulis(x_words, z_words, q)
+            col = 4*col + qubit_paulis(prev_x_words, prev_z_words, q)
+        amplitudes *= ptm[row, col]
+    return amplitudes
+
+
+def frontier_z_spectrum(C, layers, n, gamma, z_spectrum=None):
+    """
+    Same spectrum as push_tree_weights, computed a whole layer at a time over the arrays of
+    flatten_layers: each operator's weight is the sum, over the operators of its parent node,
+    of their weight times the transition amplitude, gathered from the transfer matrices for
+    every (operator, parent operator) pair at once.
+
+    Parameters:
+        C (CompiledCircuit): Compiled circuit.
+        layers (List[dict]): Output of flatten_layers, or FlatTrees.layers().
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+        z_spectrum (DefaultDict[int, float]): Spectrum to add to, a new one if None.
+
+    Returns:
+        DefaultDict[int, float]: Z-mask mapped to the summed path coefficients (without the all-'I' path).
+    """
+    if z_spectrum is None:
+        z_spectrum = defaultdict(float)
+    if not layers: # no trees
+        return z_spectrum
+
+    layer = layers[0]
+    # input overlap: 2^(-n/2) for operators with no 'X' or 'Y', else 0
+    weights = np.where(np.any(layer['x_words'] != 0, axis=1), 0.0, 2.0 ** (-n / 2))
+    weights *= (1 - gamma) ** popcount(layer['x_words'] | layer['z_words'])
+
+    for index in range(len(layers) - 1):
+        prev_layer, layer = layer, layers[index + 1]
+
+        # every operator of a node pairs with every operator of the parent node
+        op_node = np.repeat(np.arange(len(layer['node_parent'])), np.diff(layer['op_start']))
+        parent_node = layer['node_parent'][op_node]
+        first = prev_layer['op_start'][parent_node]
+        counts = prev_layer['op_start'][parent_node + 1] - first
+        pair_op = np.repeat(np.arange(len(op_node)), counts)
+        pair_parent = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+        # pairs whose parent operator carries no weight add nothing
+        live = weights[pair_parent] != 0
+        pair_op = pair_op[live]
+        pair_parent = pair_parent[live]
+
+        amplitudes = layer_transition_amplitudes(C, index,
+                                                 layer['x_words'][pair_op], layer['z_words'][pair_op],
+                                                 prev_layer['x_words'][pair_parent], prev_layer['z_words'][pair_parent])
+        weights = np.bincount(pair_op, weights=weights[pair_parent] * amplitudes, minlength=len(op_node))
+        weights *= (1 - gamma) ** popcount(layer['x_words'] | layer['z_words'])
+
+    # only the final operators with no 'X' or 'Y' reach the spectrum
+    final = np.all(layer['x_words'] == 0, axis=1) & (weights != 0)
+    masks, inverse = np.unique(layer['z_words'][final], axis=0, return_inverse=True)
+    sums = np.bincount(inverse.reshape(-1), weights=weights[final], minlength=len(masks))
+    for words, coeff in zip(masks, sums):
+        z_spectrum[words_to_mask(words)] += coeff
+
+    return z_spectrum
+
+
+def compute_noisy_z_spectrum_vectorized(C, xyz_gen_heads, n, gamma, chunk_size=4096):
+    """
+    compute_noisy_z_spectrum with the vectorized layer-frontier traversal. The roots are flattened
+    and traversed chunk_size at a time, which bounds the size of the arrays.
+
+    Parameters:
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+        xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+        chunk_size (int): Number of roots flattened at once.
+
+    Returns:
+        DefaultDict[int, float]: Z-mask mapped to the summed path coefficients, including the all-'I' path.
+    """
+    C = compile_circuit(C, n)
+
+    z_spectrum = defaultdict(float)
+    chunk = []
+    for root in xyz_gen_heads:
+        chunk.append(root)
+        if len(chunk) == chunk_size:
+            frontier_z_spectrum(C, flatten_layers(chunk, n), n, gamma, z_spectrum)
+            chunk = []
+    if chunk:
+        frontier_z_spectrum(C, flatten_layers(chunk, n), n, gamma, z_spectrum)
+
+    add_identity_path(z_spectrum, n)
+
+    return z_spectrum
+
+
+def compute_noisy_z_spectrum_from_store(C, path_store, n, gamma):
+    """
+    compute_noisy_z_spectrum for trees spilled to a PathStore. The chunks are memory-mapped
+    and traversed one at a time, so memory is bounded by the largest chunk, not by the path set.
+
+    Parameters:
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+        path_store (PathStore): Store holding the Pauli path trees.
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+
+    Returns:
+        DefaultDict[int, float]: Z-mask mapped to the summed path coefficients, including the all-'I' path.
+    """
+    C = compile_circuit(C, n)
+
+    z_spectrum = defaultdict(float)
+    for flat_trees in path_store:
+        frontier_z_spectrum(C, flat_trees.layers(), n, gamma, z_spectrum)
+
+    add_identity_path(z_spectrum, n)
+
+    return z_spectrum
@@ -1,19 +1,39 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import numpy as np
-from Pauli_Amplitude.tree_traverse_pauli_amp import compute_marginal_noisy_fourier
+from Pauli_Amplitude.fourier_spectrum import FourierSpectrum
 
 
 class MarginalSampler:
-    def __init__(self, C, sib_op_heads, n_qubits, gamma, num_samples=16):
+    def __init__(self, C, sib_op_heads, n_qubits, gamma, num_samples=16, spectrum=None, seed=None,
+                 max_cached_prefixes=1 << 16):
+        '''
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples
+        sib_op_heads (List[XYZGenerations]): Root nodes of Pauli path trees
+        n_qubits (int): Number of qubits
+        gamma (float): Depolarizing noise rate
+        num_samples (int): Number of samples drawn for sampled_probs
+        spectrum (FourierSpectrum): Already computed spectrum of the circuit, built from the trees if None
+        seed (int): Seed of the sampler's random number generator
+        max_cached_prefixes (int): Number of prefix marginals sample_batch keeps between calls
+        '''
         self.C = C
         self.sib_op_heads = sib_op_heads
         self.n = n_qubits
         self.gamma = gamma
         self.num_samples = num_samples
+        self.rng = np.random.default_rng(seed)
 
-        # Sample immediately and store normalized distribution
-        #self.sampled_probs = self.sample_many(1)  # was 2000
+        # Every marginal comes from this one traversal, rather than two traversals per qubit per sample
+        if spectrum is None:
+            spectrum = FourierSpectrum.from_trees(C, sib_op_heads, n_qubits, gamma)
+        self.spectrum = spectrum
+
+        # Prefix trie of marginals, flattened into (prefix length, prefix bits) -> p(prefix, 0)
+        # and evicted least recently used first
+        self.max_cached_prefixes = max_cached_prefixes
+        self._prefix_cache = OrderedDict()
 
+        # Sample immediately and store normalized distribution
         self.sampled_probs = self.sample_many(self.num_samples)
 
     def sample(self):
@@ -21,8 +41,7 @@ class MarginalSampler:
 
     def sample_many(self, num_samples):
         counts = defaultdict(int)
-        for _ in range(num_samples):
-            bitstring = self.sample()
+        for bitstring in unpack_samples(self.sample_batch(num_samples), self.n):
             counts[bitstring] += 1
 
         # Normalize to get probability distribution
@@ -33,48 +52,100 @@ class MarginalSampler:
         """
         Samples a full bitstring x ∈ {0,1}^n using bit-by-bit marginal sampling.
         """
-        fixed_bits = {}
+        ones_mask = 0 # bits fixed so far, bit i is qubit i
+        p_prefix = self.spectrum.prefix_marginal(0, 0) # marginal of the empty prefix, ~1
+        bits = []
         for i in range(self.n):
-            fb0 = fixed_bits.copy()
-            fb0[i] = '0'
-            fb1 = fixed_bits.copy()
-            fb1[i] = '1'
-
-            p0 = compute_marginal_noisy_fourier(self.C, self.sib_op_heads, fb0, self.n, self.gamma)
-            p1 = compute_marginal_noisy_fourier(self.C, self.sib_op_heads, fb1, self.n, self.gamma)
-            print(f'p(0) before ={p0}')
-            p0 = max(p0.real, 0)
-            print(f'p(0) after ={p0}')
-        
-            print(f'p(1) before ={p1}')
-            p1 = max(p1.real, 0)
-            print(f'p(1) after ={p1}')
-         
-            total = p0 + p1
-            
+            # only one marginal per qubit, since p(prefix,1) = p(prefix) - p(prefix,0)
+            p0 = self.spectrum.prefix_marginal(ones_mask, i+1)
+            p1 = p_prefix - p0
+
+            # truncated expansions can dip below 0
+            total = max(p0, 0) + max(p1, 0)
             if total == 0:
-                #print("total 0")
                 prob0 = 0.5
             else:
-                #print("not 0")
-                prob0 = p0 / total
-            print(f'P(0|{fb0}) = {p0:.4e}, P(1|{fb1}) = {p1:.4e}, prob0 = {prob0:.4f}')
-            
-            bit = '0' if np.random.rand() < prob0 else '1'
-            print(f'bit={bit}')
-            print()
-
-            #reversed_fb0 = {self.n - 1 - i: b for i, b in fb0.items()}
-            #p0 = compute_marginal_noisy_fourier(self.C, self.sib_op_heads,fb0, self.n, self.gamma)
-
-            #prob0 = min(max(p0, 0.0), 1.0)  # ensure in [0, 1] range
-            #print('prob0', prob0)
-            #print("bit:", bit)
-            #print(f"[DEBUG] Qubit {i}: p(0|...) = {p0:.4e}, p(1|...) = {p1:.4e}, chosen bit = {bit}")
-            fixed_bits[i] = bit
-            #print(f"Qubit {i} | p0: {p0.real:.5f} | p1: {p1.real:.5f} | prob0: {prob0:.5f} | sampled: {bit}")
-
-        #print('fixed_bits', fixed_bits)
-        #print("fixed_bits:", fixed_bits, "bitstring:", ''.join(fixed_bits[i] for i in reversed(range(self.n))), "p0:", p0.real)
-
-        return ''.join(fixed_bits[i] for i in range(self.n))
+                prob0 = max(p0, 0) / total
+
+            if self.rng.random() < prob0:
+                bits.append('0')
+                p_prefix = p0
+            else:
+                bits.append('1')
+                ones_mask |= 1 << i
+                p_prefix = p1
+
+        return ''.join(bits)
+
+    def prefix_zero_marginals(self, ones_masks, num_fixed):
+        """
+        Looks up p(prefix, 0) for each prefix of length num_fixed-1 given in ones_masks.
+        The misses are computed from the spectrum in one batch and cached.
+        """
+        p0s = np.empty(len(ones_masks))
+        missing = []
+        for j, ones_mask in enumerate(ones_masks):
+            key = (num_fixed, ones_mask)
+            if key in self._prefix_cache:
+                self._prefix_cache.move_to_end(key)
+                p0s[j] = self._prefix_cache[key]
+            else:
+                missing.append(j)
+
+        if missing:
+            computed = self.spectrum.prefix_marginals([ones_masks[j] for j in missing], num_fixed)
+            for j, p0 in zip(missing, computed):
+                p0s[j] = p0
+                self._prefix_cache[(num_fixed, ones_masks[j])] = p0
+            while len(self._prefix_cache) > self.max_cached_prefixes:
+                self._prefix_cache.popitem(last=False)
+
+        return p0s
+
+    def sample_batch(self, num_samples):
+        """
+        Samples num_samples bitstrings at once, advancing all of them one qubit at a time.
+        Samples that share a prefix share its marginal, which is computed once per distinct
+        prefix and every bit of a qubit comes from a single vectorized draw.
+
+        Parameters:
+            num_samples (int): Number of bitstrings to draw.
+
+        Returns:
+            np.ndarray: uint8 array of shape (num_samples, ceil(n/8)), the bits packed with
+            np.packbits(..., bitorder='little'), so qubit i is bit i % 8 of byte i // 8.
+        """
+        bits = np.zeros((num_samples, self.n), dtype=np.uint8)
+
+        # Distinct prefixes at the current qubit, and the prefix each sample is on
+        level_masks = [0]
+        level_probs = np.array([self.spectrum.prefix_marginal(0, 0)])
+        group = np.zeros(num_samples, dtype=np.int64)
+
+        for i in range(self.n):
+            # only one marginal per prefix, since p(prefix,1) = p(prefix) - p(prefix,0)
+            p0 = self.prefix_zero_marginals(level_masks, i+1)
+            p1 = level_probs - p0
+
+            # truncated expansions can dip below 0
+            total = np.maximum(p0, 0) + np.maximum(p1, 0)
+            prob0 = np.divide(np.maximum(p0, 0), total, out=np.full(len(total), 0.5), where=total > 0)
+
+            bits[:, i] = self.rng.random(num_samples) >= prob0[group]
+
+            # keep only the prefixes that some sample reached. The children of prefix j
+            # are 2*j (bit 0) and 2*j + 1 (bit 1)
+            reached, group = np.unique(2*group + bits[:, i], return_inverse=True)
+            level_masks = [level_masks[k >> 1] | ((k & 1) << i) for k in reached.tolist()]
+            level_probs = np.where(reached & 1, p1[reached >> 1], p0[reached >> 1])
+
+        return np.packbits(bits, axis=1, bitorder='little')
+
+
+def unpack_samples(packed, n):
+    """
+    Turns the packed output of MarginalSampler.sample_batch back into bitstrings,
+    where character i is qubit i.
+    """
+    bits = np.unpackbits(packed, axis=1, count=n, bitorder='little')
+    return [''.join('1' if b else '0' for b in row) for row in bits]
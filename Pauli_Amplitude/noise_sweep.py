@@ -0,0 +1,220 @@
+import numpy as np
+from collections import defaultdict
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Pauli_Amplitude.tree_traverse_pauli_amp import push_tree_weights, fast_walsh_hadamard, add_identity_path
+from Pauli_Amplitude.fourier_spectrum import FourierSpectrum
+
+
+def tree_path_weight(xyz_gen):
+    """
+    Total Hamming weight of the paths of one XYZGenerations tree. The 'X', 'Y', and 'Z' fillings
+    of an 'R', 'N', 'P', and 'I' path keep the weight of every operator, so all paths of a tree
+    share it and the first complete path is enough.
+
+    Parameters:
+        xyz_gen (XYZGenerations): Root of one Pauli path tree.
+
+    Returns:
+        int: Sum of the Hamming weights of the operators of a path, or None if the tree has no complete path.
+    """
+    stack = [(xyz_gen, 0)]
+    while stack:
+        node, weight = stack.pop()
+        weight += node.parent_ops[0].weight
+        if node.next_gen is None:
+            return weight
+        stack.extend((child, weight) for child in reversed(node.next_gen))
+    return None
+
+
+def compute_weighted_z_spectrum(C, xyz_gen_heads, n):
+    """
+    Noiseless version of compute_noisy_z_spectrum that keeps the paths of each total Hamming
+    weight W apart. The noise only scales a path by (1 - gamma)^W, so the spectrum at any
+    noise rate is Σ_W (1 - gamma)^W weighted_z_spectrum[W], a polynomial in gamma.
+
+    Parameters:
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+        xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+        n (int): Number of qubits.
+
+    Returns:
+        Dict[int, DefaultDict[int, float]]: Total path weight W mapped to the noiseless spectrum
+        of the paths of weight W. The all-'I' path sits at W = 0.
+    """
+    weighted_z_spectrum = {0: defaultdict(float)}
+    add_weighted_trees(compile_circuit(C, n), xyz_gen_heads, weighted_z_spectrum)
+
+    add_identity_path(weighted_z_spectrum[0], n)
+
+    return weighted_z_spectrum
+
+
+def add_weighted_trees(C, xyz_gen_heads, weighted_z_spectrum):
+    """
+    Adds the noiseless paths of every tree to the spectrum of their total weight, in place.
+
+    Parameters:
+        C (CompiledCircuit): Compiled circuit.
+        xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+        weighted_z_spectrum (Dict[int, DefaultDict[int, float]]): Total path weight mapped to a spectrum.
+    """
+    for root in xyz_gen_heads:
+        path_weight = tree_path_weight(root)
+        if path_weight is None: # a tree whose branches were all cut off adds nothing
+            continue
+        if path_weight not in weighted_z_spectrum:
+            weighted_z_spectrum[path_weight] = defaultdict(float)
+        push_tree_weights(root, C, 0.0, weighted_z_spectrum[path_weight])
+
+
+class NoiseSweep:
+    """
+    Spectrum of a circuit as a polynomial in the noise rate: row W of coeffs holds the
+    noiseless coefficients of the paths of total Hamming weight W, so the spectrum for any
+    gamma is (1 - gamma)^weights @ coeffs. The trees are traversed once for a whole sweep
+    over noise rates.
+
+    Keeping the weights apart also gives every smaller truncation for free: the paths of
+    CircuitSim(n, max_weight, gate_pos) are exactly the paths of weight at most max_weight,
+    so summing the rows up to max_weight gives the spectrum of that truncation.
+    """
+
+    def __init__(self, n, weighted_z_spectrum):
+        '''
+        n (int): Number of qubits
+        weighted_z_spectrum (Dict[int, Dict[int, float]]): Total path weight mapped to the
+        noiseless Z-mask spectrum of the paths of that weight
+        '''
+        self.n = n
+        self._set_weighted_spectrum(weighted_z_spectrum)
+
+    def _set_weighted_spectrum(self, weighted_z_spectrum):
+        self.weights = np.array(sorted(weighted_z_spectrum), dtype=float)
+        self.masks = sorted({z_mask for z_spectrum in weighted_z_spectrum.values() for z_mask in z_spectrum})
+
+        column = {z_mask: i for i, z_mask in enumerate(self.masks)}
+        self.coeffs = np.zeros((len(self.weights), len(self.masks)))
+        for row, path_weight in enumerate(sorted(weighted_z_spectrum)):
+            for z_mask, coeff in weighted_z_spectrum[path_weight].items():
+                self.coeffs[row, column[z_mask]] = coeff
+
+        self._weight_dists = None # Walsh–Hadamard transform of each row, built on first use
+
+    @classmethod
+    def from_trees(cls, C, xyz_gen_heads, n):
+        """
+        Builds the sweep with a single noiseless traversal of the Pauli path trees.
+
+        Parameters:
+            C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+            xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+            n (int): Number of qubits.
+
+        Returns:
+            NoiseSweep: The sweep, including the all-I path.
+        """
+        return cls(n, compute_weighted_z_spectrum(C, xyz_gen_heads, n))
+
+    def weighted_z_spectrum(self):
+        """
+        Inverse of the constructor: total path weight mapped to the noiseless spectrum of its paths.
+        """
+        return {int(path_weight): defaultdict(float, ((z_mask, coeff) for z_mask, coeff in zip(self.masks, row.tolist()) if coeff != 0))
+                for path_weight, row in zip(self.weights, self.coeffs)}
+
+    def extend(self, C, xyz_gen_heads):
+        """
+        Adds the paths of more trees in place, e.g. the new trees returned by CircuitSim.extend,
+        so raising the truncation only traverses the new trees.
+
+        Parameters:
+            C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+            xyz_gen_heads (List[XYZGenerations]): Root nodes of the new Pauli path trees.
+        """
+        weighted_z_spectrum = self.weighted_z_spectrum()
+        add_weighted_trees(compile_circuit(C, self.n), xyz_gen_heads, weighted_z_spectrum)
+        self._set_weighted_spectrum(weighted_z_spectrum)
+
+    def damping(self, gammas, max_weight=None):
+        """
+        (1 - gamma)^W for every noise rate and total path weight.
+
+        Parameters:
+            gammas (Iterable[float]): Depolarizing noise rates.
+            max_weight (int): If given, the weights above it get 0, truncating the paths there.
+
+        Returns:
+            np.ndarray: Array of shape (len(gammas), number of weights).
+        """
+        damping = (1 - np.asarray(gammas, dtype=float))[:, None] ** self.weights[None, :]
+        if max_weight is not None:
+            damping[:, self.weights > max_weight] = 0.0
+        return damping
+
+    def z_spectrum(self, gamma, max_weight=None):
+        """
+        Evaluates the polynomial at one noise rate.
+
+        Parameters:
+            gamma (float): Depolarizing noise rate.
+            max_weight (int): If given, only the paths of total weight at most max_weight are kept.
+
+        Returns:
+            Dict[int, float]: Z-mask mapped to its noisy coefficient, as compute_noisy_z_spectrum gives.
+        """
+        coeffs = self.damping([gamma], max_weight)[0] @ self.coeffs
+        return dict(zip(self.masks, coeffs.tolist()))
+
+    def spectrum(self, gamma, max_weight=None):
+        """
+        FourierSpectrum of the circuit at noise rate gamma, truncated at max_weight if given.
+        """
+        return FourierSpectrum(self.n, self.z_spectrum(gamma, max_weight))
+
+    def weight_distributions(self):
+        """
+        Noiseless contribution of the paths of each total weight to all 2^n outcome probabilities.
+
+        Returns:
+            np.ndarray: Array of shape (number of weights, 2^n), indexed by outcome_mask in each row.
+        """
+        if self._weight_dists is None:
+            weight_dists = np.zeros((len(self.weights), 1 << self.n))
+            weight_dists[:, self.masks] = self.coeffs
+            for row in weight_dists:
+                row[:] = fast_walsh_hadamard(row)
+            self._weight_dists = 2.0 ** (-self.n / 2) * weight_dists
+        return self._weight_dists
+
+    def distributions(self, gammas):
+        """
+        Computes q̄(C, x) for all 2^n outcomes at every noise rate in gammas. Each weight is
+        transformed once, so every further noise rate only costs a dot product per outcome.
+
+        Parameters:
+            gammas (Iterable[float]): Depolarizing noise rates.
+
+        Returns:
+            np.ndarray: Array of shape (len(gammas), 2^n), where row i, entry outcome_mask(x)
+            is the probability of x at noise rate gammas[i].
+        """
+        return self.damping(list(gammas)) @ self.weight_distributions()
+
+    def truncation_distributions(self, gamma, max_weights):
+        """
+        Computes q̄(C, x) for all 2^n outcomes at every truncation in max_weights, from the
+        cumulative sums of the per-weight contributions. One run at the largest truncation
+        replaces a CircuitSim and a traversal per truncation.
+
+        Parameters:
+            gamma (float): Depolarizing noise rate.
+            max_weights (Iterable[int]): Upper bounds on the total Hamming weight of a path.
+
+        Returns:
+            np.ndarray: Array of shape (len(max_weights), 2^n), where row i is the distribution
+            CircuitSim(n, max_weights[i], gate_pos) gives.
+        """
+        cumulative = np.cumsum(self.damping([gamma])[0][:, None] * self.weight_distributions(), axis=0)
+        rows = np.searchsorted(self.weights, np.asarray(list(max_weights), dtype=float), side='right') - 1
+        return cumulative[rows]
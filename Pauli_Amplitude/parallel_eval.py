@@ -0,0 +1,91 @@
+import multiprocessing
+from collections import defaultdict
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Pauli_Amplitude.tree_traverse_pauli_amp import push_tree_weights, traverse_tree_with_noise, add_identity_path
+
+# Trees and gate tables of a worker process, set once per worker by init_chunk_worker. With fork,
+# the initializer arguments are inherited rather than pickled, so the workers read the parent's copy
+# (copy-on-write). The parent never writes it, so concurrent calls cannot clobber each other's state
+_shared = {}
+
+
+def init_chunk_worker(C, heads, n, gamma, factorized):
+    _shared['C'] = C
+    _shared['heads'] = heads
+    _shared['n'] = n
+    _shared['gamma'] = gamma
+    _shared['factorized'] = factorized
+
+
+def _chunk_z_spectrum(chunk, C, heads, n, gamma, factorized):
+    """
+    Sums the paths of the roots in one chunk into a Z-mask spectrum.
+
+    Parameters:
+        chunk (tuple): (start, end) range of root indices.
+        C (CompiledCircuit): Compiled circuit.
+        heads (List[XYZGenerations]): Root nodes of every Pauli path tree.
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+        factorized (bool): Walk each tree with push_tree_weights.
+
+    Returns:
+        Dict[int, float]: Z-mask mapped to the summed path coefficients of the chunk.
+    """
+    start, end = chunk
+    z_spectrum = defaultdict(float)
+    for root in heads[start:end]:
+        if factorized:
+            push_tree_weights(root, C, gamma, z_spectrum)
+        else:
+            traverse_tree_with_noise(root, None, 1.0, None, -1, C, None, n, gamma, z_spectrum=z_spectrum)
+    return dict(z_spectrum)
+
+
+# Runs in a worker process, on the state set by init_chunk_worker
+def _worker_chunk_z_spectrum(chunk):
+    return _chunk_z_spectrum(chunk, **_shared)
+
+
+def compute_noisy_z_spectrum_parallel(C, xyz_gen_heads, n, gamma, workers=None, chunk_size=256, factorized=True):
+    """
+    Same as compute_noisy_z_spectrum, with the tree roots split across worker processes.
+
+    The roots are cut into chunks of chunk_size, whatever the number of workers, and the chunk
+    spectra are added up in chunk order, so the result is bit-for-bit the same for any number of
+    workers (including 1, which runs in this process).
+
+    Parameters:
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+        xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+        workers (int): Number of worker processes, all cores if None.
+        chunk_size (int): Number of roots per task.
+        factorized (bool): Walk each tree with push_tree_weights.
+
+    Returns:
+        DefaultDict[int, float]: Z-mask mapped to the summed path coefficients, including the all-'I' path.
+    """
+    state = (compile_circuit(C, n), list(xyz_gen_heads), n, gamma, factorized)
+    chunks = [(start, start + chunk_size) for start in range(0, len(state[1]), chunk_size)]
+
+    # Forking shares the trees with the workers; without fork we fall back to this process
+    if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        z_spectrum = _reduce_chunk_spectra(_chunk_z_spectrum(chunk, *state) for chunk in chunks)
+    else:
+        with multiprocessing.get_context('fork').Pool(workers, initializer=init_chunk_worker, initargs=state) as pool:
+            z_spectrum = _reduce_chunk_spectra(pool.imap(_worker_chunk_z_spectrum, chunks))
+
+    add_identity_path(z_spectrum, n)
+
+    return z_spectrum
+
+
+def _reduce_chunk_spectra(chunk_spectra):
+    # Adds the chunk spectra in chunk order, which fixes the order of every floating point sum
+    z_spectrum = defaultdict(float)
+    for chunk_spectrum in chunk_spectra:
+        for z_mask, coeff in chunk_spectrum.items():
+            z_spectrum[z_mask] += coeff
+    return z_spectrum
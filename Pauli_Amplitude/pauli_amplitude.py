@@ -3,6 +3,7 @@ from qiskit.quantum_info import Pauli, Statevector
 from qiskit import QuantumCircuit
 from qiskit.visualization import plot_histogram
 import matplotlib.pyplot as plt
+from Pauli_Amplitude.pauli_transfer import compile_circuit
 
 global_path_count = 0
 
@@ -87,17 +88,12 @@ def calculate_non_gate_transition_amplitude(sd, sd_minus_1, qubit_indices):
     if not qubit_indices:  # If empty, return 1.0
         return 1.0
         
-    # Extract relevant sub-Paulis
-    sd_sub = extract_qubit_pauli(sd, qubit_indices)
-
-    sd_minus_1_sub = extract_qubit_pauli(sd_minus_1, qubit_indices)
-    
-    # Convert to normalized matrices
-    sd_matrix = Pauli(sd_sub).to_matrix() / np.sqrt(2**len(sd_sub))
-    sd_minus_1_matrix = Pauli(sd_minus_1_sub).to_matrix() / np.sqrt(2**len(sd_minus_1_sub))
-    
-    # For non-gate qubits, the transition is just Tr(sd_sub · sd_minus_1_sub)
-    return np.trace(sd_matrix @ sd_minus_1_matrix) #.real
+    # For non-gate qubits, the transition is just Tr(sd_sub · sd_minus_1_sub),
+    # which is 1 if the normalized sub-Paulis agree and 0 otherwise
+    for q in qubit_indices:
+        if sd[q] != sd_minus_1[q]:
+            return 0.0
+    return 1.0
 
 def calculate_layer_transition_amplitude(sd, sd_minus_1, layer_gates, n_qubits):
     """
@@ -195,9 +191,9 @@ def compute_fourier_coefficient(C, s, x):
     Compute f(C, s, x) for a given circuit C and Pauli path s.
     
     Parameters:
-        C (list of list of tuples): Circuit as a list of layers,
-                                    where each layer contains tuples of gates and their acting qubits.
-                                    Example: [[(CNOT01, [0, 1]), (CNOT23, [2, 3])], ...]
+        C (list or CompiledCircuit): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+                             A raw list is compiled on every call, so compile it once with
+                             compile_circuit when computing many paths.
         s (list of str): Pauli path as a list of strings (e.g., ["IZIZ", "YIXI", "XXIX", "ZZII"]).
         x (str): Output state as a binary string (e.g., "0000").
     
@@ -210,6 +206,7 @@ def compute_fourier_coefficient(C, s, x):
     x_reversed = reverse_output_state(x)
     n = len(s[0])  # Number of qubits
     d = len(s)-1     # Depth of the circuit
+    C = compile_circuit(C, n) # no-op when the caller compiled it once for all paths
     
     # Check if path is legal (s0 and sd contain only I and Z)
     if not all(op in ['I', 'Z'] for op in s[0]) or not all(op in ['I', 'Z'] for op in s[-1]):
@@ -225,7 +222,7 @@ def compute_fourier_coefficient(C, s, x):
     transition_amplitude = 1.0
     for i in range(d):
         #layer_amplitude = calculate_layer_transition_amplitude(s[i+1], s[i], C[i], n)
-        layer_amplitude = calculate_layer_transition_amplitude(s_reversed[i+1], s_reversed[i], C[i],n)
+        layer_amplitude = C.layer_transition_amplitude(i, s_reversed[i+1], s_reversed[i])
         transition_amplitude *= layer_amplitude
         if transition_amplitude == 0:
             return 0.0
@@ -280,7 +277,7 @@ def preprocess_pauli_path(raw_path):
     return [''.join(layer) for layer in raw_path]
 
 def compute_fourier_from_raw_inputs(raw_gate_data, raw_pauli_path, output_state, n):
-    circuit_layers = preprocess_circuit_gates(raw_gate_data, n)  # Pass `n` here
+    circuit_layers = compile_circuit(preprocess_circuit_gates(raw_gate_data, n), n)  # Pass `n` here
     pauli_path_str = preprocess_pauli_path(raw_pauli_path)
     reversed_pauli_path = reverse_qubit_indices(pauli_path_str)
     reversed_output = reverse_output_state(output_state)
@@ -301,6 +298,7 @@ def compute_noisy_fourier_from_tree(C, sib_op_heads, x, n, gamma):
     Returns:
         float: Sum of Fourier coefficients over all legal Pauli paths.
     """
+    C = compile_circuit(C, n) # once for all paths
     all_paths = []
     for head in sib_op_heads:
         traverse_tree_collect_paths(head, [], all_paths)
@@ -339,6 +337,7 @@ def traverse_tree_with_noise(sib_op, path_so_far, C, x, total, n, gamma):
         total (List[float]): Single-element list used to accumulate total.
         n (int): Number of qubits.
     """
+    C = compile_circuit(C, n) # compiled on the first call, passed on compiled to the recursive ones
     global_path_count = 0
     for op in sib_op.pauli_ops:
         next_path = path_so_far + [''.join(op.operator)]
@@ -0,0 +1,99 @@
+from collections import defaultdict
+from itertools import combinations
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Pauli_Amplitude.tree_traverse_pauli_amp import add_identity_path
+
+
+def gate_transitions(qubit_indices, ptm):
+    """
+    Lists, for every Pauli string a gate can receive, the strings it can send out with their
+    transfer matrix entries, written as bit masks over the gate's qubits.
+
+    Only the transitions of legal Pauli paths are kept: all 'I's stay all 'I's, and anything
+    else goes to anything else but all 'I's, just like the 'II' -> 'II' and 'R' -> 'RI', 'IR', 'RR'
+    rules of Path_Generation.
+
+    Parameters:
+        qubit_indices (tuple): Qubits of the gate, in the order of its transfer matrix.
+        ptm (np.ndarray): Pauli transfer matrix of the gate.
+
+    Returns:
+        Dict[tuple, List[tuple]]: (x bits, z bits) of the incoming string mapped to a list of
+        (x bits, z bits, amplitude) of the outgoing strings.
+    """
+    # x and z bits over the gate's qubits of each row / column of the transfer matrix
+    index_masks = []
+    for index in range(len(ptm)):
+        x_bits = 0
+        z_bits = 0
+        for i, q in enumerate(reversed(qubit_indices)): # the first qubit is the most significant digit
+            pauli = (index >> (2*i)) & 3
+            x_bits |= (pauli & 1) << q
+            z_bits |= (pauli >> 1) << q
+        index_masks.append((x_bits, z_bits))
+
+    transitions = {index_masks[0]: [index_masks[0] + (1.0,)]}
+    for col in range(1, len(ptm)):
+        transitions[index_masks[col]] = [index_masks[row] + (float(ptm[row, col]),)
+                                         for row in range(1, len(ptm)) if ptm[row, col] != 0]
+    return transitions
+
+
+def propagate_noisy_z_spectrum(C, n, max_weight, gamma):
+    """
+    Computes the same Z-mask spectrum as compute_noisy_z_spectrum on the trees of
+    CircuitSim(n, max_weight, gate_pos), without enumerating paths. A sparse map
+    {(operator, Hamming weight so far) -> summed coefficient} is pushed through the circuit one
+    gate at a time, so paths that meet at the same operator with the same weight are merged and
+    the cost grows with the number of distinct operators per layer rather than with the number of paths.
+
+    Parameters:
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+        n (int): Number of qubits.
+        max_weight (int): Upper bound on the total Hamming weight of a Pauli path.
+        gamma (float): Depolarizing noise rate.
+
+    Returns:
+        DefaultDict[int, float]: Z-mask mapped to the summed path coefficients, including the all-'I' path.
+    """
+    C = compile_circuit(C, n)
+    num_op_layers = len(C) + 1
+    noise = [(1 - gamma) ** weight for weight in range(n + 1)]
+
+    # The first operator only holds 'I's and 'Z's, and every later layer has weight at least 1
+    states = defaultdict(float)
+    for weight in range(1, min(n, max_weight - (num_op_layers - 1)) + 1):
+        coeff = 2.0 ** (-n / 2) * noise[weight] # input overlap times noise
+        for qubits in combinations(range(n), weight):
+            states[(0, sum(1 << q for q in qubits), weight)] = coeff
+
+    for index in range(len(C)):
+        for qubit_indices, ptm in C.layers[index]:
+            gate_mask = sum(1 << q for q in qubit_indices)
+            transitions = gate_transitions(qubit_indices, ptm)
+            next_states = defaultdict(float)
+            for (x_mask, z_mask, weight), coeff in states.items():
+                kept_x = x_mask & ~gate_mask
+                kept_z = z_mask & ~gate_mask
+                for x_bits, z_bits, amplitude in transitions[(x_mask & gate_mask, z_mask & gate_mask)]:
+                    next_states[(kept_x | x_bits, kept_z | z_bits, weight)] += coeff * amplitude
+            states = next_states
+
+        # The layer is complete: add its weight and noise, and drop what no longer fits the budget
+        layers_left = num_op_layers - (index + 2)
+        next_states = defaultdict(float)
+        for (x_mask, z_mask, weight), coeff in states.items():
+            op_weight = (x_mask | z_mask).bit_count()
+            if coeff != 0 and weight + op_weight + layers_left <= max_weight:
+                next_states[(x_mask, z_mask, weight + op_weight)] += coeff * noise[op_weight]
+        states = next_states
+
+    # Only the final operators with no 'X' or 'Y' overlap with a computational basis state
+    z_spectrum = defaultdict(float)
+    for (x_mask, z_mask, weight), coeff in states.items():
+        if x_mask == 0:
+            z_spectrum[z_mask] += coeff
+
+    add_identity_path(z_spectrum, n)
+
+    return z_spectrum
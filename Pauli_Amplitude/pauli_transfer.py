@@ -0,0 +1,135 @@
+import numpy as np
+from itertools import product
+from qiskit.quantum_info import Pauli
+
+# Position of each single-qubit Pauli in the rows and columns of a Pauli transfer matrix.
+# The symplectic order makes the index of qubit q equal to x_q | z_q << 1, so it can be
+# read straight off a PauliOperator's bit masks
+PAULI_INDEX = {'I': 0, 'X': 1, 'Z': 2, 'Y': 3}
+PAULI_LABELS = 'IXZY'
+
+
+def pauli_transfer_matrix(gate):
+    """
+    Builds the Pauli transfer matrix R of a k-qubit gate, where
+    R[a, b] = Tr(P_a U P_b U†) for the normalized Paulis P_a and P_b.
+
+    Parameters:
+        gate (np.ndarray): Unitary matrix of the gate (2^k x 2^k).
+
+    Returns:
+        np.ndarray: Real 4^k x 4^k matrix. The Pauli string p_0 p_1 ... p_{k-1}
+        (in the order of the gate's qubit indices) sits at index
+        sum_i PAULI_INDEX[p_i] * 4^(k-1-i), matching extract_qubit_pauli.
+    """
+    k = int(round(np.log2(gate.shape[0])))
+    paulis = np.array([Pauli(''.join(label)).to_matrix() / np.sqrt(2**k) for label in product(PAULI_LABELS, repeat=k)])
+
+    # U P_b U† for every Pauli P_b
+    conjugated = np.einsum('ij,bjk,lk->bil', gate, paulis, gate.conj())
+
+    # Tr(P_a U P_b U†) is real since both operators are Hermitian
+    return np.einsum('aij,bji->ab', paulis, conjugated).real
+
+
+class CompiledCircuit:
+    """
+    Preprocessed circuit layers with every gate replaced by its Pauli transfer matrix,
+    so a layer transition amplitude is a product of table lookups.
+    """
+
+    def __init__(self, C, n):
+        '''
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples
+        n (int): Number of qubits
+        '''
+        self.n = n
+        self.layers = [] # per layer, a list of (qubit indices, Pauli transfer matrix) tuples
+        self.non_gate_qubits = [] # per layer, the qubits that no gate acts on
+        self.non_gate_masks = [] # per layer, the non-gate qubits as a bit mask
+
+        for layer_gates in C:
+            acted_qubits = set()
+            compiled_gates = []
+            for gate, qubit_indices in layer_gates:
+                compiled_gates.append((tuple(qubit_indices), pauli_transfer_matrix(np.asarray(gate))))
+                acted_qubits.update(qubit_indices)
+            self.layers.append(compiled_gates)
+            self.non_gate_qubits.append([i for i in range(n) if i not in acted_qubits])
+            self.non_gate_masks.append(sum(1 << i for i in self.non_gate_qubits[-1]))
+
+    def __len__(self):
+        return len(self.layers)
+
+    def layer_transition_amplitude(self, index, sd, sd_minus_1):
+        """
+        Calculates the transition amplitude between sd_minus_1 and sd through layer index.
+
+        Parameters:
+            index (int): Layer of the circuit between sd_minus_1 and sd.
+            sd (str or List[str]): Current full Pauli operator (e.g., "IZIZ").
+            sd_minus_1 (str or List[str]): Previous full Pauli operator (e.g., "XXIX").
+
+        Returns:
+            float: Product of the gates' transfer matrix entries, or 0.0 if a non-gate
+            qubit changes between the two operators.
+        """
+        # Normalized Paulis are orthonormal, so the trace over the non-gate qubits
+        # is 1 when they agree and 0 otherwise
+        for q in self.non_gate_qubits[index]:
+            if sd[q] != sd_minus_1[q]:
+                return 0.0
+
+        layer_amplitude = 1.0
+        for qubit_indices, ptm in self.layers[index]:
+            row = 0
+            col = 0
+            for q in qubit_indices:
+                row = 4*row + PAULI_INDEX[sd[q]]
+                col = 4*col + PAULI_INDEX[sd_minus_1[q]]
+            layer_amplitude *= ptm[row, col]
+            if layer_amplitude == 0:
+                return 0.0
+
+        return layer_amplitude
+
+    def op_transition_amplitude(self, index, sd, sd_minus_1):
+        """
+        Same as layer_transition_amplitude, but reads the Paulis from the bit masks of
+        two PauliOperators instead of indexing strings.
+
+        Parameters:
+            index (int): Layer of the circuit between sd_minus_1 and sd.
+            sd (PauliOperator): Current full Pauli operator.
+            sd_minus_1 (PauliOperator): Previous full Pauli operator.
+
+        Returns:
+            float: Product of the gates' transfer matrix entries, or 0.0 if a non-gate
+            qubit changes between the two operators.
+        """
+        x, z = sd.x_mask, sd.z_mask
+        prev_x, prev_z = sd_minus_1.x_mask, sd_minus_1.z_mask
+        if ((x ^ prev_x) | (z ^ prev_z)) & self.non_gate_masks[index]:
+            return 0.0
+
+        layer_amplitude = 1.0
+        for qubit_indices, ptm in self.layers[index]:
+            row = 0
+            col = 0
+            for q in qubit_indices:
+                row = 4*row + ((x >> q) & 1 | ((z >> q) & 1) << 1)
+                col = 4*col + ((prev_x >> q) & 1 | ((prev_z >> q) & 1) << 1)
+            layer_amplitude *= ptm[row, col]
+            if layer_amplitude == 0:
+                return 0.0
+
+        return layer_amplitude
+
+
+def compile_circuit(C, n):
+    """
+    Returns C as a CompiledCircuit, compiling it only if it has not been compiled yet.
+    """
+    if isinstance(C, CompiledCircuit):
+        return C
+    return CompiledCircuit(C, n)
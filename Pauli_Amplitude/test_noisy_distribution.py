@@ -0,0 +1,304 @@
+import math
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from Path_Generation.circuit_sim import CircuitSim
+from Pauli_Amplitude.test_pauli_transfer import haar_unitary
+from Pauli_Amplitude.tree_traverse_pauli_amp import compute_noisy_fourier, compute_marginal_noisy_fourier, compute_noisy_distribution, compute_noisy_z_spectrum, compute_noisy_z_spectrum_shared, outcome_mask, add_identity_path
+from Pauli_Amplitude.fourier_spectrum import FourierSpectrum
+from Pauli_Amplitude.noise_sweep import NoiseSweep
+from Pauli_Amplitude.adaptive_truncation import AdaptiveTruncation, tail_bound
+from Pauli_Amplitude.anytime_eval import AnytimeEvaluation
+from Pauli_Amplitude.marginal_sampler import MarginalSampler, unpack_samples
+from Pauli_Amplitude.parallel_eval import compute_noisy_z_spectrum_parallel
+from Pauli_Amplitude.pauli_propagation import propagate_noisy_z_spectrum
+from Pauli_Amplitude.layer_frontier import compute_noisy_z_spectrum_vectorized, compute_noisy_z_spectrum_from_store, frontier_z_spectrum
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Path_Generation.flat_trees import FlatTrees
+from Path_Generation.path_store import PathStore
+from Path_Generation.subtree_sharing import count_nodes
+
+
+class TestNoisyDistribution(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        rng = np.random.default_rng(3)
+        self.n = 4
+        self.gamma = 0.02
+        self.max_weight = 7
+        gate_pos = [[(0, 1), (2, 3)], [(1, 2)]]
+        self.C = [[(haar_unitary(4, rng), [a, b]) for a, b in layer] for layer in gate_pos]
+        self.heads = CircuitSim(self.n, self.max_weight, gate_pos).xyz_gen_heads
+        self.exact_heads = CircuitSim(self.n, 12, gate_pos).xyz_gen_heads # no truncation, so no negative probabilities
+        self.gate_pos = gate_pos
+
+    def test_single_pass_matches_per_outcome(self):
+        dist = compute_noisy_distribution(self.C, self.heads, self.n, self.gamma)
+        for i in range(1 << self.n):
+            x = format(i, f'0{self.n}b')
+            # the trees leave out the all-I path, which adds 1/2^n to every outcome
+            expected = compute_noisy_fourier(self.C, self.heads, x, self.n, self.gamma) + 1/2**self.n
+            self.assertAlmostEqual(dist[outcome_mask(x)], expected)
+        self.assertAlmostEqual(dist.sum(), 1.0)
+
+    def test_spectrum_queries(self):
+        spectrum = FourierSpectrum.from_trees(self.C, self.heads, self.n, self.gamma)
+        dist = compute_noisy_distribution(self.C, self.heads, self.n, self.gamma)
+        xs = [format(i, f'0{self.n}b') for i in range(1 << self.n)]
+        self.assertTrue(np.allclose(spectrum.probs(xs), [dist[outcome_mask(x)] for x in xs]))
+        self.assertTrue(np.allclose(spectrum.distribution(), dist))
+        self.assertAlmostEqual(spectrum.prob('0110'), dist[outcome_mask('0110')])
+
+        fixed_bits = {0: '1', 2: '0'}
+        # the trees leave out the all-I path, which adds 2^-k to a marginal over k fixed qubits
+        expected = compute_marginal_noisy_fourier(self.C, self.heads, fixed_bits, self.n, self.gamma) + 1/2**len(fixed_bits)
+        self.assertAlmostEqual(spectrum.marginal(fixed_bits), expected)
+
+    def test_factorized_spectrum(self):
+        spectrum = compute_noisy_z_spectrum(self.C, self.heads, self.n, self.gamma, factorized=False)
+        factorized = compute_noisy_z_spectrum(self.C, self.heads, self.n, self.gamma)
+        self.assertEqual(set(spectrum) - set(factorized), set())
+        for z_mask, coeff in factorized.items():
+            self.assertAlmostEqual(spectrum[z_mask], coeff)
+
+    def test_shared_subtree_spectrum(self):
+        spectrum = compute_noisy_z_spectrum(self.C, self.heads, self.n, self.gamma, factorized=False)
+        circuit = CircuitSim(self.n, self.max_weight, self.gate_pos, lazy=True)
+        circuit.share_subtrees()
+        shared = compute_noisy_z_spectrum_shared(self.C, circuit.xyz_gen_heads, self.n, self.gamma)
+        for z_mask in set(spectrum) | set(shared):
+            self.assertAlmostEqual(spectrum.get(z_mask, 0.0), shared.get(z_mask, 0.0))
+
+    def test_vectorized_spectrum(self):
+        spectrum = compute_noisy_z_spectrum(self.C, self.heads, self.n, self.gamma, factorized=False)
+        vectorized = compute_noisy_z_spectrum_vectorized(self.C, self.heads, self.n, self.gamma, chunk_size=7)
+        for z_mask in set(spectrum) | set(vectorized):
+            self.assertAlmostEqual(spectrum.get(z_mask, 0.0), vectorized.get(z_mask, 0.0))
+
+    def test_memory_mapped_trees(self):
+        spectrum = compute_noisy_z_spectrum(self.C, self.heads, self.n, self.gamma, factorized=False)
+        with tempfile.TemporaryDirectory() as directory:
+            FlatTrees.from_trees(self.heads, self.n).save(directory)
+            flat = FlatTrees.load(directory)
+            flat_spectrum = frontier_z_spectrum(compile_circuit(self.C, self.n), flat.layers(), self.n, self.gamma)
+            del flat # releases the memory maps before the directory is removed
+        add_identity_path(flat_spectrum, self.n)
+        for z_mask in set(spectrum) | set(flat_spectrum):
+            self.assertAlmostEqual(spectrum.get(z_mask, 0.0), flat_spectrum.get(z_mask, 0.0))
+
+    def test_path_store_spectrum(self):
+        spectrum = compute_noisy_z_spectrum(self.C, self.heads, self.n, self.gamma, factorized=False)
+        with tempfile.TemporaryDirectory() as directory:
+            path_store = PathStore(directory)
+            path_store.write(self.heads, self.n, roots_per_chunk=16)
+            stored = compute_noisy_z_spectrum_from_store(self.C, path_store, self.n, self.gamma)
+        for z_mask in set(spectrum) | set(stored):
+            self.assertAlmostEqual(spectrum.get(z_mask, 0.0), stored.get(z_mask, 0.0))
+
+    def test_propagated_spectrum(self):
+        spectrum = compute_noisy_z_spectrum(self.C, self.heads, self.n, self.gamma, factorized=False)
+        propagated = propagate_noisy_z_spectrum(self.C, self.n, self.max_weight, self.gamma)
+        for z_mask in set(spectrum) | set(propagated):
+            self.assertAlmostEqual(spectrum.get(z_mask, 0.0), propagated.get(z_mask, 0.0))
+
+        # and the same holds without truncation
+        dist = FourierSpectrum.from_propagation(self.C, self.n, 12, self.gamma).distribution()
+        self.assertTrue(np.allclose(dist, compute_noisy_distribution(self.C, self.exact_heads, self.n, self.gamma)))
+
+    def test_parallel_spectrum(self):
+        serial = compute_noisy_z_spectrum(self.C, self.heads, self.n, self.gamma, factorized=False)
+        spectra = [compute_noisy_z_spectrum_parallel(self.C, self.heads, self.n, self.gamma, workers, chunk_size=5)
+                   for workers in (1, 2, 3)]
+        for z_mask, coeff in serial.items():
+            self.assertAlmostEqual(spectra[0][z_mask], coeff)
+        # the chunks are reduced in a fixed order, so any worker count gives the same bits
+        self.assertEqual(spectra[0], spectra[1])
+        self.assertEqual(spectra[0], spectra[2])
+
+        # concurrent calls each keep their own trees and noise rate
+        gammas = [0.0, self.gamma, 0.2, 0.3]
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6) # switch threads often, so the calls interleave
+        try:
+            with ThreadPoolExecutor(len(gammas)) as pool:
+                concurrent = list(pool.map(lambda gamma: compute_noisy_z_spectrum_parallel(self.C, self.heads, self.n, gamma, 1, chunk_size=1),
+                                           gammas))
+        finally:
+            sys.setswitchinterval(switch_interval)
+        for gamma, spectrum in zip(gammas, concurrent):
+            self.assertEqual(spectrum, compute_noisy_z_spectrum_parallel(self.C, self.heads, self.n, gamma, 1, chunk_size=1))
+
+    def test_gate_aware_trees(self):
+        cnot = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]])
+        cz = np.diag([1, 1, 1, -1])
+        C = compile_circuit([[(cnot, [0, 1]), (cz, [2, 3])], [(cnot, [1, 2])]], self.n)
+        full = CircuitSim(self.n, self.max_weight, self.gate_pos)
+        heads = full.xyz_gen_heads
+        circuit = CircuitSim(self.n, self.max_weight, self.gate_pos, compiled_circuit=C)
+        self.assertLess(len(circuit.xyz_pauli_paths), len(full.xyz_pauli_paths))
+        parallel = CircuitSim(self.n, self.max_weight, self.gate_pos, workers=2, compiled_circuit=C)
+        self.assertEqual(count_nodes(parallel.xyz_gen_heads), count_nodes(circuit.xyz_gen_heads))
+
+        # lazy generation skips the same dead roots, here and when the truncation is raised
+        lazy = CircuitSim(self.n, self.max_weight - 1, self.gate_pos, lazy=True, compiled_circuit=C)
+        eager = CircuitSim(self.n, self.max_weight - 1, self.gate_pos, compiled_circuit=C)
+        self.assertEqual(len(list(lazy.iter_xyz_trees())), len(eager.xyz_gen_heads))
+        self.assertEqual(len(list(lazy.extend(self.max_weight))), len(eager.extend(self.max_weight)))
+        self.assertEqual(len(list(lazy.iter_xyz_trees())), len(circuit.xyz_gen_heads))
+        self.assertEqual(sorted(tuple(op.operator for op in path) for path in lazy.iter_paths()),
+                         sorted(tuple(op.operator for op in path) for path in circuit.xyz_pauli_paths))
+
+        # only zero-amplitude paths are skipped
+        spectrum = compute_noisy_z_spectrum(C, heads, self.n, self.gamma)
+        pruned = compute_noisy_z_spectrum(C, circuit.xyz_gen_heads, self.n, self.gamma)
+        for z_mask in set(spectrum) | set(pruned):
+            self.assertAlmostEqual(spectrum.get(z_mask, 0.0), pruned.get(z_mask, 0.0))
+
+        # Haar random gates have no zero entries, so nothing is skipped
+        haar = CircuitSim(self.n, self.max_weight, self.gate_pos, compiled_circuit=compile_circuit(self.C, self.n))
+        self.assertEqual(count_nodes(haar.xyz_gen_heads), count_nodes(heads))
+
+    def test_noise_sweep(self):
+        sweep = NoiseSweep.from_trees(self.C, self.heads, self.n)
+        gammas = [0.0, 0.01, 0.02, 0.1]
+        dists = sweep.distributions(gammas)
+        for gamma, dist in zip(gammas, dists):
+            spectrum = compute_noisy_z_spectrum(self.C, self.heads, self.n, gamma)
+            swept = sweep.z_spectrum(gamma)
+            for z_mask in set(spectrum) | set(swept):
+                self.assertAlmostEqual(spectrum.get(z_mask, 0.0), swept.get(z_mask, 0.0))
+            self.assertTrue(np.allclose(dist, compute_noisy_distribution(self.C, self.heads, self.n, gamma)))
+
+    def test_truncation_sweep(self):
+        sweep = NoiseSweep.from_trees(self.C, self.heads, self.n)
+        max_weights = list(range(3, self.max_weight + 1))
+        dists = sweep.truncation_distributions(self.gamma, max_weights)
+        for max_weight, dist in zip(max_weights, dists):
+            heads = CircuitSim(self.n, max_weight, self.gate_pos).xyz_gen_heads
+            self.assertTrue(np.allclose(dist, compute_noisy_distribution(self.C, heads, self.n, self.gamma)))
+            self.assertTrue(np.allclose(sweep.spectrum(self.gamma, max_weight).distribution(), dist))
+
+    def test_extended_spectrum(self):
+        circuit = CircuitSim(self.n, 5, self.gate_pos)
+        spectrum = FourierSpectrum.from_trees(self.C, circuit.xyz_gen_heads, self.n, self.gamma)
+        sweep = NoiseSweep.from_trees(self.C, circuit.xyz_gen_heads, self.n)
+        new_heads = circuit.extend(self.max_weight)
+        spectrum.extend(self.C, new_heads, self.gamma)
+        sweep.extend(self.C, new_heads)
+
+        expected = compute_noisy_distribution(self.C, self.heads, self.n, self.gamma)
+        self.assertTrue(np.allclose(spectrum.distribution(), expected))
+        self.assertTrue(np.allclose(sweep.distributions([self.gamma])[0], expected))
+
+    def test_adaptive_truncation(self):
+        adaptive = AdaptiveTruncation(self.C, self.n, self.gate_pos, 0.2, 0.05)
+        self.assertIsNone(adaptive.spectrum) # nothing is generated before run
+        adaptive.run()
+        self.assertIn(adaptive.stop_reason, ('bound', 'converged'))
+        self.assertEqual([max_weight for max_weight, _ in adaptive.step_sizes], list(range(4, adaptive.max_weight + 1)))
+        self.assertEqual(adaptive.error_bound, tail_bound(self.n, 0.2, adaptive.max_weight, 3))
+
+        # the same spectrum as a circuit built at the chosen truncation
+        heads = CircuitSim(self.n, adaptive.max_weight, self.gate_pos).xyz_gen_heads
+        self.assertTrue(np.allclose(adaptive.spectrum.distribution(), compute_noisy_distribution(self.C, heads, self.n, 0.2)))
+
+        limited = AdaptiveTruncation(self.C, self.n, self.gate_pos, self.gamma, 1e-9, max_weight_limit=self.max_weight)
+        spectrum = limited.run()
+        self.assertEqual((limited.stop_reason, limited.max_weight), ('limit', self.max_weight))
+        self.assertTrue(np.allclose(spectrum.distribution(), compute_noisy_distribution(self.C, self.heads, self.n, self.gamma)))
+
+        # without noise only the limit can stop the run
+        with self.assertRaises(ValueError):
+            AdaptiveTruncation(self.C, self.n, self.gate_pos, 0.0, 0.05)
+        noiseless = AdaptiveTruncation(self.C, self.n, self.gate_pos, 0.0, 0.05, max_weight_limit=5)
+        noiseless.run()
+        self.assertEqual((noiseless.stop_reason, noiseless.max_weight, noiseless.estimated_tail), ('limit', 5, math.inf))
+
+    def test_anytime_evaluation(self):
+        complete = AnytimeEvaluation(self.C, self.n, self.gate_pos, self.gamma, max_weight=self.max_weight)
+        spectrum = complete.run()
+        self.assertEqual((complete.stop_reason, complete.completed_weight), ('complete', self.max_weight))
+        self.assertEqual(complete.num_trees, len(self.heads))
+        self.assertTrue(np.allclose(spectrum.distribution(), compute_noisy_distribution(self.C, self.heads, self.n, self.gamma)))
+        self.assertEqual(complete.error_bound, tail_bound(self.n, self.gamma, self.max_weight, 3))
+
+        # out of budget before the first tree, only the all-I path is in
+        for budget, reason in (({'time_budget': 0}, 'time'), ({'memory_budget': 1}, 'memory')):
+            partial = AnytimeEvaluation(self.C, self.n, self.gate_pos, self.gamma, **budget)
+            self.assertEqual(partial.run().masks, [0])
+            self.assertEqual((partial.stop_reason, partial.completed_weight, partial.num_trees), (reason, 2, 0))
+
+        cancelled = AnytimeEvaluation(self.C, self.n, self.gate_pos, self.gamma)
+        canceller = threading.Thread(target=cancelled.cancel)
+        canceller.start()
+        canceller.join()
+        cancelled.run()
+        self.assertEqual(cancelled.stop_reason, 'cancelled')
+        cancelled.run() # the cancellation only stops one run
+        self.assertEqual(cancelled.stop_reason, 'complete')
+
+        # stopped partway through the weight-5 trees, which are dropped again, so the spectrum and its
+        # bound are exactly those of the truncation at weight 4
+        class StopAfterTrees(AnytimeEvaluation):
+            def _interruption(self, deadline, check_budgets=True):
+                self.num_checks = getattr(self, 'num_checks', 0) + 1
+                return 'cancelled' if self.num_checks > 1 + 12 + 10 + 5 else None # 12 trees of weight 3, 10 of weight 4
+        stopped = StopAfterTrees(self.C, self.n, self.gate_pos, self.gamma)
+        stopped_spectrum = stopped.run()
+        truncated = AnytimeEvaluation(self.C, self.n, self.gate_pos, self.gamma, max_weight=4)
+        truncated_spectrum = truncated.run()
+        self.assertEqual((stopped.stop_reason, stopped.completed_weight, stopped.num_trees), ('cancelled', 4, 22))
+        self.assertEqual(stopped_spectrum.masks, truncated_spectrum.masks)
+        self.assertTrue(np.allclose(stopped_spectrum.coeffs, truncated_spectrum.coeffs))
+        self.assertEqual(stopped.error_bound, truncated.error_bound)
+
+        # an event shared with a scheduler stays set until the scheduler clears it
+        cancel_event = threading.Event()
+        cancel_event.set()
+        shared = AnytimeEvaluation(self.C, self.n, self.gate_pos, self.gamma, cancel_event=cancel_event)
+        shared.run()
+        self.assertTrue(cancel_event.is_set())
+
+    def test_prefix_marginal(self):
+        spectrum = FourierSpectrum.from_trees(self.C, self.heads, self.n, self.gamma)
+        for ones_mask in range(1 << 3):
+            fixed_bits = {i: str((ones_mask >> i) & 1) for i in range(3)}
+            self.assertAlmostEqual(spectrum.prefix_marginal(ones_mask, 3), spectrum.marginal(fixed_bits))
+
+    def test_marginal_sampler(self):
+        sampler = MarginalSampler(self.C, self.exact_heads, self.n, self.gamma, num_samples=20000, seed=5)
+        dist = sampler.spectrum.distribution()
+        tvd = 0.5 * sum(abs(sampler.sampled_probs.get(x, 0) - dist[outcome_mask(x)])
+                        for x in (format(i, f'0{self.n}b') for i in range(1 << self.n)))
+        self.assertLess(tvd, 0.05)
+
+    def test_sample_batch(self):
+        sampler = MarginalSampler(self.C, self.exact_heads, self.n, self.gamma, num_samples=0, seed=9)
+        packed = sampler.sample_batch(1000)
+        self.assertEqual(packed.dtype, np.uint8)
+        self.assertEqual(packed.shape, (1000, 1))
+        self.assertLessEqual(len(sampler._prefix_cache), 2**self.n) # one marginal per distinct prefix
+
+        # the same seed gives the same samples
+        again = MarginalSampler(self.C, self.exact_heads, self.n, self.gamma, num_samples=0, spectrum=sampler.spectrum, seed=9)
+        self.assertTrue(np.array_equal(again.sample_batch(1000), packed))
+        self.assertTrue(all(len(x) == self.n for x in unpack_samples(packed, self.n)))
+
+    def test_spectrum_save_load(self):
+        wide = FourierSpectrum(70, {0: 0.5, (1 << 69) | 1: -0.25, 1 << 64: 0.125}) # wider than one word
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'spectrum.npz')
+            wide.save(path)
+            loaded = FourierSpectrum.load(path)
+        self.assertEqual(loaded.masks, wide.masks)
+        self.assertTrue(np.array_equal(loaded.coeffs, wide.coeffs))
+        x = (1 << 69) | (1 << 3)
+        self.assertAlmostEqual(loaded.prob(x) * 2.0**35, 0.5 + 0.25 + 0.125)
+
+
+if __name__ == '__main__':
+    unittest.main()
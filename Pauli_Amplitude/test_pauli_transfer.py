@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+from itertools import product
+from Pauli_Amplitude.pauli_transfer import CompiledCircuit, pauli_transfer_matrix
+from Pauli_Amplitude.tree_traverse_pauli_amp import calculate_layer_transition_amplitude
+from Pauli_Amplitude.pauli_amplitude import compute_fourier_coefficient
+from Path_Generation.pauli_operator import PauliOperator
+
+
+def haar_unitary(dim, rng):
+    z = (rng.standard_normal((dim, dim)) + 1j*rng.standard_normal((dim, dim))) / np.sqrt(2)
+    q, r = np.linalg.qr(z)
+    return q * (np.diag(r) / np.abs(np.diag(r)))
+
+
+class TestPauliTransfer(unittest.TestCase):
+    @classmethod
+    def setUpClass(self):
+        rng = np.random.default_rng(7)
+        self.n = 4
+        self.C = [
+            [(haar_unitary(4, rng), [3, 2]), (haar_unitary(4, rng), [1, 0])],
+            [(haar_unitary(4, rng), [2, 1])],
+        ]
+        self.compiled = CompiledCircuit(self.C, self.n)
+
+    def test_ptm_is_real_orthogonal(self):
+        for layer in self.compiled.layers:
+            for _, ptm in layer:
+                self.assertEqual(ptm.shape, (16, 16))
+                self.assertTrue(np.allclose(ptm @ ptm.T, np.eye(16)))
+                self.assertAlmostEqual(ptm[0, 0], 1.0) # II always maps to II
+
+    def test_cnot_table(self):
+        cnot = np.array([[1,0,0,0],[0,1,0,0],[0,0,0,1],[0,0,1,0]])
+        ptm = pauli_transfer_matrix(cnot)
+        # The first qubit is the control, so an X on it spreads to XX
+        self.assertAlmostEqual(ptm[4*1 + 1, 4*1 + 0], 1.0)
+        self.assertAlmostEqual(ptm[4*1 + 0, 4*1 + 0], 0.0)
+
+    def test_matches_matrix_traces(self):
+        rng = np.random.default_rng(11)
+        ops = [''.join(p) for p in product('IXYZ', repeat=self.n)]
+        for index in range(len(self.C)):
+            for _ in range(300):
+                sd = ops[rng.integers(len(ops))]
+                sd_minus_1 = ops[rng.integers(len(ops))]
+                expected = calculate_layer_transition_amplitude(sd, sd_minus_1, self.C[index], self.n)
+                self.assertAlmostEqual(self.compiled.layer_transition_amplitude(index, sd, sd_minus_1), expected.real)
+
+    def test_masks_match_strings(self):
+        rng = np.random.default_rng(13)
+        ops = [''.join(p) for p in product('IXYZ', repeat=self.n)]
+        for index in range(len(self.C)):
+            for _ in range(300):
+                sd = ops[rng.integers(len(ops))]
+                sd_minus_1 = ops[rng.integers(len(ops))]
+                self.assertEqual(self.compiled.op_transition_amplitude(index, PauliOperator(list(sd)), PauliOperator(list(sd_minus_1))),
+                                 self.compiled.layer_transition_amplitude(index, sd, sd_minus_1))
+
+    def test_raw_circuit_is_compiled(self):
+        rng = np.random.default_rng(17)
+        ops = [''.join(p) for p in product('IXYZ', repeat=self.n)]
+        end_ops = [''.join(p) for p in product('IZ', repeat=self.n)]
+        for _ in range(50):
+            s = [end_ops[rng.integers(len(end_ops))], ops[rng.integers(len(ops))], end_ops[rng.integers(len(end_ops))]]
+            # a raw gate list is compiled by the entry point instead of being rejected
+            self.assertEqual(compute_fourier_coefficient(self.C, s, '0110'), compute_fourier_coefficient(self.compiled, s, '0110'))
+
+if __name__ == '__main__':
+    unittest.main()
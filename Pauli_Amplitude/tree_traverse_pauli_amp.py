@@ -4,7 +4,9 @@ from qiskit import QuantumCircuit
 from qiskit.visualization import plot_histogram
 import matplotlib.pyplot as plt
 import copy
+from collections import defaultdict
 from typing import Set
+from Pauli_Amplitude.pauli_transfer import compile_circuit
 
 import pdb # my debugging bestie
 
@@ -85,17 +87,12 @@ def calculate_non_gate_transition_amplitude(sd, sd_minus_1, qubit_indices):
     if not qubit_indices:  # If empty, return 1.0
         return 1.0
         
-    # Extract relevant sub-Paulis
-    sd_sub = extract_qubit_pauli(sd, qubit_indices)
-
-    sd_minus_1_sub = extract_qubit_pauli(sd_minus_1, qubit_indices)
-    
-    # Convert to normalized matrices
-    sd_matrix = Pauli(sd_sub).to_matrix() / np.sqrt(2**len(sd_sub))
-    sd_minus_1_matrix = Pauli(sd_minus_1_sub).to_matrix() / np.sqrt(2**len(sd_minus_1_sub))
-    
-    # For non-gate qubits, the transition is just Tr(sd_sub · sd_minus_1_sub)
-    return np.trace(sd_matrix @ sd_minus_1_matrix) #.real
+    # For non-gate qubits, the transition is just Tr(sd_sub · sd_minus_1_sub),
+    # which is 1 if the normalized sub-Paulis agree and 0 otherwise
+    for q in qubit_indices:
+        if sd[q] != sd_minus_1[q]:
+            return 0.0
+    return 1.0
 
 def calculate_layer_transition_amplitude(sd, sd_minus_1, layer_gates, n_qubits):
     """
@@ -378,11 +375,81 @@ def traverse_tree_with_noise(sib, fourier_coeffs_for_paths, cur_fourier, prev_op
 '''
 
 
+def calculate_input_overlap_masks(s0):
+    """
+    Calculate Tr(s0 |0^n><0^n|) from the bit masks of a PauliOperator.
+
+    Parameters:
+        s0 (PauliOperator): Initial Pauli operator.
+
+    Returns:
+        float: Input overlap, 0.0 unless s0 only holds 'I's and 'Z's.
+    """
+    if s0.x_mask: # an 'X' or 'Y' somewhere
+        return 0.0
+    return 2.0 ** (-len(s0) / 2) # Python floats, since 2**n overflows NumPy ints past 63 qubits
+
+def outcome_mask(x):
+    """
+    Packs a bitstring so that bit i of the returned int is x[i].
+    """
+    return int(x[::-1], 2)
+
+def calculate_output_overlap_masks(x, sd):
+    """
+    Calculate Tr(|x><x| s_d) from the bit masks of a PauliOperator.
+
+    Parameters:
+        x (str or int): Output state as a binary string, or already packed with outcome_mask.
+        sd (PauliOperator): Final Pauli operator.
+
+    Returns:
+        float: Output overlap.
+    """
+    if sd.x_mask:
+        return 0.0
+    if isinstance(x, str):
+        x = outcome_mask(x)
+
+    # each 'Z' that meets a '1' flips the sign
+    sign = -1 if (sd.z_mask & x).bit_count() & 1 else 1
+    return sign * 2.0 ** (-len(sd) / 2)
+
+def calculate_partial_overlap_masks(fixed_bits, sd):
+    """
+    Tr(sd ⋅ (⨂_{i ∈ T} |x_i⟩⟨x_i| ⊗ ⨂_{j ∉ T} I)) from Lemma 9, from the bit masks of a PauliOperator.
+
+    Parameters:
+        fixed_bits (Dict[int, str]): Fixed qubits T mapped to their bit.
+        sd (PauliOperator): Final Pauli operator.
+
+    Returns:
+        float: Marginal measurement term for the fixed qubits.
+    """
+    n = len(sd)
+    k = len(fixed_bits)
+    fixed_mask = 0
+    ones_mask = 0
+    for i, b in fixed_bits.items():
+        fixed_mask |= 1 << i
+        if b == '1':
+            ones_mask |= 1 << i
+
+    # Tr(X or Y) = 0, and so is Tr(Z) over a qubit we sum out
+    if sd.x_mask or sd.z_mask & ~fixed_mask:
+        return 0.0
+
+    sign = -1 if (sd.z_mask & ones_mask).bit_count() & 1 else 1
+    return sign * 2.0 ** (-n / 2) * 2.0 ** (n - k)
+
+
 def compute_marginal_noisy_fourier(C, xyz_gen_heads, fixed_bits, n, gamma):
     """
     Computes ∑_{x ∈ {0,1}^n: x_T = fixed_bits} q̄(C, x) as per Lemma 9.
     """
 
+    C = compile_circuit(C, n) # gate transfer matrices are built once for every path
+
     fourier_coeffs_for_paths = []
     #visited_roots = set()  
 
@@ -405,6 +472,99 @@ def compute_marginal_noisy_fourier(C, xyz_gen_heads, fixed_bits, n, gamma):
     return sum(fourier_coeffs_for_paths)
 
 
+def add_identity_path(z_spectrum, n):
+    """
+    Adds the all-'I' path, which the trees and frontiers leave out, to a Z spectrum.
+    Every gate maps II to II, so only the input overlap is left, on the Z-mask 0.
+
+    Parameters:
+        z_spectrum (DefaultDict[int, float]): Z-mask mapped to the summed path coefficients.
+        n (int): Number of qubits.
+
+    Returns:
+        DefaultDict[int, float]: The same z_spectrum, with the all-'I' path added.
+    """
+    z_spectrum[0] += 2.0 ** (-n / 2)
+    return z_spectrum
+
+
+def compute_noisy_z_spectrum(C, xyz_gen_heads, n, gamma, factorized=True):
+    """
+    Traverses every XYZGenerations tree once and sums the noisy coefficient of each path
+    into a bucket keyed by the Z-mask of its final operator.
+
+    Parameters:
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+        xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+        factorized (bool): Push the weights of sibling operators through each node once
+            (push_tree_weights). If False, walks every subtree once per parent operator, which
+            is much slower and only kept as an independent reference for the tests.
+
+    Returns:
+        DefaultDict[int, float]: Z-mask (bit i is qubit i) mapped to the summed path coefficients,
+        including the all-'I' path that the trees leave out.
+        Then q̄(C, x) = 2^(-n/2) Σ_z spectrum[z] (-1)^|z ∧ x|.
+    """
+    C = compile_circuit(C, n) # gate transfer matrices are built once for every path
+
+    z_spectrum = defaultdict(float)
+    for root in xyz_gen_heads:
+        if factorized:
+            push_tree_weights(root, C, gamma, z_spectrum)
+        else:
+            traverse_tree_with_noise(root, None, 1.0, None, -1, C, None, n, gamma, z_spectrum=z_spectrum)
+
+    add_identity_path(z_spectrum, n)
+
+    return z_spectrum
+
+
+def fast_walsh_hadamard(values):
+    """
+    Computes H[x] = Σ_z values[z] (-1)^|z ∧ x| for every x with n·2^n additions.
+
+    Parameters:
+        values (np.ndarray): Array of length 2^n indexed by mask.
+
+    Returns:
+        np.ndarray: The transformed array, indexed by mask.
+    """
+    transformed = np.array(values, dtype=float)
+    size = len(transformed)
+    half = 1
+    while half < size:
+        # pairs masks that differ only in the bit worth half
+        blocks = transformed.reshape(-1, 2, half)
+        transformed = np.stack((blocks[:, 0] + blocks[:, 1], blocks[:, 0] - blocks[:, 1]), axis=1).reshape(-1)
+        half *= 2
+    return transformed
+
+
+def compute_noisy_distribution(C, xyz_gen_heads, n, gamma):
+    """
+    Computes q̄(C, x) for all 2^n outcomes with a single traversal of the trees,
+    instead of one traversal per outcome.
+
+    Parameters:
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+        xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees.
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+
+    Returns:
+        np.ndarray: Array of length 2^n, where entry outcome_mask(x) is the probability of x.
+    """
+    z_spectrum = compute_noisy_z_spectrum(C, xyz_gen_heads, n, gamma)
+
+    dense_spectrum = np.zeros(1 << n)
+    for z_mask, coeff in z_spectrum.items():
+        dense_spectrum[z_mask] = coeff
+
+    return fast_walsh_hadamard(dense_spectrum) * 2.0 ** (-n / 2)
+
+
 def compute_noisy_fourier(C, xyz_gen_heads, x, n, gamma):
     #pdb.set_trace()
     """
@@ -422,6 +582,9 @@ def compute_noisy_fourier(C, xyz_gen_heads, x, n, gamma):
 
     #x = reverse_output_state(x) # reverse the output state to match Qiskit
     
+    C = compile_circuit(C, n) # gate transfer matrices are built once for every path
+    x = outcome_mask(x) # packed once, rather than at every leaf
+
     total = 0.0 # probability for this state
     fourier_coeffs_for_paths = [] # all fourier coefficients for paths ending at this state
 
@@ -468,7 +631,7 @@ def build_list(xyz_gen, fourier_coeffs_for_paths, cur_fourier, op_list, index, C
                 build_list(next_gen, fourier_coeffs_for_paths, cur_fourier, this_op_list, index+1, C, x, n, gamma)
 
 def traverse_tree_with_noise(xyz_gen, fourier_coeffs_for_paths, cur_fourier, prev_op, index, C, x, n, gamma, 
-                             fixed_bits=None):
+                             fixed_bits=None, z_spectrum=None):
     """
     Recursively traverse a XYZGenerations tree to accumulate Fourier coefficient contributions.
 
@@ -483,45 +646,35 @@ def traverse_tree_with_noise(xyz_gen, fourier_coeffs_for_paths, cur_fourier, pre
 
     for op in xyz_gen.parent_ops:
 
-
-        cur_op = op.operator #[::-1] # reverses the operator to match Qiskit
-
-        if prev_op == []:
-            layer_amplitude = calculate_input_overlap(cur_op)
+        if index < 0: # first operator of the path
+            layer_amplitude = calculate_input_overlap_masks(op)
 
         else:
-            layer_amplitude = calculate_layer_transition_amplitude(
-                cur_op, 
-                prev_op,
-                C[index],
-                n
-            )
+            layer_amplitude = C.op_transition_amplitude(index, op, prev_op)
         
-        #print(f"[DEBUG] amplitude {layer_amplitude} at depth {index+1} with ops: {prev_op} → {cur_op}")
+        #print(f"[DEBUG] amplitude {layer_amplitude} at depth {index+1} with ops: {prev_op} → {op}")
  
         # ask how the reversal comes into play
         branched_cur_fourier = cur_fourier * layer_amplitude
 
         # each non-identity Pauli is affected by the depolarizing noise
         # E(ρ) := (1 − γ)ρ + γ(I/2)Tr(ρ)
-        ham_weight = sum(p != 'I' for p in cur_op) # accounting for noise
-        branched_cur_fourier *= (1 - gamma) ** ham_weight
-        
-        cur_op_tuple = tuple(cur_op)
-        key = (index, cur_op_tuple)
-        #if key in visited:
-        #    return
-        #visited.add(key)
-        #print(f"[DEBUG] depth {index+1} | cur_op = {cur_op}, prev_op = {prev_op}")
-        #MAX_DEPTH = len(C)
+        branched_cur_fourier *= (1 - gamma) ** op.weight # accounting for noise
 
         if xyz_gen.next_gen is None:
-            #print(f"[DEBUG] FINAL layer | cur_op = {cur_op}")
+            #print(f"[DEBUG] FINAL layer | cur_op = {op}")
+
+            if z_spectrum is not None:
+                # only the sign of Tr(|x><x| s_d) depends on x, so we bucket the path by the
+                # 'Z's of its final operator and leave the overlap to the Walsh–Hadamard transform
+                if op.x_mask == 0 and branched_cur_fourier != 0:
+                    z_spectrum[op.z_mask] += branched_cur_fourier
+                continue
 
             if fixed_bits is not None:
-                final_fourier = branched_cur_fourier * calculate_partial_overlap(fixed_bits, cur_op)
+                final_fourier = branched_cur_fourier * calculate_partial_overlap_masks(fixed_bits, op)
             else:
-                final_fourier = branched_cur_fourier * calculate_output_overlap(x, cur_op)
+                final_fourier = branched_cur_fourier * calculate_output_overlap_masks(x, op)
 
             if final_fourier != 0:
                 fourier_coeffs_for_paths.append(final_fourier)
@@ -529,18 +682,19 @@ def traverse_tree_with_noise(xyz_gen, fourier_coeffs_for_paths, cur_fourier, pre
 
         else:
             for xyz_child in xyz_gen.next_gen:
-                #print(f"[RECURSE] Going deeper: index = {index+1}, cur_op = {cur_op}")
+                #print(f"[RECURSE] Going deeper: index = {index+1}, cur_op = {op}")
                 traverse_tree_with_noise(
                         xyz_child,
                         fourier_coeffs_for_paths,
                         branched_cur_fourier,
-                        cur_op,
+                        op,
                         index + 1,
                         C,
                         x,
                         n,
                         gamma,
                         fixed_bits,
+                        z_spectrum,
                     )
     def calculate_partial_overlap(fixed_bits, sd):
         """Tr(sd ⋅ (⨂_{i ∈ T} |x_i⟩⟨x_i| ⊗ ⨂_{j ∉ T} I)) from Lemma 9. 
@@ -559,3 +713,123 @@ def traverse_tree_with_noise(xyz_gen, fourier_coeffs_for_paths, cur_fourier, pre
                     return 0.0
                 
         return sign * (1 / np.sqrt(2 ** n)) * (2 ** (n - k))
+
+
+def push_tree_weights(xyz_gen, C, gamma, z_spectrum):
+    """
+    Sibling-factorized version of traverse_tree_with_noise for the Z-mask spectrum. Instead of
+    walking every child subtree once per parent operator, the parents' weights are pushed layer
+    by layer: each child operator gets the sum over the parent operators of their weight times
+    the transition amplitude, and every node of the tree is then visited exactly once.
+
+    Parameters:
+        xyz_gen (XYZGenerations): Root of one Pauli path tree.
+        C (CompiledCircuit): Compiled circuit.
+        gamma (float): Depolarizing noise rate.
+        z_spectrum (DefaultDict[int, float]): Z-mask mapped to summed path coefficients, added to in place.
+    """
+    # each node of the frontier comes with one accumulated weight per operator in parent_ops
+    frontier = [(xyz_gen, [calculate_input_overlap_masks(op) * (1 - gamma) ** op.weight
+                           for op in xyz_gen.parent_ops])]
+    index = 0 # circuit layer between the frontier and its children
+
+    while frontier:
+        next_frontier = []
+        for node, weights in frontier:
+            live = [(op, weight) for op, weight in zip(node.parent_ops, weights) if weight != 0]
+            if not live: # nothing below this node can contribute, so a lazy node is never expanded
+                continue
+
+            next_gen = node.take_next_gen() # a lazy tree is let go of layer by layer as the frontier moves on
+            if next_gen is None:
+                for op, weight in live:
+                    if op.x_mask == 0:
+                        z_spectrum[op.z_mask] += weight
+                continue
+
+            for child in next_gen:
+                child_weights = []
+                for child_op in child.parent_ops:
+                    weight = 0.0
+                    for op, parent_weight in live:
+                        weight += parent_weight * C.op_transition_amplitude(index, child_op, op)
+                    child_weights.append(weight * (1 - gamma) ** child_op.weight)
+                next_frontier.append((child, child_weights))
+
+        frontier = next_frontier
+        index += 1
+
+
+def suffix_z_spectra(xyz_gen, index, C, gamma, memo):
+    """
+    Computes, for every operator s in xyz_gen.parent_ops, the Z-mask spectrum of all path suffixes
+    that start with s: its noise factor times, over the children, the transition amplitude into each
+    child operator times that operator's suffix spectrum. The result only depends on the subtree,
+    so it is memoized per node, and a subtree shared by several parents (see share_subtrees in
+    Path_Generation) is computed once.
+
+    Parameters:
+        xyz_gen (XYZGenerations): Current node.
+        index (int): Circuit layer between this node's operators and its children's.
+        C (CompiledCircuit): Compiled circuit.
+        gamma (float): Depolarizing noise rate.
+        memo (dict): id of a node mapped to its suffix spectra.
+
+    Returns:
+        List[Dict[int, float]]: One spectrum per operator in xyz_gen.parent_ops.
+    """
+    suffixes = memo.get(id(xyz_gen))
+    if suffixes is not None:
+        return suffixes
+
+    suffixes = []
+    for op in xyz_gen.parent_ops:
+        suffix = defaultdict(float)
+        noise = (1 - gamma) ** op.weight
+        if xyz_gen.next_gen is None:
+            if op.x_mask == 0: # only 'I's and 'Z's overlap with a computational basis state
+                suffix[op.z_mask] = noise
+        else:
+            for child in xyz_gen.next_gen:
+                child_suffixes = suffix_z_spectra(child, index + 1, C, gamma, memo)
+                for child_op, child_suffix in zip(child.parent_ops, child_suffixes):
+                    amplitude = C.op_transition_amplitude(index, child_op, op)
+                    if amplitude == 0:
+                        continue
+                    for z_mask, coeff in child_suffix.items():
+                        suffix[z_mask] += noise * amplitude * coeff
+        suffixes.append(suffix)
+
+    memo[id(xyz_gen)] = suffixes
+    return suffixes
+
+
+def compute_noisy_z_spectrum_shared(C, xyz_gen_heads, n, gamma):
+    """
+    compute_noisy_z_spectrum that memoizes the suffix spectrum of every node with suffix_z_spectra,
+    which pays off when the trees have been turned into a DAG by share_subtrees.
+
+    Parameters:
+        C (list): Preprocessed circuit as layers of (unitary, [qubits]) tuples.
+        xyz_gen_heads (List[XYZGenerations]): Root nodes of Pauli path trees or DAG.
+        n (int): Number of qubits.
+        gamma (float): Depolarizing noise rate.
+
+    Returns:
+        DefaultDict[int, float]: Z-mask mapped to the summed path coefficients, including the all-'I' path.
+    """
+    C = compile_circuit(C, n)
+
+    z_spectrum = defaultdict(float)
+    memo = {} # the nodes stay alive in the DAG, so their ids are stable
+    for root in xyz_gen_heads:
+        for op, suffix in zip(root.parent_ops, suffix_z_spectra(root, 0, C, gamma, memo)):
+            input_overlap = calculate_input_overlap_masks(op)
+            if input_overlap == 0:
+                continue
+            for z_mask, coeff in suffix.items():
+                z_spectrum[z_mask] += input_overlap * coeff
+
+    add_identity_path(z_spectrum, n)
+
+    return z_spectrum
@@ -8,7 +8,10 @@ import pdb
 from Brute_Force_RCS.evaluation_utils import total_variation_distance, calculate_true_distribution, compute_xeb, tvd_truedist_empdist, xeb_truedist_empdist_noisy, classical_fidelity
 from Brute_Force_RCS.circuit_utils import  complete_distribution, run_noisy_simulation, create_noise_model, reverse_keys, generate_emp_distribution
 from Pauli_Amplitude.list_pauli_amp import compute_fourier_from_raw_inputs, preprocess_circuit_gates
-from Pauli_Amplitude.tree_traverse_pauli_amp import compute_noisy_fourier
+from Pauli_Amplitude.tree_traverse_pauli_amp import compute_noisy_fourier, outcome_mask
+from Pauli_Amplitude.fourier_spectrum import FourierSpectrum
+from Pauli_Amplitude.noise_sweep import NoiseSweep
+from Pauli_Amplitude.pauli_transfer import compile_circuit
 from qiskit import circuit
 import itertools
 # pip3 install memory-profiler requests
@@ -20,7 +23,9 @@ class GetProbDist:
     """
     
     """
-    def __init__(self, circuit_sim:CircuitSim,gates:List, num_qubs:int, depth:int, QC:circuit, noise_rate:float=0):
+    def __init__(self, circuit_sim:CircuitSim,gates:List, num_qubs:int, depth:int, QC:circuit, noise_rate:float=0,
+                 single_pass:bool=True, workers:int=None, noise_sweep:NoiseSweep=None, max_weight:int=None,
+                 spectrum:FourierSpectrum=None):
 
         '''
         circuit (CircuitSim): A fully initiated CircuitSim object based on our circuit architecture
@@ -28,24 +33,48 @@ class GetProbDist:
         the second item is the gate matrix, and the third item is a tuple of the gate positions
         QC (circuit): quantum circuit generated using Qiskit
         noise_rate: single-qubit depolarizing noise (γ in the research paper)
+        single_pass: if True, traverses the Pauli path trees once and gets every outcome from a
+        Walsh–Hadamard transform; otherwise traverses them once per outcome
+        workers: number of processes the single pass splits the tree roots across (None walks them here)
+        noise_sweep: if given (NoiseSweep.from_trees on the same trees and gates), the single pass
+        evaluates it at noise_rate instead of traversing the trees, so a sweep over noise rates
+        traverses them only once
+        max_weight: with noise_sweep, keeps only the paths of total Hamming weight at most max_weight,
+        so a sweep over truncations only needs the trees of the largest one
+        spectrum: if given (built from the same trees, gates, and noise_rate, e.g. by AdaptiveTruncation),
+        the single pass uses it as is
         '''
         self.depth = depth
         self.n = num_qubs
 
         #test on this one, right now the values aren't looking right 
-        self.pauli_ops_to_strs(circuit_sim.xyz_pauli_paths) # initializes self.s_list, which contains all pauli paths
+        if circuit_sim.lazy: # the paths are streamed, so we don't hold them all as strs
+            self.s_list = None
+        elif single_pass or noise_sweep is not None or spectrum is not None: # these never read the strs, and
+            self.s_list = None # building them costs a pass over every path, e.g. once per truncation of a sweep
+        else:
+            self.pauli_ops_to_strs(circuit_sim.xyz_pauli_paths) # initializes self.s_list, which contains all pauli paths
 
         #self.C = gates
         self.C = preprocess_circuit_gates(gates, self.n) # list of tuples, containing the layer of each gate, the matrix, and the qubit indicices its acting on
+        self.C = compile_circuit(self.C, self.n) # Pauli transfer matrix of each gate, built once for all outcomes
         self.probs = DefaultDict(float) # hash function mapping outcomes to their probabilities
         
 
         # tree roots for Pauli path traversal
         self.sib_op_heads = circuit_sim.xyz_gen_heads
+        if circuit_sim.lazy:
+            # a single pass only walks the trees once, so they can be built as they are reached
+            self.sib_op_heads = circuit_sim.iter_xyz_trees() if single_pass else list(circuit_sim.iter_xyz_trees())
 
         self.bruteForceQC = QC
 
         self.noise_rate = noise_rate
+        self.single_pass = single_pass
+        self.workers = workers
+        self.noise_sweep = noise_sweep
+        self.max_weight = max_weight
+        self.spectrum = spectrum
         
         self.calc_noisy_prob_dist()
     
@@ -65,12 +94,26 @@ class GetProbDist:
       
 
       self.other_probs = DefaultDict(float) # hash function mapping outcomes to their probabilities
+
+      if self.single_pass and self.spectrum is not None: # already traversed
+        dist = self.spectrum.distribution()
+      elif self.single_pass and self.noise_sweep is not None: # no traversal at all
+        self.spectrum = self.noise_sweep.spectrum(self.noise_rate, self.max_weight)
+        dist = self.spectrum.distribution()
+      elif self.single_pass: # one traversal, all outcomes at once (the all-I path is already included)
+        self.spectrum = FourierSpectrum.from_trees(self.C, self.sib_op_heads, self.n, self.noise_rate,
+                                                   workers=self.workers)
+        dist = self.spectrum.distribution()
+
       for i in range(1 << self.n):
         x = format(i, f'0{self.n}b') # possible outcome of the circuit, represented as a string of 1's and 0's
    
-        self.probs[x] = compute_noisy_fourier(self.C, self.sib_op_heads, x, self.n, self.noise_rate)
-        self.probs[x] += compute_fourier_from_raw_inputs(self.C, 
-                        [["I" for _ in range(self.n)] for _ in range(len(self.C)+1)], x, self.n)
+        if self.single_pass:
+          self.probs[x] = dist[outcome_mask(x)]
+        else:
+          self.probs[x] = compute_noisy_fourier(self.C, self.sib_op_heads, x, self.n, self.noise_rate)
+          self.probs[x] += compute_fourier_from_raw_inputs(self.C, 
+                          [["I" for _ in range(self.n)] for _ in range(len(self.C)+1)], x, self.n)
         if (self.probs[x].real < 0):
            self.probs[x] = 0
            
@@ -172,7 +215,7 @@ class GetProbDist:
         self.s_list = [[] for _ in range(len(xyz_pauli_paths)+1)]
         for i in range(len(xyz_pauli_paths)):
           for pauli_op in xyz_pauli_paths[i]:
-              self.s_list[i].append(pauli_op.operator)
+              self.s_list[i].append(list(pauli_op.operator))
 
 
         # accounting for the fact that we excluded the all I's case from our path generation
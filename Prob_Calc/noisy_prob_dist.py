@@ -1,8 +1,12 @@
 from typing import List, Tuple, DefaultDict
 from collections import defaultdict
 from Path_Generation.circuit_sim import CircuitSim
+from Path_Generation.path_cache import PathCache
 from Brute_Force_RCS import circuit_utils
 from Prob_Calc.get_prob_dist import GetProbDist
+from Pauli_Amplitude.adaptive_truncation import AdaptiveTruncation
+from Pauli_Amplitude.list_pauli_amp import preprocess_circuit_gates
+from Pauli_Amplitude.pauli_transfer import compile_circuit
 from qiskit import circuit
 from itertools import product
 from Brute_Force_RCS.evaluation_utils import total_variation_distance, calculate_true_distribution, compute_xeb
@@ -23,11 +27,18 @@ class NoisyProbDist:
   The circuit is represented as a QuantumCircuit object from Qiskit.
   """
 
-  def __init__(self, num_qubits:int, depth:int, truncation_param:int, noise_rate=0.001):
+  def __init__(self, num_qubits:int, depth:int, truncation_param:int=None, noise_rate=0.001, path_cache:PathCache=None,
+               epsilon:float=0.01):
     self.n = num_qubits # must be at least 3
     self.d = depth
     
-    self.l = (self.d+1)*self.n - truncation_param
+    # Without a truncation_param, the truncation is picked by AdaptiveTruncation for a target error of epsilon.
+    # It streams the trees of one weight at a time and never holds a whole path set, so it has nothing
+    # to read from or write to a path_cache
+    self.auto_truncation = truncation_param is None
+    if self.auto_truncation and path_cache is not None:
+      raise ValueError("A path_cache only applies to a fixed truncation_param, the automatic truncation does not use it.")
+    self.l = None if self.auto_truncation else (self.d+1)*self.n - truncation_param
 
     self.bruteForceQC = circuit_utils.random_circuit(self.n, self.d) # Qiskit Representation of a random circuit.
 
@@ -51,12 +62,27 @@ class NoisyProbDist:
 
     print()
     print(f'Noise rate: {noise_rate}')
-    print(f'Truncation parameter: {truncation_param}')
 
     start = time.time()
 
-    circuit = CircuitSim(self.n, self.l, gate_pos) # 1D architecuture
-    self.prob_dist = GetProbDist(circuit, gates, self.n, self.d, self.bruteForceQC, noise_rate)
+    if self.auto_truncation:
+      # raises the truncation one weight at a time, lightest paths first, until the omitted tail is below epsilon
+      C = compile_circuit(preprocess_circuit_gates(gates, self.n), self.n)
+      self.adaptive_truncation = AdaptiveTruncation(C, self.n, gate_pos, noise_rate, epsilon)
+      self.adaptive_truncation.run()
+      self.l = self.adaptive_truncation.max_weight
+      self.error_bound = self.adaptive_truncation.error_bound
+      truncation_param = (self.d+1)*self.n - self.l
+      print(f'Truncation parameter: {truncation_param} (chosen for epsilon = {epsilon}, stopped on {self.adaptive_truncation.stop_reason})')
+      print(f'Error bound: {self.error_bound}, estimated tail: {self.adaptive_truncation.estimated_tail}')
+      circuit = self.adaptive_truncation.circuit
+      self.prob_dist = GetProbDist(circuit, gates, self.n, self.d, self.bruteForceQC, noise_rate,
+                                   spectrum=self.adaptive_truncation.spectrum)
+    else:
+      print(f'Truncation parameter: {truncation_param}')
+      circuit = CircuitSim(self.n, self.l, gate_pos, path_cache) # 1D architecuture, reuses cached paths if given
+      self.prob_dist = GetProbDist(circuit, gates, self.n, self.d, self.bruteForceQC, noise_rate)
+    self.truncation_param = truncation_param
 
     end = time.time()
     self.duration = end - start
@@ -5,6 +5,9 @@ from collections import defaultdict
 from Pauli_Path_Method.Pauli_Amplitude.Path_Generation.circuit_sim import CircuitSim
 from Brute_Force_RCS import circuit_utils
 from Lemma_8.get_prob_dist import GetProbDist
+from Pauli_Amplitude.noise_sweep import NoiseSweep
+from Pauli_Amplitude.pauli_transfer import compile_circuit
+from Pauli_Amplitude.list_pauli_amp import preprocess_circuit_gates
 from qiskit import circuit
 from itertools import product
 from Brute_Force_RCS.evaluation_utils import total_variation_distance, calculate_true_distribution, compute_xeb
@@ -136,30 +139,39 @@ class TestEverything(unittest.TestCase):
       filename = f"MeasuringTVDVaryingTruncation{numQubits}Qubits_{depth}Depth_{noise}Noise"
       filepath = os.path.join(filename)
 
+      truncations = list(range(trunc_start, trunc_end + 1, trunc_step))
+      tvds = defaultdict(list)
+      for _ in range(5):  # average over 5 samples
+          C = circuit_utils.random_circuit(numQubits, depth)
+          gates = circuit_utils.extract_gates_info(C)
+
+          gate_pos = []
+          for g in gates:
+              layer = g[2]
+              while len(gate_pos) <= layer:
+                  gate_pos.append([])
+              a, b = g[1]
+              gate_pos[layer].append((numQubits - a - 1, numQubits - b - 1))
+
+          # the paths of every smaller truncation are among those of the largest one, so the
+          # trees are built and traversed once per sample rather than once per truncation.
+          # Unlike drawing new circuits for every truncation, every truncation is averaged over
+          # the same 5 circuits: each average still estimates the mean TVD over random circuits,
+          # but the averages of different truncations are no longer independent, and their
+          # differences only reflect the truncation, not which circuits were drawn
+          circuit = CircuitSim(numQubits, truncations[-1], gate_pos)
+          noise_sweep = NoiseSweep.from_trees(compile_circuit(preprocess_circuit_gates(gates, numQubits), numQubits),
+                                              circuit.xyz_gen_heads, numQubits)
+          warnings.filterwarnings("ignore", category=DeprecationWarning)
+          for truncation in truncations:
+              probDist = GetProbDist(circuit, gates, numQubits, depth, C, noise,
+                                     noise_sweep=noise_sweep, max_weight=truncation)
+              tvds[truncation].append(probDist.tvd)
+
       with open(filepath, "w") as f:
           f.write("truncation,average_tvd\n")
-
-          for truncation in range(trunc_start, trunc_end + 1, trunc_step):
-              tvds = []
-              for _ in range(5):  # average over 5 samples
-                  C = circuit_utils.random_circuit(numQubits, depth)
-                  gates = circuit_utils.extract_gates_info(C)
-
-                  gate_pos = []
-                  for g in gates:
-                      layer = g[2]
-                      while len(gate_pos) <= layer:
-                          gate_pos.append([])
-                      a, b = g[1]
-                      gate_pos[layer].append((numQubits - a - 1, numQubits - b - 1))
-
-                  circuit = CircuitSim(numQubits, truncation, gate_pos)
-                  warnings.filterwarnings("ignore", category=DeprecationWarning)
-                  probDist = GetProbDist(circuit, gates, numQubits, depth, C, noise)
-
-                  tvds.append(probDist.tvd)
-
-              avg_tvd = sum(tvds) / len(tvds)
+          for truncation in truncations:
+              avg_tvd = sum(tvds[truncation]) / len(tvds[truncation])
               f.write(f"{truncation},{avg_tvd}\n")
 
   def plot_tvd_varying_truncation(